@@ -0,0 +1,60 @@
+"""
+Throughput of the random configuration sampler.
+
+    python3 -m benchmarks.bench_sampler -n 200000 --check 2000
+
+Reports valid configs per second, uniform and biased toward a synthetic SOI corridor,
+and optionally re-checks a subset with the TestValidator rules used for LLM configs.
+"""
+import argparse
+import logging
+import time
+import numpy as np
+from distance_field import DistanceField
+from sampler import ConfigSampler
+from test_validator import TestValidator
+
+# obstacle-free flight of the case studies: straight from the start area to the far side
+SYNTHETIC_SOI = np.stack([np.linspace(-10.0, 5.0, 200), np.linspace(11.0, 38.0, 200)], axis=1)
+
+
+def measure(sampler, n):
+    sampler.sample(min(n, 1000))  # warm up
+    start = time.perf_counter()
+    batch = sampler.sample(n)
+    elapsed = time.perf_counter() - start
+    return batch, n / elapsed, sampler.accepted / sampler.drawn
+
+
+def check(batch, validator):
+    invalid = 0
+    for obstacles in ConfigSampler.to_obstacles(batch):
+        if (
+            not validator.check_within_boundary(obstacles)
+            or validator.any_overlap(obstacles)
+            or not all(obs["size"]["h"] > 10 and obs["position"]["z"] == 0 for obs in obstacles)
+        ):
+            invalid += 1
+    return invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Random configuration sampler benchmark")
+    parser.add_argument("-n", type=int, default=100000, help="number of configs to sample")
+    parser.add_argument("--obstacles", type=int, default=2, help="obstacles per config")
+    parser.add_argument("--check", type=int, default=0, help="configs re-checked with TestValidator")
+    args = parser.parse_args()
+
+    field = DistanceField(SYNTHETIC_SOI)
+    validator = TestValidator(logging.getLogger(__name__))
+    print(f"{'sampler':<12}{'configs/s':>14}{'acceptance':>12}{'blocked':>10}{'invalid':>10}")
+    for name, path in (("uniform", None), ("corridor", field.path)):
+        sampler = ConfigSampler(n_obstacles=args.obstacles, path=path, rng_seed=0)
+        batch, rate, acceptance = measure(sampler, args.n)
+        blocked = field.blocked_fraction(batch[:10000]).mean()
+        invalid = check(batch[:args.check], validator) if args.check else "-"
+        print(f"{name:<12}{rate:>14,.0f}{acceptance:>12.2f}{blocked:>10.2f}{invalid:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Per-test setup cost of building a TestCase for a mission.
+
+    python3 -m benchmarks.bench_test_setup case_studies/mission1.yaml -n 2000
+
+Compares the previous setup (parse the mission YAML + deepcopy for every test)
+with a template parsed once per run and the copy-on-write TestCase.
+"""
+import argparse
+import copy
+import time
+import tracemalloc
+from aerialist.px4.aerialist_test import AerialistTest
+from testcase import TestCase
+from utils.helper import Helper
+
+OBSTACLES = [
+    {"size": {"l": 20, "w": 2, "h": 20}, "position": {"x": -5, "y": 12, "z": 0, "r": 0}},
+    {"size": {"l": 10, "w": 5, "h": 15}, "position": {"x": 5, "y": 30, "z": 0, "r": 45}},
+]
+
+
+def parse_and_deepcopy(mission, template, obstacles):
+    test = copy.deepcopy(AerialistTest.from_yaml(mission))
+    test.simulation.obstacles = obstacles
+    return test
+
+
+def template_deepcopy(mission, template, obstacles):
+    test = copy.deepcopy(template)
+    test.simulation.obstacles = obstacles
+    return test
+
+
+def copy_on_write(mission, template, obstacles):
+    return TestCase(template, obstacles).test
+
+
+def measure(setup, mission, template, n):
+    obstacles = Helper.to_px4_obstacles(OBSTACLES)
+    start = time.perf_counter()
+    for _ in range(n):
+        setup(mission, template, obstacles)
+    elapsed = time.perf_counter() - start
+
+    # memory retained when n tests are kept alive (as test_cases does)
+    tracemalloc.start()
+    kept = [setup(mission, template, obstacles) for _ in range(n)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return elapsed / n * 1e6, current / n, peak / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TestCase setup benchmark")
+    parser.add_argument("mission", help="mission yaml (e.g. case_studies/mission1.yaml)")
+    parser.add_argument("-n", type=int, default=1000, help="number of tests to build")
+    args = parser.parse_args()
+
+    template = AerialistTest.from_yaml(args.mission)
+    print(f"{'setup':<22}{'us/test':>12}{'bytes/test':>14}{'peak bytes/test':>18}")
+    for setup in (parse_and_deepcopy, template_deepcopy, copy_on_write):
+        us, retained, peak = measure(setup, args.mission, template, args.n)
+        print(f"{setup.__name__:<22}{us:>12.1f}{retained:>14.0f}{peak:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Synthetic fixtures of the micro-benchmarks: PX4 flight logs, missions, obstacle
+configs, results.csv files and LLM replies of any size, generated from a seed so two
+runs of the suite time the same inputs.
+"""
+import json
+import os
+import struct
+import numpy as np
+import yaml
+from constraints import RANGES
+from flight_monitor import ULOG_MAGIC
+from utils.helper import Helper
+
+RESULTS_COL = ["Iteration", "distance", "time", "obs1-size", "obs1-position", "obs2-size", "obs2-position", "novelty"]
+
+
+def _message(kind, payload):
+    return struct.pack("<HB", len(payload), ord(kind)) + payload
+
+
+def write_ulog(path, samples, rate_hz=50, noise_topics=2):
+    """
+    ULog of a synthetic flight: samples vehicle_local_position messages at rate_hz along
+    a curved path, interleaved with noise_topics other topics the readers have to skip.
+    """
+    header = ULOG_MAGIC + b"\x01" + struct.pack("<Q", 0)
+    out = [header, _message("B", bytes(40))]
+    out.append(_message("F", b"vehicle_local_position:uint64_t timestamp;float x;float y;float z;float vx;float vy;float vz;"))
+    for i in range(noise_topics):
+        out.append(_message("F", f"noise_{i}:uint64_t timestamp;float[8] values;".encode("ascii")))
+    out.append(_message("I", b"\x0bchar[4] ver" + b"sitl"))
+    out.append(_message("A", struct.pack("<BH", 0, 0) + b"vehicle_local_position"))
+    for i in range(noise_topics):
+        out.append(_message("A", struct.pack("<BH", 0, i + 1) + f"noise_{i}".encode("ascii")))
+    t = np.arange(samples, dtype=np.uint64) * np.uint64(1_000_000 // rate_hz) + np.uint64(1_000_000)
+    s = np.linspace(0.0, 1.0, samples)
+    x, y, z = -10.0 + 15.0 * s, 11.0 + 27.0 * s + 3.0 * np.sin(6 * s), -5.0 * np.ones(samples)
+    position = struct.Struct("<HQ6f")
+    noise = struct.Struct("<HQ8f")
+    for i in range(samples):
+        out.append(_message("D", position.pack(0, int(t[i]), x[i], y[i], z[i], 1.0, 1.0, 0.0)))
+        for j in range(noise_topics):
+            out.append(_message("D", noise.pack(j + 1, int(t[i]), *([float(i)] * 8))))
+    with open(path, "wb") as f:
+        f.write(b"".join(out))
+    return path
+
+
+def obstacle(rng, **ranges):
+    def draw(name):
+        low, high = ranges.get(name, RANGES[name])
+        return round(float(rng.uniform(low, high)), 1)
+
+    return {
+        "size": {"l": draw("l"), "w": draw("w"), "h": max(10.5, draw("h"))},
+        "position": {"x": draw("x"), "y": draw("y"), "z": 0, "r": draw("r")},
+    }
+
+
+def obstacle_config(n, rng=None, spread=True):
+    """
+    n obstacles, spread=True lays small ones out on a grid (no overlap, the validators
+    go through every pair), otherwise they are drawn anywhere in RANGES.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    if not spread:
+        return [obstacle(rng) for _ in range(n)]
+    side = int(np.ceil(np.sqrt(n)))
+    step_x, step_y = 60.0 / side, 26.0 / side
+    obstacles = []
+    for i in range(n):
+        cx, cy = -35.0 + (i % side + 0.5) * step_x, 12.0 + (i // side + 0.5) * step_y
+        size = max(RANGES["l"][0], min(step_x, step_y) / 3)
+        # crowded grids keep the footprints axis aligned so they never touch
+        turn = (0, 90) if min(step_x, step_y) >= 3 * size else (0, 0)
+        obstacles.append(obstacle(rng, x=(cx, cx), y=(cy, cy), l=(size, size), w=(size, size), r=turn))
+    return obstacles
+
+
+def write_mission(folder, waypoints):
+    """Mission YAML referencing a QGC plan of waypoints and a params file (hashed by get_mission_hash)."""
+    os.makedirs(folder, exist_ok=True)
+    plan = os.path.join(folder, "mission.plan")
+    items = [
+        {"command": 16, "params": [0, 0, 0, None, 47.39 + i * 1e-5, 8.54 + i * 1e-5, 5], "type": "SimpleItem"}
+        for i in range(waypoints)
+    ]
+    with open(plan, "w", encoding="utf-8") as f:
+        json.dump({"fileType": "Plan", "mission": {"items": items}}, f)
+    params = os.path.join(folder, "params.csv")
+    with open(params, "w", encoding="utf-8") as f:
+        f.write("name,value\n" + "".join(f"PARAM_{i},{i}\n" for i in range(waypoints)))
+    mission = os.path.join(folder, "mission.yaml")
+    with open(mission, "w", encoding="utf-8") as f:
+        yaml.safe_dump({
+            "drone": {"port": "ros", "params_file": params, "mission_file": plan},
+            "simulation": {"simulator": "ros", "speed": 1, "headless": True},
+        }, f)
+    return mission
+
+
+def write_results(path, rows, rng=None):
+    """results.csv of a run with rows simulated configs (Helper.best_worse_fitness input)."""
+    rng = rng if rng is not None else np.random.default_rng(0)
+    if os.path.isfile(path):
+        os.remove(path)
+    for i in range(rows):
+        o1, o2 = obstacle_config(2, rng, spread=False)
+        Helper.write_csv(
+            RESULTS_COL,
+            [i, round(float(rng.uniform(0, 10)), 3), round(float(rng.uniform(20, 90)), 1),
+             o1["size"], o1["position"], o2["size"], o2["position"], round(float(rng.uniform(0, 5)), 2)],
+            path,
+        )
+    return path
+
+
+def replies(n_configs, rng=None):
+    """The same configs as the three reply formats parse_reply accepts."""
+    rng = rng if rng is not None else np.random.default_rng(0)
+    data = {"configs": [{"obstacles": obstacle_config(2, rng, spread=False)} for _ in range(n_configs)]}
+    return {
+        "json": json.dumps(data),
+        "fenced": "Here are the configs:\n```json\n" + json.dumps(data, indent=2) + "\n```",
+        "yaml": yaml.safe_dump(data),
+    }
+
+
+class StubTrajectory:
+    """Stands in for the aerialist Trajectory of TestCase.get_distances: XY polyline, numpy distances."""
+
+    def __init__(self, samples):
+        s = np.linspace(0.0, 1.0, samples)
+        self.xy = np.stack([-10.0 + 15.0 * s, 11.0 + 27.0 * s + 3.0 * np.sin(6 * s)], axis=1)
+
+    def min_distance_to_obstacles(self, obstacles):
+        best = float("inf")
+        for o in obstacles:
+            r = np.radians(o.position.r)
+            dx, dy = self.xy[:, 0] - o.position.x, self.xy[:, 1] - o.position.y
+            u = np.abs(dx * np.cos(r) + dy * np.sin(r)) - o.size.l / 2
+            v = np.abs(dy * np.cos(r) - dx * np.sin(r)) - o.size.w / 2
+            best = min(best, float(np.hypot(np.maximum(u, 0), np.maximum(v, 0)).min()))
+        return best
@@ -0,0 +1,197 @@
+"""
+Micro-benchmarks of the Python hot paths on synthetic fixtures of growing size.
+
+    python3 -m benchmarks.suite --save              record benchmarks/baseline.json
+    python3 -m benchmarks.suite                     compare, exit 1 on a regression
+    python3 -m benchmarks.suite -k read_ulg --quick only some benchmarks, small sizes
+
+Without a baseline file the comparison fails (exit 2), unless --allow-missing-baseline.
+
+A benchmark regresses when its median time exceeds the baseline median by more than
+its threshold (the per-benchmark "threshold" of the baseline file, --threshold
+otherwise). The baseline is machine specific: record it on the machine that checks it.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks import fixtures
+from reply_parser import parse_reply, seeds_schema
+from test_validator import TestValidator
+from testcase import TestCase
+from utils.helper import Helper
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# relative slowdown of the median tolerated before a benchmark fails
+THRESHOLD = 0.25
+
+ULOG_SAMPLES = (1_000, 10_000, 100_000)
+OBSTACLES = (2, 16, 128)
+WAYPOINTS = (10, 1_000, 50_000)
+RESULT_ROWS = (10, 1_000, 20_000)
+REPLY_CONFIGS = (1, 10, 200)
+TRAJECTORY_SAMPLES = (1_000, 100_000)
+
+
+def benchmarks(tmp, quick=False, keep=lambda name: True):
+    """
+    (name, callable) of the benchmarks keep() selects, the fixtures are built before anything
+    is timed, and only for the selected benchmarks.
+    """
+    pick = (lambda sizes: sizes[:2]) if quick else (lambda sizes: sizes)
+    wanted = lambda *names: any(keep(name) for name in names)
+    validator = TestValidator(logging.getLogger(__name__))
+    # every fixture draws from its own generator, so it does not depend on the benchmarks selected
+    rng = lambda *key: np.random.default_rng(key)
+
+    for n in pick(ULOG_SAMPLES):
+        if wanted(f"read_ulg[{n}]", f"get_flight_time[{n}]"):
+            path = fixtures.write_ulog(os.path.join(tmp, f"flight_{n}.ulg"), n)
+            yield f"read_ulg[{n}]", lambda path=path: Helper.read_ulg(path, 30)
+            yield f"get_flight_time[{n}]", lambda path=path: Helper.get_flight_time(path)
+
+    for n in pick(WAYPOINTS):
+        if wanted(f"get_mission_hash[{n}]"):
+            mission = fixtures.write_mission(os.path.join(tmp, f"mission_{n}"), n)
+            yield f"get_mission_hash[{n}]", lambda mission=mission: Helper.get_mission_hash(mission, {"AGENT": "docker"})
+
+    for n in pick(OBSTACLES):
+        if wanted(f"get_hash[{n}]"):
+            config = {"obstacles": fixtures.obstacle_config(n, rng(1, n))}
+            yield f"get_hash[{n}]", lambda config=config: Helper.get_hash(config)
+
+    for n in pick(RESULT_ROWS):
+        if wanted(f"best_worse_fitness[{n}]"):
+            path = fixtures.write_results(os.path.join(tmp, f"results_{n}.csv"), n, rng(2, n))
+            yield f"best_worse_fitness[{n}]", lambda path=path: Helper.best_worse_fitness(path)
+
+    for n in pick(REPLY_CONFIGS):
+        if wanted(*(f"parse_reply_{kind}[{n}]" for kind in ("json", "fenced", "yaml"))):
+            schema = seeds_schema(n)
+            for kind, text in fixtures.replies(n, rng(3, n)).items():
+                yield f"parse_reply_{kind}[{n}]", lambda text=text, schema=schema: parse_reply(text, schema)
+
+    checks = ("any_overlap", "obstacles_overlap", "check_within_boundary", "check_obstacle_parameter_ranges",
+              "check_based_and_min_height")
+    for n in pick(OBSTACLES):
+        if wanted(*(f"{check}[{n}]" for check in checks)):
+            obstacles = fixtures.obstacle_config(n, rng(4, n))
+            yield f"any_overlap[{n}]", lambda obstacles=obstacles: validator.any_overlap(obstacles)
+            yield f"obstacles_overlap[{n}]", lambda obstacles=obstacles: [
+                validator.obstacles_overlap(a, b) for a, b in zip(obstacles, obstacles[1:])
+            ]
+            yield f"check_within_boundary[{n}]", lambda obstacles=obstacles: validator.check_within_boundary(obstacles)
+            yield f"check_obstacle_parameter_ranges[{n}]", lambda obstacles=obstacles: validator.check_obstacle_parameter_ranges(obstacles)
+            yield f"check_based_and_min_height[{n}]", lambda obstacles=obstacles: validator.check_based_and_min_height(obstacles)
+
+    for n in pick(TRAJECTORY_SAMPLES):
+        for k in pick(OBSTACLES)[:2]:
+            if not wanted(f"get_distances[{n}x{k}]"):
+                continue
+            test = TestCase.__new__(TestCase)
+            test.test = type("Test", (), {})()
+            test.test.simulation = type("Simulation", (), {})()
+            test.test.simulation.obstacles = Helper.to_px4_obstacles(fixtures.obstacle_config(k, rng(5, n, k)))
+            test.trajectory = fixtures.StubTrajectory(n)
+            yield f"get_distances[{n}x{k}]", test.get_distances
+
+
+def measure(fn, repeat=7, min_time=0.05):
+    """Median/min seconds per call, the call count of a repeat is raised until it lasts min_time."""
+    fn()  # warm up (imports, caches)
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= max(2, int(min_time / max(elapsed, 1e-9)))
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {"median_s": statistics.median(times), "min_s": min(times), "number": number, "repeat": repeat}
+
+
+def compare(results, baseline, threshold):
+    """(name, current, baseline, ratio, limit) of the regressions."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        limit = reference.get("threshold", threshold)
+        ratio = result["median_s"] / reference["median_s"]
+        if ratio > 1 + limit:
+            regressions.append((name, result["median_s"], reference["median_s"], ratio, limit))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks with a regression baseline")
+    parser.add_argument("-k", default="", help="only the benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="skip the largest fixture sizes")
+    parser.add_argument("--repeat", type=int, default=7, help="timed repeats per benchmark")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file (JSON)")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="default relative slowdown tolerated")
+    parser.add_argument("--allow-missing-baseline", action="store_true", help="exit 0 when there is no baseline to compare to")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        print(f"{'benchmark':<44}{'median':>12}{'min':>12}{'calls':>10}")
+        for name, fn in benchmarks(tmp, args.quick, keep=lambda name: args.k in name):
+            if args.k not in name:
+                continue
+            results[name] = measure(fn, repeat=args.repeat)
+            r = results[name]
+            print(f"{name:<44}{r['median_s'] * 1e3:>10.3f}ms{r['min_s'] * 1e3:>10.3f}ms{r['number']:>10}")
+
+    if args.save:
+        previous = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("results", {})
+        for name, r in results.items():
+            # hand tuned thresholds survive a new baseline
+            if "threshold" in previous.get(name, {}):
+                r["threshold"] = previous[name]["threshold"]
+        baseline = {
+            "machine": platform.platform(),
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": {**previous, **results},
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if not os.path.isfile(args.baseline):
+        print(f"no baseline at {args.baseline}, record one with --save")
+        if not args.allow_missing_baseline:
+            sys.exit(2)
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for name, current, reference, ratio, limit in regressions:
+        print(f"REGRESSION {name}: {current * 1e3:.3f}ms vs {reference * 1e3:.3f}ms (x{ratio:.2f}, limit x{1 + limit:.2f})")
+    if regressions:
+        sys.exit(1)
+    print(f"{len(results)} benchmarks within the baseline ({baseline.get('machine')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,22 +5,49 @@ from dotenv import load_dotenv
 from openai import OpenAI
 import os
 import csv
+import threading
+import time
+import logging
 from datetime import datetime
+from utils.logger import CsvRow, get_pipeline
+from bot.core.router import get_router
+from bot.core.scheduler import RunRateLimited
+from reply_parser import StreamParser
 
 load_dotenv(override=True)
 
 SUCCESS_STATES = {"completed", "succeeded"}
+FAILED_EVENTS = {"thread.run.failed", "thread.run.cancelled", "thread.run.expired", "thread.run.incomplete"}
+# stream the runs: replies are parsed while generated and cut short once decided (StreamParser)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "True").lower() in ("1", "true", "yes")
+# constrain replies to the JSON schema of the request when one is given (reply_parser)
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "True").lower() in ("1", "true", "yes")
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenAI:
+    """One OpenAI client (and HTTP connection pool) for every Bot of the process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI()
+    return _client
+
 
 class Bot:
     def __init__(self, logger, system_prompt, log_path: str = "logs/assistant_tokens.csv"):
         self.logger = logger
-        self.client = OpenAI()
-        self.model: str = os.getenv("MODEL_NAME", "gpt-4o-mini") 
+        self.client = get_client()
+        self.model: str = os.getenv("MODEL_NAME", "gpt-4o-mini")
+        self.router = get_router()
         self.name = "UAV Test Generator"
         self.assistant = self.initialize_bot(system_prompt)
 
         # token accounting
         self.cumulative_tokens = 0
+        self.accounting_lock = threading.Lock()
         self.log_path = log_path
         os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
         if not os.path.exists(self.log_path):
@@ -35,8 +62,25 @@ class Bot:
                     "prompt_tokens",
                     "completion_tokens",
                     "total_tokens",
-                    "cumulative_tokens"
+                    "cumulative_tokens",
+                    "model",
+                    "request_class",
+                    "latency_s",
+                    "status",
+                    "first_obstacle_s",
+                    "cancelled",
                 ])
+        # rows are appended by the log pipeline thread, prompts/replies in full (it is the accounting
+        # record, not a log), one logger per accounting file so runs with their own workspace do not share it
+        self.token_log = logging.getLogger(f"assistant_tokens:{os.path.abspath(self.log_path)}")
+        self.token_log.setLevel(logging.INFO)
+        self.token_log.propagate = False
+        pipeline = get_pipeline()
+        pipeline.attach(
+            self.token_log,
+            [pipeline.file_handler(self.log_path, level=logging.INFO, fmt="%(message)s", rotate=False)],
+            replace=True,
+        )
 
     def initialize_bot(self, system_prompt) -> Dict[str, Any]:
         """Create and return an Assistant object (as a dict)."""
@@ -84,8 +128,24 @@ class Bot:
         prompt_text: Optional[str] = None,
         file_id: Optional[str] = None,
         image_id: Optional[str] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None,
+        request_class: Optional[int] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        cancel_invalid: bool = False,
+        cancel: Optional[threading.Event] = None,
     ) -> Dict[str, Any]:
-        """Append a user message, run the assistant, then return a dict with reply + usage."""
+        """
+        Append a user message, run the assistant, then return a dict with reply + usage.
+        response_format -> structured output (json_schema) of this run, ignored unless STRUCTURED_OUTPUT
+        model -> model of this run (see ModelRouter), the assistant's model if None
+        request_class -> scheduler Priority of the request, the run is reported to the router
+        schema -> reply_parser schema of a streamed reply, the generation is cancelled once every
+                  obstacle arrived (or, with cancel_invalid, once one of them is out of range)
+        cancel -> set when the reply is no longer needed (a hedged copy answered first), a streamed
+                  run is then cancelled, a polled one runs to the end
+        """
+        model = model or self.model
         self.logger.info("Building the prompt.....")
         attachments: List[Dict[str, Any]] = []
         if file_id:
@@ -106,16 +166,43 @@ class Bot:
         self.logger.info(f"User message created: {getattr(msg, 'id', msg)}")
 
         # Start run and wait; capture run (for usage)
-        run = self.run_and_wait(thread_id=thread_id, assistant_id=self.assistant.id)
+        run_options: Dict[str, Any] = {}
+        if response_format is not None and STRUCTURED_OUTPUT:
+            run_options["response_format"] = response_format
+            if not attachments:
+                # json_schema replies cannot be combined with file_search
+                run_options["tools"] = []
+        if model != self.model:
+            run_options["model"] = model
+        start = time.perf_counter()
+        stream = None
+        try:
+            if LLM_STREAMING:
+                parser = StreamParser(schema) if schema is not None else None
+                run, reply_text, stream = self.stream_run(
+                    thread_id, self.assistant.id, parser, cancel_invalid, cancel, **run_options
+                )
+            else:
+                run = self.run_and_wait(thread_id=thread_id, assistant_id=self.assistant.id, **run_options)
+        except Exception:
+            latency = time.perf_counter() - start
+            self.log_usage(thread_id, None, prompt_text, "", 0, 0, 0, model, request_class, latency, "error")
+            if request_class is not None:
+                note = self.router.failure(request_class, model, latency)
+                if note:
+                    self.logger.warning(note)
+            raise
+        latency = time.perf_counter() - start
 
         # Fetch the assistant reply
-        reply_text = self.fetch_reply(thread_id) or ""
+        if stream is None:
+            reply_text = self.fetch_reply(thread_id) or ""
 
         # Extract token usage (if present)
         prompt_tokens = 0
         completion_tokens = 0
         total_tokens = 0
-        run_id = getattr(run, "id", None)
+        run_id = getattr(run, "id", None) or (stream or {}).get("run_id")
 
         usage = getattr(run, "usage", None)
         # Newer SDKs expose usage as an object; fallback to dict keys if needed
@@ -124,27 +211,30 @@ class Bot:
             completion_tokens = getattr(usage, "completion_tokens", getattr(usage, "output_tokens", 0)) or 0
             # Some SDKs expose total_tokens directly; otherwise sum
             total_tokens = getattr(usage, "total_tokens", prompt_tokens + completion_tokens) or 0
+        elif stream is not None and stream["cancelled"]:
+            # no usage for a cancelled run, estimated (4 characters per token, system prompt excluded)
+            prompt_tokens = len(prompt_text or "") // 4
+            completion_tokens = len(reply_text) // 4
+            total_tokens = prompt_tokens + completion_tokens
 
-        self.cumulative_tokens += total_tokens
-
-        # Log to CSV
-        with open(self.log_path, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.utcnow().isoformat(),
-                thread_id,
-                run_id,
-                (prompt_text or ""),
-                reply_text,
-                prompt_tokens,
-                completion_tokens,
-                total_tokens,
-                self.cumulative_tokens,
-            ])
+        # ok: the reply is complete (a stream cut once every obstacle arrived included),
+        # invalid: cut at an out-of-range obstacle, hedged: cut because its hedge answered first
+        status = stream["cancelled"] if stream and stream["cancelled"] not in (None, "complete") else "ok"
+        cumulative_tokens = self.log_usage(
+            thread_id, run_id, prompt_text, reply_text, prompt_tokens, completion_tokens, total_tokens,
+            model, request_class, latency, status,
+            first_obstacle_s=stream and stream["first_obstacle_s"],
+            cancelled=stream and stream["cancelled"],
+        )
+        # a run cut short by its hedge says nothing about the model
+        if request_class is not None and not (stream and stream["cancelled"] == "hedged"):
+            note = self.router.success(request_class, model, latency, prompt_tokens, completion_tokens)
+            if note:
+                self.logger.warning(note)
 
         self.logger.info(
-            f"[Tokens] prompt={prompt_tokens}, completion={completion_tokens}, "
-            f"total={total_tokens}, cumulative={self.cumulative_tokens}"
+            f"[Tokens] model={model}, prompt={prompt_tokens}, completion={completion_tokens}, "
+            f"total={total_tokens}, cumulative={cumulative_tokens}, latency={latency:.1f}s"
         )
 
         return {
@@ -153,35 +243,137 @@ class Bot:
                 "prompt_tokens": prompt_tokens,
                 "completion_tokens": completion_tokens,
                 "total_tokens": total_tokens,
-                "cumulative_tokens": self.cumulative_tokens,
+                "cumulative_tokens": cumulative_tokens,
             },
             "thread_id": thread_id,
             "run_id": run_id,
+            "model": model,
+            "stream": stream,
         }
 
-    def run_and_wait(self, thread_id: str, assistant_id: str) -> Dict[str, Any]:
+    def log_usage(self, thread_id, run_id, prompt_text, reply_text, prompt_tokens, completion_tokens,
+                  total_tokens, model, request_class, latency, status, first_obstacle_s=None, cancelled=None) -> int:
+        """Append a row to the token accounting CSV, returns the cumulative tokens."""
+        with self.accounting_lock:
+            self.cumulative_tokens += total_tokens
+            cumulative_tokens = self.cumulative_tokens
+        self.token_log.info(CsvRow([
+            datetime.utcnow().isoformat(),
+            thread_id,
+            run_id,
+            prompt_text or "",
+            reply_text,
+            prompt_tokens,
+            completion_tokens,
+            total_tokens,
+            cumulative_tokens,
+            model,
+            self.router.class_name(request_class) if request_class is not None else "",
+            round(latency, 3),
+            status,
+            "" if first_obstacle_s is None else round(first_obstacle_s, 3),
+            cancelled or "",
+        ]))
+        return cumulative_tokens
+
+    def run_and_wait(self, thread_id: str, assistant_id: str, **run_options: Any) -> Dict[str, Any]:
         """Start a Run and block until it reaches a terminal state. Return the Run object."""
         run = self.client.beta.threads.runs.create_and_poll(
             thread_id=thread_id,
             assistant_id=assistant_id,
+            **run_options,
         )
 
         status = getattr(run, "status", None)
         if status not in SUCCESS_STATES:
-            err = getattr(run, "last_error", None)
-            details = None
-            if err:
-                if isinstance(err, dict):
-                    details = f"code={err.get('code')} message={err.get('message')}"
-                else:
-                    details = str(err)
-            self.logger.error(f"Run did not complete successfully. status={status} details={details}")
-            raise RuntimeError(
-                f"Run did not complete successfully. status={status} details={details}"
-            )
+            raise self.run_error(status, getattr(run, "last_error", None))
 
         return run
 
+    def run_error(self, status, err) -> RuntimeError:
+        """Exception of a failed run, RunRateLimited when it hit the organization limits (the scheduler backs off)."""
+        details = None
+        code = None
+        if err:
+            if isinstance(err, dict):
+                code = err.get("code")
+                details = f"code={code} message={err.get('message')}"
+            else:
+                code = getattr(err, "code", None)
+                details = str(err)
+        self.logger.error(f"Run did not complete successfully. status={status} details={details}")
+        error = RunRateLimited if code == "rate_limit_exceeded" else RuntimeError
+        return error(f"Run did not complete successfully. status={status} details={details}")
+
+    def stream_run(self, thread_id: str, assistant_id: str, parser: Optional[StreamParser] = None,
+                   cancel_invalid: bool = False, cancel: Optional[threading.Event] = None, **run_options: Any):
+        """
+        Streaming run_and_wait + fetch_reply in one request: the reply is assembled from the text
+        deltas and fed to parser. Returns (run, reply, stream), run is None when the generation
+        was cancelled; stream holds run_id, parser, first_obstacle_s (time to the first complete
+        obstacle) and cancelled (complete | invalid | hedged | None).
+        """
+        start = time.perf_counter()
+        parts: List[str] = []
+        run = None
+        stream = {"run_id": None, "parser": parser, "first_obstacle_s": None, "cancelled": None}
+        events = self.client.beta.threads.runs.create(
+            thread_id=thread_id, assistant_id=assistant_id, stream=True, **run_options
+        )
+        try:
+            for event in events:
+                kind = getattr(event, "event", None)
+                data = getattr(event, "data", None)
+                if kind == "thread.run.created":
+                    stream["run_id"] = data.id
+                if cancel is not None and cancel.is_set():
+                    stream["cancelled"] = "hedged"
+                    self.cancel_run(thread_id, stream["run_id"])
+                    break
+                if kind == "thread.message.delta":
+                    chunk = "".join(
+                        part.text.value
+                        for part in (getattr(data.delta, "content", None) or [])
+                        if getattr(part, "type", None) == "text" and part.text and part.text.value
+                    )
+                    if not chunk:
+                        continue
+                    parts.append(chunk)
+                    if parser is None:
+                        continue
+                    if parser.feed(chunk) and stream["first_obstacle_s"] is None:
+                        stream["first_obstacle_s"] = time.perf_counter() - start
+                    if parser.complete:
+                        stream["cancelled"] = "complete"
+                    elif cancel_invalid and parser.errors:
+                        stream["cancelled"] = "invalid"
+                    else:
+                        continue
+                    self.logger.info(f"generation cancelled ({stream['cancelled']}) after {len(''.join(parts))} characters")
+                    self.cancel_run(thread_id, stream["run_id"])
+                    break
+                elif kind == "thread.run.completed":
+                    run = data
+                elif kind in FAILED_EVENTS or kind == "error":
+                    raise self.run_error(kind, getattr(data, "last_error", None) or data)
+        finally:
+            events.close()
+        return run, "".join(parts), stream
+
+    def cancel_run(self, thread_id: str, run_id: Optional[str]):
+        """Stop a generation in the background, the caller already has what it needs."""
+        if run_id is None:
+            return
+
+        def cancel():
+            try:
+                self.client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread_id)
+            except Exception as e:
+                # the run may have completed meanwhile
+                self.logger.debug(f"cancel of {run_id} failed: {e}")
+
+        threading.Thread(target=cancel, name="llm-cancel", daemon=True).start()
+
     def fetch_reply(self, thread_id: str) -> Optional[str]:
         """Return the first plain-text assistant reply in the thread (no new run)."""
         msgs = self.client.beta.threads.messages.list(thread_id=thread_id)
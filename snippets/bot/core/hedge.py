@@ -0,0 +1,133 @@
+from __future__ import annotations
+import collections
+import os
+import threading
+from typing import Deque, Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from bot.core.router import CLASSES
+
+load_dotenv(override=True)
+
+# send a duplicate of a request still running at the HEDGE_PERCENTILE latency of its class
+LLM_HEDGE = os.getenv("LLM_HEDGE", "True").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# latencies of a class observed before its requests are hedged
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+# tokens of the hedges, as a fraction of all the tokens spent, above which no hedge is sent
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+# latencies per class the percentile is taken over
+HEDGE_WINDOW = 200
+
+
+class HedgeStats:
+    """Hedges of one request class."""
+
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+        self.extra_tokens = 0
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "over_budget": self.over_budget,
+            "extra_tokens": self.extra_tokens,
+        }
+
+
+class HedgePolicy:
+    """
+    When to duplicate a request (see Prompter.process).
+
+    The last HEDGE_WINDOW execution latencies of each request class (queue wait excluded)
+    give the delay after which a request still running is sent again: the percentile-th
+    latency, once min_samples are known. Whichever copy answers first with a valid reply
+    wins and the other is cancelled. The tokens of the losers are the extra spend: no
+    hedge is sent while it exceeds budget of every token spent so far.
+    """
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES,
+                 budget: float = HEDGE_BUDGET, enabled: bool = LLM_HEDGE):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.enabled = enabled
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.stats: Dict[str, HedgeStats] = {}
+        self.tokens = 0
+        self.extra_tokens = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def class_name(priority) -> str:
+        return CLASSES.get(priority, priority) if not isinstance(priority, str) else priority
+
+    def _stats(self, name) -> HedgeStats:
+        if name not in self.stats:
+            self.stats[name] = HedgeStats()
+        return self.stats[name]
+
+    def delay(self, priority) -> Optional[float]:
+        """Seconds of execution after which a request of the class is hedged, None: never."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            latencies = self.latencies.get(self.class_name(priority))
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            return float(np.percentile(latencies, self.percentile))
+
+    def allow(self, priority, estimate: float) -> bool:
+        """A hedge of estimate tokens fits in the budget (counted as over budget otherwise)."""
+        with self.lock:
+            if self.extra_tokens + estimate <= self.budget * self.tokens:
+                self._stats(self.class_name(priority)).hedged += 1
+                return True
+            self._stats(self.class_name(priority)).over_budget += 1
+            return False
+
+    def observe(self, priority, latencies: List[float], tokens: int, hedge_won: bool = False):
+        """
+        A request answered: execution latencies of the winner and, when its hedge won, the time
+        the primary had run (a lower bound of its latency, dropping it would bias the percentile
+        toward the fast replies), tokens of the winner.
+        """
+        name = self.class_name(priority)
+        with self.lock:
+            stats = self._stats(name)
+            stats.requests += 1
+            stats.hedge_wins += int(hedge_won)
+            self.tokens += tokens
+            self.latencies.setdefault(name, collections.deque(maxlen=HEDGE_WINDOW)).extend(latencies)
+
+    def wasted(self, priority, tokens: int):
+        """Tokens of the copy that lost."""
+        with self.lock:
+            self._stats(self.class_name(priority)).extra_tokens += tokens
+            self.tokens += tokens
+            self.extra_tokens += tokens
+
+    def report(self) -> Dict[str, dict]:
+        with self.lock:
+            report = {name: stats.summary() for name, stats in sorted(self.stats.items())}
+            if self.tokens:
+                report["extra_token_share"] = round(self.extra_tokens / self.tokens, 3)
+            return report
+
+
+_policy: Optional[HedgePolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_hedge_policy() -> HedgePolicy:
+    """Process wide hedge policy: LLM_HEDGE, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES and HEDGE_BUDGET."""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy()
+    return _policy
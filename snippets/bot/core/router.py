@@ -0,0 +1,282 @@
+from __future__ import annotations
+import csv
+import glob
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from bot.core.scheduler import Priority
+
+load_dotenv(override=True)
+
+# request classes, named after the scheduler priorities
+CLASSES = {Priority.SEED: "seed", Priority.MUTATE: "mutate", Priority.REPAIR: "repair", Priority.DEDUP: "dedup"}
+# fixed | cheapest | fastest | balanced
+ROUTING_POLICY = os.getenv("ROUTING_POLICY", "fixed")
+# calls of a model below which it is tried before being ranked
+ROUTE_MIN_SAMPLES = int(os.getenv("ROUTE_MIN_SAMPLES", "3"))
+# errors in a row, or a mean latency above LLM_SLOW_SECONDS, put a model aside for ROUTE_COOLDOWN seconds
+ROUTE_MAX_ERRORS = int(os.getenv("ROUTE_MAX_ERRORS", "2"))
+ROUTE_COOLDOWN = float(os.getenv("ROUTE_COOLDOWN", "300"))
+LLM_SLOW_SECONDS = float(os.getenv("LLM_SLOW_SECONDS", "60"))
+# USD per 1M prompt/completion tokens, MODEL_PRICES=model=in/out,... adds or overrides entries
+PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4.1-nano": (0.1, 0.4),
+}
+
+
+def parse_prices(spec: str) -> Dict[str, tuple]:
+    prices = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        model, _, price = item.partition("=")
+        prompt, _, completion = price.partition("/")
+        prices[model.strip()] = (float(prompt), float(completion or prompt))
+    return prices
+
+
+def parse_routes(spec: str, default: str) -> Dict[str, List[str]]:
+    """MODEL_ROUTES=seed=gpt-4o,gpt-4o-mini;repair=gpt-4o-mini -> candidates per class, in fallback order."""
+    routes = {name: [default] for name in CLASSES.values()}
+    for item in filter(None, (s.strip() for s in spec.split(";"))):
+        name, _, models = item.partition("=")
+        candidates = [m.strip() for m in models.split(",") if m.strip()]
+        if name.strip() not in routes:
+            raise ValueError(f"unknown request class in MODEL_ROUTES: {name}")
+        if candidates:
+            routes[name.strip()] = candidates
+    return routes
+
+
+class ModelStats:
+    """Observed behaviour of one model for one request class (moving averages)."""
+
+    ALPHA = 0.2
+
+    def __init__(self):
+        self.calls = 0
+        self.ok = 0
+        self.invalid = 0
+        self.errors_in_row = 0
+        self.latency = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.cooling_until = 0.0
+
+    def _avg(self, current, value):
+        return value if current is None else (1 - self.ALPHA) * current + self.ALPHA * value
+
+    def success(self, latency, prompt_tokens, completion_tokens):
+        self.calls += 1
+        self.ok += 1
+        self.errors_in_row = 0
+        self.latency = self._avg(self.latency, latency)
+        self.prompt_tokens = self._avg(self.prompt_tokens, prompt_tokens)
+        self.completion_tokens = self._avg(self.completion_tokens, completion_tokens)
+
+    def failure(self, latency=None):
+        self.calls += 1
+        self.errors_in_row += 1
+        if latency is not None:
+            self.latency = self._avg(self.latency, latency)
+
+    @property
+    def success_rate(self):
+        """Valid replies per call, with a uniform prior so unseen models are not ruled out."""
+        return (self.ok - self.invalid + 1) / (self.calls + 2)
+
+    def cost(self, price):
+        if self.prompt_tokens is None:
+            return None
+        return (self.prompt_tokens * price[0] + self.completion_tokens * price[1]) / 1e6
+
+    def summary(self, price):
+        cost = self.cost(price)
+        return {
+            "calls": self.calls,
+            "success_rate": round(self.success_rate, 3),
+            "latency_s": None if self.latency is None else round(self.latency, 2),
+            "cost_usd": None if cost is None else round(cost, 5),
+        }
+
+
+class ModelRouter:
+    """
+    Picks the model of every LLM request from its class (seed, mutate, repair, dedup).
+
+    Each class has candidate models (MODEL_ROUTES, MODEL_NAME alone by default). The
+    policy ranks the healthy candidates by expected cost (fixed: configuration order,
+    cheapest: USD, fastest: latency, balanced: both relative to the best candidate), each
+    divided by the valid reply rate. Candidates with fewer than min_samples calls are tried
+    first. A model failing max_errors times in a row, or slower than slow_seconds on
+    average, is put aside for cooldown seconds; the router falls back to the next one and
+    only uses a cooling model when no other candidate is left.
+
+    Stats are kept per (class, model), fed by Bot (latency, tokens, API errors) and by
+    Prompter (replies that did not parse/validate), and warm started from token logs.
+    """
+
+    def __init__(self, routes: Dict[str, List[str]], policy: str = ROUTING_POLICY,
+                 prices: Optional[Dict[str, tuple]] = None, min_samples: int = ROUTE_MIN_SAMPLES,
+                 max_errors: int = ROUTE_MAX_ERRORS, cooldown: float = ROUTE_COOLDOWN,
+                 slow_seconds: float = LLM_SLOW_SECONDS):
+        if policy not in ("fixed", "cheapest", "fastest", "balanced"):
+            raise ValueError(f"unknown ROUTING_POLICY: {policy}")
+        self.routes = routes
+        self.policy = policy
+        self.prices = {**PRICES, **(prices or {})}
+        self.min_samples = min_samples
+        self.max_errors = max_errors
+        self.cooldown = cooldown
+        self.slow_seconds = slow_seconds
+        self.stats: Dict[tuple, ModelStats] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def class_name(priority) -> str:
+        return CLASSES.get(priority, priority) if not isinstance(priority, str) else priority
+
+    def _stats(self, name, model) -> ModelStats:
+        key = (name, model)
+        if key not in self.stats:
+            self.stats[key] = ModelStats()
+        return self.stats[key]
+
+    def price(self, model):
+        # unknown models cost the same as each other, the token count decides
+        return self.prices.get(model, (1.0, 1.0))
+
+    def _rank(self, name, candidates):
+        if self.policy == "fixed":
+            return list(candidates)
+        stats = {m: self._stats(name, m) for m in candidates}
+        untried = [m for m in candidates if stats[m].calls < self.min_samples]
+        if untried:
+            return untried[:1] + [m for m in candidates if m != untried[0]]
+
+        costs = {m: stats[m].cost(self.price(m)) for m in candidates}
+        latencies = {m: stats[m].latency for m in candidates}
+        # a model that never replied counts as the worst of the others
+        worst_cost = max([c for c in costs.values() if c is not None], default=1.0)
+        worst_latency = max([t for t in latencies.values() if t is not None], default=1.0)
+
+        def cost(m):
+            return worst_cost if costs[m] is None else costs[m]
+
+        def latency(m):
+            return worst_latency if latencies[m] is None else latencies[m]
+
+        best_cost = min(cost(m) for m in candidates) or 1e-9
+        best_latency = min(latency(m) for m in candidates) or 1e-9
+        if self.policy == "cheapest":
+            score = lambda m: cost(m) / stats[m].success_rate
+        elif self.policy == "fastest":
+            score = lambda m: latency(m) / stats[m].success_rate
+        else:
+            score = lambda m: (cost(m) / best_cost + latency(m) / best_latency) / stats[m].success_rate
+        return sorted(candidates, key=score)
+
+    def choose(self, priority, exclude: Iterable[str] = ()) -> str:
+        """Model of the next request of the class, exclude: models that already failed this request."""
+        name = self.class_name(priority)
+        candidates = self.routes.get(name) or self.routes["mutate"]
+        now = time.monotonic()
+        with self.lock:
+            ranked = self._rank(name, candidates)
+            usable = [m for m in ranked if m not in exclude]
+            healthy = [m for m in usable if self._stats(name, m).cooling_until <= now]
+            if healthy:
+                return healthy[0]
+            # every candidate failed or is cooling down: the least recently put aside one
+            pool = usable or ranked
+            return min(pool, key=lambda m: self._stats(name, m).cooling_until)
+
+    def success(self, priority, model, latency, prompt_tokens, completion_tokens):
+        name = self.class_name(priority)
+        with self.lock:
+            stats = self._stats(name, model)
+            stats.success(latency, prompt_tokens, completion_tokens)
+            if stats.latency > self.slow_seconds and len(self.routes.get(name, ())) > 1:
+                stats.cooling_until = time.monotonic() + self.cooldown
+                return f"{model} slow for {name} requests ({stats.latency:.1f}s), put aside for {self.cooldown:.0f}s"
+        return None
+
+    def failure(self, priority, model, latency=None):
+        name = self.class_name(priority)
+        with self.lock:
+            stats = self._stats(name, model)
+            stats.failure(latency)
+            if stats.errors_in_row >= self.max_errors:
+                stats.cooling_until = time.monotonic() + self.cooldown
+                return f"{model} failed {stats.errors_in_row} {name} requests in a row, put aside for {self.cooldown:.0f}s"
+        return None
+
+    def invalid(self, priority, model):
+        """A reply of the model that did not parse or validate (counted against its success rate)."""
+        with self.lock:
+            self._stats(self.class_name(priority), model).invalid += 1
+
+    def warm_start(self, paths: Iterable[str], rows: int = 200):
+        """
+        Seed the stats with the last rows of previous token logs (those with the routing columns),
+        the same way the live calls are counted: ok is a success, invalid a success whose reply is
+        counted against the valid reply rate, error a failure, hedged rows (cut short) are skipped.
+        """
+        records = []
+        for path in paths:
+            try:
+                with open(path, "r", newline="", encoding="utf-8") as f:
+                    records += [r for r in csv.DictReader(f) if r.get("model") and r.get("request_class")]
+            except (OSError, csv.Error):
+                continue
+        records.sort(key=lambda r: r.get("timestamp", ""))
+        for r in records[-rows:]:
+            try:
+                latency = float(r["latency_s"])
+                status = r.get("status")
+                if status in ("ok", "invalid"):
+                    self.success(r["request_class"], r["model"], latency, float(r["prompt_tokens"]), float(r["completion_tokens"]))
+                    if status == "invalid":
+                        self.invalid(r["request_class"], r["model"])
+                elif status == "error":
+                    self.failure(r["request_class"], r["model"], latency)
+            except (KeyError, ValueError):
+                continue
+        with self.lock:
+            # history only informs the ranking, models start healthy
+            for stats in self.stats.values():
+                stats.cooling_until = 0.0
+                stats.errors_in_row = 0
+        return len(records[-rows:])
+
+    def report(self) -> Dict[str, Dict[str, dict]]:
+        with self.lock:
+            report: Dict[str, Dict[str, dict]] = {}
+            for (name, model), stats in sorted(self.stats.items()):
+                report.setdefault(name, {})[model] = stats.summary(self.price(model))
+            return report
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """
+    Process wide router: MODEL_ROUTES, ROUTING_POLICY and MODEL_PRICES, warm started from the
+    token logs of the previous runs under WORKSPACE_DIR.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter(
+                parse_routes(os.getenv("MODEL_ROUTES", ""), os.getenv("MODEL_NAME", "gpt-4o-mini")),
+                prices=parse_prices(os.getenv("MODEL_PRICES", "")),
+            )
+            logs = glob.glob(os.path.join(os.getenv("WORKSPACE_DIR", "runs/"), "*", "logs", "assistant_tokens.csv"))
+            _router.warm_start(sorted(logs, key=os.path.getmtime)[-20:])
+    return _router
@@ -0,0 +1,183 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+from openai import RateLimitError
+
+load_dotenv(override=True)
+
+
+class Priority:
+    """Request classes, lower value is served first."""
+    SEED = 0
+    MUTATE = 1
+    REPAIR = 2
+    DEDUP = 3
+
+
+class RunRateLimited(RuntimeError):
+    """An Assistants run that failed with last_error.code rate_limit_exceeded (no 429 is raised for those)."""
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute, up to one minute worth of capacity."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until amount units are available, 0 if they are now."""
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Charge (positive) or refund (negative) units once the real usage is known."""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+    def drain(self):
+        self._refill()
+        self.level = min(self.level, 0.0)
+
+
+class RequestScheduler:
+    """
+    Asyncio scheduler for the OpenAI calls of every Bot of the process.
+
+    Requests are admitted by priority class, limited to `concurrency` in flight and by
+    requests-per-minute / tokens-per-minute token buckets. The token cost of a request is
+    estimated from the usage Bot recorded for previous requests of the same class and
+    corrected once its own usage is known. A 429 drains both buckets so every pending
+    request backs off, not only the one that failed.
+
+    The event loop runs in a background thread: `submit` returns a concurrent Future,
+    `asubmit` can be awaited from any event loop and `call` blocks until the reply.
+    """
+
+    DEFAULT_ESTIMATE = 2000
+
+    def __init__(self, concurrency: int, rpm: float, tpm: float):
+        self.concurrency = concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.estimates: Dict[int, float] = {}
+        self.counter = itertools.count()
+        self.stats = {"completed": 0, "failed": 0, "rate_limited": 0, "tokens": 0}
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm")
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="llm-scheduler", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    async def _start(self):
+        # heap of (priority, order, fn, estimate, future), arrived is set on every push
+        self.pending: list = []
+        self.arrived = asyncio.Event()
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def estimate(self, priority: int, prompt: Optional[str]) -> float:
+        if priority in self.estimates:
+            return self.estimates[priority]
+        return len(prompt or "") / 4 + self.DEFAULT_ESTIMATE
+
+    async def _enqueue(self, fn, priority, prompt):
+        future = self.loop.create_future()
+        heapq.heappush(self.pending, (priority, next(self.counter), fn, self.estimate(priority, prompt), future))
+        self.arrived.set()
+        return await future
+
+    async def _dispatch(self):
+        while True:
+            # take a free slot first, so the job picked is the highest priority one at that time
+            await self.slots.acquire()
+            # wait for the buckets before taking a job off the heap, so a job arriving meanwhile
+            # with a higher priority is served first instead of waiting behind the one picked
+            while True:
+                delay = None
+                if self.pending:
+                    estimate = self.pending[0][3]
+                    delay = max(self.requests.delay(1), self.tokens.delay(estimate))
+                    if delay == 0:
+                        break
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            priority, _, fn, estimate, future = heapq.heappop(self.pending)
+            self.requests.take(1)
+            self.tokens.take(estimate)
+            asyncio.ensure_future(self._execute(priority, fn, estimate, future))
+
+    async def _execute(self, priority, fn, estimate, future):
+        try:
+            result = await self.loop.run_in_executor(self.executor, fn)
+            used = self._usage(result)
+            if used is not None:
+                self.tokens.adjust(used - estimate)
+                previous = self.estimates.get(priority, used)
+                self.estimates[priority] = 0.8 * previous + 0.2 * used
+                self.stats["tokens"] += used
+            self.stats["completed"] += 1
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            self.stats["failed"] += 1
+            if isinstance(e, (RateLimitError, RunRateLimited)):
+                self.stats["rate_limited"] += 1
+                self.requests.drain()
+                self.tokens.drain()
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    @staticmethod
+    def _usage(result: Any) -> Optional[int]:
+        if isinstance(result, dict) and isinstance(result.get("usage"), dict):
+            return result["usage"].get("total_tokens")
+        return None
+
+    def submit(self, fn: Callable[[], Any], priority: int = Priority.MUTATE, prompt: Optional[str] = None) -> Future:
+        return asyncio.run_coroutine_threadsafe(self._enqueue(fn, priority, prompt), self.loop)
+
+    async def asubmit(self, fn: Callable[[], Any], priority: int = Priority.MUTATE, prompt: Optional[str] = None) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, priority, prompt))
+
+    def call(self, fn: Callable[[], Any], priority: int = Priority.MUTATE, prompt: Optional[str] = None) -> Any:
+        return self.submit(fn, priority, prompt).result()
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """Process wide scheduler, limits come from LLM_CONCURRENCY, LLM_RPM and LLM_TPM."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                concurrency=int(os.getenv("LLM_CONCURRENCY", "4")),
+                rpm=float(os.getenv("LLM_RPM", "500")),
+                tpm=float(os.getenv("LLM_TPM", "200000")),
+            )
+    return _scheduler
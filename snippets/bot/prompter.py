@@ -1,34 +1,67 @@
 import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
 from pathlib import Path
 from bot.core.bot_init_thread import Bot
+from bot.core.scheduler import Priority, get_scheduler
+from bot.core.router import get_router
+from bot.core.hedge import get_hedge_policy
+from utils.logger import Payload
+from utils import profiler
+from reply_parser import PARSE_STATS, ReplyError, parse_reply, response_format
+
+# structured requests re-asked at most this many times when the reply does not parse or validate
+MAX_PARSE_RETRIES = 2
 
 class Prompter:
     """
     Generates the submisson method on fly
     """
-    def __init__(self, logger, system_prompt):
+    def __init__(self, logger, system_prompt, token_log=None):
+        """
+        token_log -> token accounting CSV of the Bot, Bot's default (logs/) if None
+        """
         self.logger = logger
-        self.bot = Bot(logger=logger, system_prompt=system_prompt)
+        if token_log is None:
+            self.bot = Bot(logger=logger, system_prompt=system_prompt)
+        else:
+            self.bot = Bot(logger=logger, system_prompt=system_prompt, log_path=token_log)
+        self.scheduler = get_scheduler()
+        self.router = get_router()
+        self.hedge = get_hedge_policy()
 
-    def process(self, prompt, img_path=None, file_path=None, max_retries=3, backoff_factor=2):
+    def process(self, prompt, img_path=None, file_path=None, max_retries=3, backoff_factor=2, priority=Priority.MUTATE,
+                schema=None, cancel_invalid=False):
         file_id = self.bot.upload_file(Path(file_path)) if file_path is not None else None
         image_id = self.bot.upload_image(Path(img_path)) if img_path is not None else None
         thread = self.bot.create_thread()
 
         retries = 0
+        # models that failed this request, the retries fall back to the next candidate of the class
+        failed = set()
         while retries < max_retries:
+            model = self.router.choose(priority, exclude=failed)
             try:
-                raw_resp = self.bot.post_message_to_thread(
-                    thread_id=thread.id,
-                    prompt_text=prompt,
-                    file_id=file_id,
-                    image_id=image_id,
-                )
+                with profiler.wait("llm"):
+                    raw_resp = self.hedged_call(
+                        thread.id,
+                        model,
+                        priority,
+                        prompt_text=prompt,
+                        file_id=file_id,
+                        image_id=image_id,
+                        response_format=response_format(schema) if schema is not None else None,
+                        schema=schema,
+                        cancel_invalid=cancel_invalid,
+                    )
                 # Success: write JSON and break
-                self.logger.info(f"Generated submission method code:\n{raw_resp}")
+                self.logger.info("Generated submission method code:\n%s", Payload(raw_resp, self.logger))
                 return raw_resp
             except Exception as e:
-                self.logger.error(f"Error during OpenAI request: {e}")
+                self.logger.error(f"Error during OpenAI request ({model}): {e}")
+                failed.add(model)
                 retries += 1
                 if retries < max_retries:
                     wait_time = backoff_factor ** retries
@@ -36,3 +69,189 @@ class Prompter:
                     time.sleep(wait_time)
                 else:
                     self.logger.error("Max retries reached. Failing gracefully.")
+
+    def submit(self, thread_id, model, priority, **message):
+        """One copy of a request on the scheduler -> (future, copy), copy holds its cancel event and timing."""
+        copy = {"model": model, "cancel": threading.Event(), "start": None, "end": None}
+
+        def run():
+            if copy["cancel"].is_set():
+                # the other copy answered while this one was queued
+                return None
+            copy["start"] = time.perf_counter()
+            try:
+                return self.bot.post_message_to_thread(
+                    thread_id=thread_id, model=model, request_class=priority, cancel=copy["cancel"], **message
+                )
+            finally:
+                copy["end"] = time.perf_counter()
+
+        return self.scheduler.submit(run, priority=priority, prompt=message.get("prompt_text")), copy
+
+    def hedged_call(self, thread_id, model, priority, **message):
+        """
+        Send a request and wait for its reply. A request still running (queue wait excluded) at
+        the hedge delay of its class is sent again, on a new thread and to the next candidate
+        model of the class when there is one. The first valid reply wins, the other copy is
+        cancelled and its tokens are counted against the hedge budget.
+        """
+        future, copy = self.submit(thread_id, model, priority, **message)
+        primary = copy
+        pending = {future: copy}
+        delay = self.hedge.delay(priority)
+        if delay is not None:
+            while not future.done():
+                if copy["start"] is None:
+                    wait([future], timeout=0.1)
+                    continue
+                left = copy["start"] + delay - time.perf_counter()
+                if left <= 0:
+                    break
+                wait([future], timeout=left)
+            if not future.done() and self.hedge.allow(priority, self.scheduler.estimate(priority, message.get("prompt_text"))):
+                # a thread runs one request at a time, the copy gets its own
+                hedge_model = self.router.choose(priority, exclude={model})
+                self.logger.info(f"{model} request still running after {delay:.1f}s, hedged on {hedge_model}")
+                hedge_future, hedge_copy = self.submit(self.bot.create_thread().id, hedge_model, priority, **message)
+                hedge_copy["hedge"] = True
+                pending[hedge_future] = hedge_copy
+
+        winner, fallback, error = None, None, None
+        while pending and winner is None:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                copy = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if self.valid(result):
+                    winner = (copy, result)
+                    break
+                if fallback is not None:
+                    self.hedge.wasted(priority, self._tokens(fallback[1]))
+                fallback = (copy, result)
+
+        for future, copy in pending.items():
+            copy["cancel"].set()
+            future.add_done_callback(lambda f, p=priority: self.hedge.wasted(p, 0 if f.exception() else self._tokens(f.result())))
+        if winner is None:
+            winner = fallback
+        elif fallback is not None:
+            self.hedge.wasted(priority, self._tokens(fallback[1]))
+        if winner is None:
+            raise error
+        copy, result = winner
+        latencies = [copy["end"] - copy["start"]]
+        if copy is not primary:
+            # the primary lost to its hedge: its latency is at least the time it has run so far
+            latencies.append((primary["end"] or time.perf_counter()) - primary["start"])
+        self.hedge.observe(priority, latencies, self._tokens(result), hedge_won=copy is not primary)
+        return result
+
+    @staticmethod
+    def valid(result):
+        """A reply worth returning: streamed ones are checked against their schema as they arrive."""
+        stream = result.get("stream") or {}
+        if stream.get("parser") is not None:
+            return stream["cancelled"] != "invalid" and not stream["parser"].errors
+        return bool(result.get("reply"))
+
+    @staticmethod
+    def _tokens(result):
+        if isinstance(result, dict) and isinstance(result.get("usage"), dict):
+            return result["usage"].get("total_tokens") or 0
+        return 0
+
+    def ask(self, prompt, schema, priority=Priority.MUTATE, retries=MAX_PARSE_RETRIES, reask_invalid=True):
+        """
+        Structured request: the reply is constrained to schema and goes through the single
+        reply parser. Replies that do not parse (or, with reask_invalid, do not validate) are
+        re-asked with the errors. Returns (data, errors), errors lists the schema violations
+        left in data.
+        """
+        request = prompt
+        for attempt in range(retries + 1):
+            # streamed replies are cut short at the first out-of-range obstacle, except on the
+            # last attempt whose reply is returned even when it does not validate
+            resp = self.process(
+                request, priority=priority, schema=schema, cancel_invalid=reask_invalid and attempt < retries
+            )
+            if resp is None:
+                raise ReplyError("no reply from the LLM")
+            data, errors = self.parse(resp, schema)
+            if data is None or (errors and reask_invalid):
+                self.router.invalid(priority, resp.get("model", self.bot.model))
+            if not errors or (data is not None and not reask_invalid):
+                return data, errors
+            self.logger.warning(f"invalid reply ({len(errors)} errors): {errors[:5]}")
+            if attempt < retries:
+                PARSE_STATS.add("reprompts")
+                request = (
+                    prompt
+                    + "\nYour previous reply was invalid: " + "; ".join(errors[:10])
+                    + "\nReply only with JSON matching the requested format and parameter ranges."
+                )
+        if data is None:
+            raise ReplyError(errors[0])
+        return data, errors
+
+    @staticmethod
+    def parse(resp, schema):
+        stream = resp.get("stream")
+        if stream is None or stream["parser"] is None:
+            return parse_reply(resp["reply"], schema)
+        if stream["first_obstacle_s"] is not None:
+            PARSE_STATS.first(stream["first_obstacle_s"])
+        if stream["cancelled"] is not None:
+            PARSE_STATS.add("early_cancels")
+        if stream["cancelled"] == "invalid":
+            PARSE_STATS.add("replies")
+            PARSE_STATS.add("schema_violations")
+            return None, stream["parser"].errors
+        return stream["parser"].parse()
+
+    def post(self, prompt, img_path, file_path, model, priority, schema):
+        """Uploads, thread and run of one attempt, called on the scheduler executor."""
+        file_id = self.bot.upload_file(Path(file_path)) if file_path is not None else None
+        image_id = self.bot.upload_image(Path(img_path)) if img_path is not None else None
+        return self.bot.post_message_to_thread(
+            thread_id=self.bot.create_thread().id,
+            prompt_text=prompt,
+            file_id=file_id,
+            image_id=image_id,
+            response_format=response_format(schema) if schema is not None else None,
+            model=model,
+            request_class=priority,
+            schema=schema,
+        )
+
+    async def aprocess(self, prompt, img_path=None, file_path=None, max_retries=3, backoff_factor=2, priority=Priority.MUTATE,
+                       schema=None):
+        """
+        Awaitable version of process (not hedged): every attempt is awaited on the scheduler
+        (RequestScheduler.asubmit), the caller holds no thread while the request is queued or running.
+        """
+        retries = 0
+        failed = set()
+        while retries < max_retries:
+            model = self.router.choose(priority, exclude=failed)
+            try:
+                raw_resp = await self.scheduler.asubmit(
+                    functools.partial(self.post, prompt, img_path, file_path, model, priority, schema),
+                    priority=priority,
+                    prompt=prompt,
+                )
+                self.logger.info("Generated submission method code:\n%s", Payload(raw_resp, self.logger))
+                return raw_resp
+            except Exception as e:
+                self.logger.error(f"Error during OpenAI request ({model}): {e}")
+                failed.add(model)
+                retries += 1
+                if retries < max_retries:
+                    wait_time = backoff_factor ** retries
+                    self.logger.warning(f"Retrying in {wait_time} seconds... (Attempt {retries}/{max_retries})")
+                    await asyncio.sleep(wait_time)
+                else:
+                    self.logger.error("Max retries reached. Failing gracefully.")
@@ -0,0 +1,100 @@
+import threading
+from decouple import config
+
+# simulations every mission of a batch is allowed before the budget follows the failure rates
+BATCH_MIN_SHARE = config("BATCH_MIN_SHARE", default=10, cast=int)
+
+
+class BudgetExhausted(Exception):
+    """Raised by Evaluator when the batch refuses a simulation, ends the run of the mission."""
+
+
+class GlobalBudget:
+    """
+    Simulation budget shared by the missions of a batch.
+
+    Every simulation is granted by acquire(mission). A mission is entitled to
+    min_share simulations plus its share of the rest, proportional to its failure rate
+    (failures + 1) / (simulations + 2), so budget flows toward the missions yielding
+    failures fastest and back when they stop. A mission over its share waits until the
+    shares change, unless every active mission is over its share (then it is served).
+    Missions that finished hand their unused share over to the others.
+    """
+
+    def __init__(self, total, min_share=BATCH_MIN_SHARE):
+        self.total = total
+        self.min_share = min_share
+        self.granted = 0
+        self.missions = {}
+        self.cond = threading.Condition()
+
+    def mission(self, name):
+        with self.cond:
+            self.missions[name] = {"granted": 0, "simulated": 0, "failures": 0, "done": False}
+        return MissionBudget(self, name)
+
+    def rate(self, name):
+        m = self.missions[name]
+        return (m["failures"] + 1) / (m["simulated"] + 2)
+
+    def allowance(self, name):
+        active = [n for n, m in self.missions.items() if not m["done"]]
+        spent = sum(m["granted"] for m in self.missions.values() if m["done"])
+        shared = max(0, self.total - spent - self.min_share * len(active))
+        rates = sum(self.rate(n) for n in active)
+        return self.min_share + shared * self.rate(name) / rates
+
+    def _may_grant(self, name):
+        if self.missions[name]["granted"] < self.allowance(name):
+            return True
+        return not any(
+            m["granted"] < self.allowance(n)
+            for n, m in self.missions.items()
+            if n != name and not m["done"]
+        )
+
+    def acquire(self, name):
+        with self.cond:
+            while self.granted < self.total and not self._may_grant(name):
+                self.cond.wait()
+            if self.granted >= self.total:
+                return False
+            self.granted += 1
+            self.missions[name]["granted"] += 1
+            return True
+
+    def report(self, name, failed):
+        with self.cond:
+            m = self.missions[name]
+            m["simulated"] += 1
+            m["failures"] += int(failed)
+            self.cond.notify_all()
+
+    def finish(self, name):
+        with self.cond:
+            self.missions[name]["done"] = True
+            self.cond.notify_all()
+
+    def summary(self):
+        with self.cond:
+            return {
+                name: {**m, "failure_rate": round(m["failures"] / m["simulated"], 3) if m["simulated"] else None}
+                for name, m in self.missions.items()
+            }
+
+
+class MissionBudget:
+    """The view of one mission on a GlobalBudget (Evaluator gate)."""
+
+    def __init__(self, budget, name):
+        self.budget = budget
+        self.name = name
+
+    def acquire(self):
+        return self.budget.acquire(self.name)
+
+    def report(self, failed):
+        self.budget.report(self.name, failed)
+
+    def finish(self):
+        self.budget.finish(self.name)
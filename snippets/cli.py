@@ -1,12 +1,19 @@
 #!/usr/bin/python3
 from argparse import ArgumentParser
-from datetime import datetime
 import logging
 import os
-import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from decouple import config
+from budget import GlobalBudget
 from intelli_generator import IntelliGen
+from utils.helper import Helper
+from utils.logger import get_pipeline
+from utils import profiler
+from workspace import Workspace
+from reply_parser import PARSE_STATS
+from bot.core.router import get_router
+from bot.core.hedge import get_hedge_policy
 
 TESTS_FOLDER = config("TESTS_FOLDER", default="./generated_tests/")
 logger = logging.getLogger(__name__)
@@ -16,7 +23,7 @@ def arg_parse():
     main_parser = ArgumentParser(
         description="UAV Test Generator",
     )
-    subparsers = main_parser.add_subparsers()
+    subparsers = main_parser.add_subparsers(dest="command")
     parser = subparsers.add_parser(name="generate", description="generate tests")
     parser.add_argument("test", help="initial test description file address")
 
@@ -25,51 +32,168 @@ def arg_parse():
         type=int,
         help="test generation budget (total number of simulations allowed)",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample the run and write flame graph stacks and a hotspot summary to <output folder>/profile",
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=5,
+        help="profiler sampling interval (ms)",
+    )
+    parser.add_argument(
+        "--trace-alloc",
+        action="store_true",
+        help="with --profile, also track allocations with tracemalloc (slows allocation heavy code down)",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=25,
+        help="number of hotspots/allocation sites in the profile summary",
+    )
+
+    batch = subparsers.add_parser(
+        name="batch",
+        description="generate tests for several missions sharing one simulation budget, LLM client and simulator pool",
+    )
+    batch.add_argument("tests", nargs="+", help="initial test description files")
+    batch.add_argument(
+        "--budget",
+        type=int,
+        required=True,
+        help="global test generation budget (simulations of all the missions together)",
+    )
+    batch.add_argument(
+        "--parallel",
+        type=int,
+        default=0,
+        help="missions running at the same time (default: all)",
+    )
 
     args = main_parser.parse_args()
     return args
 
 
-def config_loggers():
-    os.makedirs("logs/", exist_ok=True)
-    logging.basicConfig(
-        level=logging.DEBUG,
-        filename="logs/debug.txt",
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    )
-
+def config_loggers(log_dir="logs"):
     root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    pipeline = get_pipeline()
+
     # terminal logs
     c_handler = logging.StreamHandler()
     c_handler.setLevel(logging.INFO)
     c_format = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
     c_handler.setFormatter(c_format)
-    root.addHandler(c_handler)
 
     # file logs
-    f_handler = logging.FileHandler("logs/info.txt")
-    f_handler.setLevel(logging.INFO)
-    f_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    f_handler.setFormatter(f_format)
-    root.addHandler(f_handler)
+    d_handler = pipeline.file_handler(
+        os.path.join(log_dir, "debug.txt"),
+        level=logging.DEBUG,
+        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    f_handler = pipeline.file_handler(
+        os.path.join(log_dir, "info.txt"),
+        level=logging.INFO,
+        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
 
+    # all of them are written by the log pipeline thread, not by the caller
+    pipeline.attach(root, [d_handler, c_handler, f_handler])
 
-if __name__ == "__main__":
-    config_loggers()
+
+def export_tests(gen, test_cases, tests_fld, log):
+    """Copy the retained tests of a run to tests_fld and log its reports."""
+    os.makedirs(tests_fld, exist_ok=True)
+    for i, handle in enumerate(test_cases):
+        handle.export(tests_fld, f"test_{i}")
+    print(f"{len(test_cases)} test cases generated")
+    print(f"output folder: {tests_fld}")
+    fidelity = gen.evaluator.report()
+    if fidelity is not None:
+        print(f"multi-fidelity: {fidelity}")
+        log.info(f"multi-fidelity report: {fidelity}")
+    log.info(f"simulation latency (pooled vs. not pooled):\n{Helper.latency_summary(gen.workspace.sim_latency)}")
+    log.info(f"LLM replies: {PARSE_STATS.report()}")
+    log.info(f"LLM routing: {get_router().report()}")
+    log.info(f"LLM hedging: {get_hedge_policy().report()}")
+
+
+def generate(args):
+    # every file of the run goes to its own workspace, runs can share the host
+    workspace = Workspace.create(args.test)
+    config_loggers(workspace.logs)
+    tests_fld = f'{TESTS_FOLDER}{workspace.name}/'
+    if args.profile:
+        profiler.start(
+            os.path.join(tests_fld, "profile"),
+            interval=args.profile_interval / 1000,
+            trace_alloc=args.trace_alloc,
+            top=args.profile_top,
+        )
     try:
-        args = arg_parse()
-        gen = IntelliGen(logger, args.test)
+        gen = IntelliGen(logger, args.test, workspace)
         test_cases = gen.run(args.budget)
+    finally:
+        summary = profiler.stop()
+        if summary is not None:
+            print(summary)
+            print(f"profile written to: {os.path.join(tests_fld, 'profile')}")
+
+    ## copying the test cases to the output folder
+    export_tests(gen, test_cases, tests_fld, logger)
 
-        ## copying the test cases to the output folder
-        tests_fld = f'{TESTS_FOLDER}{datetime.now().strftime("%d-%m-%H-%M-%S")}/'
-        os.makedirs(tests_fld, exist_ok=True)
-        for i in range(len(test_cases)):
-            test_cases[i].save_yaml(f"{tests_fld}/test_{i}.yaml")
-            shutil.copy2(test_cases[i].log_file, f"{tests_fld}/test_{i}.ulg")
-            shutil.copy2(test_cases[i].plot_file, f"{tests_fld}/test_{i}.png")
-        print(f"{len(test_cases)} test cases generated")
-        print(f"output folder: {tests_fld}")
+
+def run_mission(mission, budget):
+    """One mission of a batch, in its own workspace, output folder and log files."""
+    workspace = Workspace.create(mission)
+    log = logging.getLogger(f"mission.{workspace.name}")
+    pipeline = get_pipeline()
+    pipeline.attach(
+        log,
+        [pipeline.file_handler(
+            os.path.join(workspace.logs, "info.txt"),
+            level=logging.INFO,
+            fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        )],
+    )
+    gen = IntelliGen(log, mission, workspace)
+    # joins the budget once its SOI is ready, so it never holds the other missions back meanwhile
+    test_cases = gen.run(budget.total, budget.mission(workspace.name))
+    export_tests(gen, test_cases, f"{TESTS_FOLDER}{workspace.name}/", log)
+    return len(test_cases)
+
+
+def batch(args):
+    # the batch folder only holds the process logs, every mission gets its own workspace
+    config_loggers(Workspace.create("batch").logs)
+    budget = GlobalBudget(args.budget)
+    parallel = args.parallel or len(args.tests)
+    failed = False
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="mission") as executor:
+        futures = {mission: executor.submit(run_mission, mission, budget) for mission in args.tests}
+        for mission, future in futures.items():
+            try:
+                logger.info(f"{mission}: {future.result()} test cases generated")
+            except Exception as e:
+                failed = True
+                logger.exception(f"{mission} terminated: {e}")
+    for name, stats in budget.summary().items():
+        print(f"{name}: {stats}")
+        logger.info(f"batch budget {name}: {stats}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = arg_parse()
+    try:
+        if args.command == "batch":
+            batch(args)
+        else:
+            generate(args)
 
     except Exception as e:
         logger.exception("program terminated:" + str(e), exc_info=True)
@@ -0,0 +1,105 @@
+import numpy as np
+from decouple import config
+from numeric_mutation import PARAMS, obstacles_to_vector
+
+FIELD_RESOLUTION = config("FIELD_RESOLUTION", default=0.25, cast=float)
+# path samples closer than this (m) to a footprint count as blocked (UAV radius)
+FIELD_MARGIN = config("FIELD_MARGIN", default=0.5, cast=float)
+
+
+class DistanceField:
+    """
+    Raster of the test area (X in [-40, 30], Y in [10, 40], same as check_within_boundary)
+    holding the distance of every cell to the SOI polyline, plus the SOI resampled at a
+    fixed step. Candidates are scored with vectorised lookups only, so whole batches of LLM
+    or numeric configs can be ranked before spending a simulation.
+
+    Candidates are arrays of shape (C, n_obstacles, 6) with the numeric_mutation.PARAMS
+    order (x, y, l, w, h, r), or lists of obstacle configs (see to_array).
+    """
+
+    def __init__(self, soi_xy, resolution=FIELD_RESOLUTION, x_range=(-40.0, 30.0), y_range=(10.0, 40.0), path_step=1.0):
+        self.soi = np.asarray(soi_xy, dtype=float)
+        self.resolution = resolution
+        self.x0, self.y0 = x_range[0], y_range[0]
+        self.nx = int(np.ceil((x_range[1] - x_range[0]) / resolution)) + 1
+        self.ny = int(np.ceil((y_range[1] - y_range[0]) / resolution)) + 1
+        xs = self.x0 + np.arange(self.nx) * resolution
+        ys = self.y0 + np.arange(self.ny) * resolution
+        gx, gy = np.meshgrid(xs, ys, indexing="ij")
+        cells = np.stack([gx.ravel(), gy.ravel()], axis=1)
+        self.grid = self.distance_to_polyline(cells).reshape(self.nx, self.ny)
+        self.path = self.resample(path_step).astype(np.float32)
+
+    def distance_to_polyline(self, points, chunk=64):
+        a_all, b_all = self.soi[:-1], self.soi[1:]
+        best = np.full(len(points), np.inf)
+        if len(a_all) == 0:
+            return np.linalg.norm(points - self.soi[0], axis=1)
+        for i in range(0, len(a_all), chunk):
+            a, b = a_all[i:i + chunk], b_all[i:i + chunk]
+            ab = b - a
+            length2 = np.maximum((ab ** 2).sum(axis=1), 1e-12)
+            ap = points[:, None, :] - a[None, :, :]
+            t = np.clip((ap * ab[None]).sum(axis=2) / length2[None], 0.0, 1.0)
+            closest = a[None] + t[..., None] * ab[None]
+            d = np.linalg.norm(points[:, None, :] - closest, axis=2).min(axis=1)
+            best = np.minimum(best, d)
+        return best
+
+    def resample(self, step):
+        seg = np.linalg.norm(np.diff(self.soi, axis=0), axis=1)
+        arc = np.concatenate([[0.0], np.cumsum(seg)])
+        if arc[-1] == 0:
+            return self.soi[:1]
+        s = np.arange(0.0, arc[-1] + step, step)
+        return np.stack([np.interp(s, arc, self.soi[:, 0]), np.interp(s, arc, self.soi[:, 1])], axis=1)
+
+    @staticmethod
+    def to_array(configs):
+        """List of obstacle lists (YAML/LLM format) -> (C, n_obstacles, 6) array."""
+        return np.stack([obstacles_to_vector(obs).reshape(-1, len(PARAMS)) for obs in configs])
+
+    def lookup(self, x, y):
+        """Nearest cell distance to the SOI, outside the raster the border cell is used."""
+        i = np.clip(np.rint((x - self.x0) / self.resolution).astype(int), 0, self.nx - 1)
+        j = np.clip(np.rint((y - self.y0) / self.resolution).astype(int), 0, self.ny - 1)
+        return self.grid[i, j]
+
+    def _footprint(self, candidates):
+        c = np.asarray(candidates, dtype=np.float32)
+        if c.ndim == 2:
+            c = c[None]
+        x, y, l, w, r = c[..., 0], c[..., 1], c[..., 2], c[..., 3], np.radians(c[..., 5])
+        return x, y, l, w, np.cos(r), np.sin(r)
+
+    def blocked_fraction(self, candidates, margin=FIELD_MARGIN):
+        """Share of the SOI path inside any obstacle footprint (grown by margin), shape (C,)."""
+        x, y, l, w, cos, sin = self._footprint(candidates)
+        # path in each obstacle frame: u along l, v along w
+        px = self.path[:, 0] * cos[..., None] + self.path[:, 1] * sin[..., None]
+        py = self.path[:, 1] * cos[..., None] - self.path[:, 0] * sin[..., None]
+        cu = (x * cos + y * sin)[..., None]
+        cv = (y * cos - x * sin)[..., None]
+        inside = np.abs(px - cu) <= (l / 2 + margin)[..., None]
+        inside &= np.abs(py - cv) <= (w / 2 + margin)[..., None]
+        return inside.any(axis=1).mean(axis=1)
+
+    def clearance(self, candidates):
+        """Smallest SOI distance over the footprint corners, edge midpoints and centres, shape (C,)."""
+        x, y, l, w, cos, sin = self._footprint(candidates)
+        offsets = np.array([-0.5, 0.0, 0.5])
+        u = (l[..., None, None] * offsets[:, None])
+        v = (w[..., None, None] * offsets[None, :])
+        px = x[..., None, None] + u * cos[..., None, None] - v * sin[..., None, None]
+        py = y[..., None, None] + u * sin[..., None, None] + v * cos[..., None, None]
+        return self.lookup(px, py).reshape(px.shape[0], -1).min(axis=1)
+
+    def score(self, candidates):
+        """(blocked_fraction, clearance) of every candidate."""
+        return self.blocked_fraction(candidates), self.clearance(candidates)
+
+    def rank(self, candidates):
+        """Candidate indices, most blocking first, ties broken by the smallest clearance."""
+        blocked, clearance = self.score(candidates)
+        return np.lexsort((clearance, -blocked))
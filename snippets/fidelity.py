@@ -0,0 +1,123 @@
+import random
+import threading
+import time
+from decouple import config
+from testcase import TestCase, SIM_LATENCY_LOG
+from budget import BudgetExhausted
+from utils.helper import Helper
+
+MULTI_FIDELITY = config("MULTI_FIDELITY", default=False, cast=bool)
+SCREEN_SPEED = config("SCREEN_SPEED", default=3, cast=float)
+# screening min distance (m) under which a config is re-run at full fidelity
+SCREEN_THRESHOLD = config("SCREEN_THRESHOLD", default=3.0, cast=float)
+# fraction of screened-out configs re-run anyway, to measure the tier agreement
+FIDELITY_AUDIT_RATE = config("FIDELITY_AUDIT_RATE", default=0.1, cast=float)
+# a test is a failure below this distance (m), same as the seed/mutation loops
+FAILURE_DISTANCE = 1.5
+
+
+class Evaluator:
+    """
+    Runs the simulation of an obstacle configuration for the seed and mutation loops.
+
+    With MULTI_FIDELITY a config is first screened at SCREEN_SPEED times real time, and only
+    configs whose screening min distance is below SCREEN_THRESHOLD (plus a random
+    FIDELITY_AUDIT_RATE of the others) are re-run at full fidelity. Every tier pair is logged
+    to fidelity.csv, report() gives the tier agreement and the wall-clock saved.
+
+    gate (budget.MissionBudget, set by IntelliGen.run in batch mode) grants every simulation,
+    BudgetExhausted is raised once the batch budget is used.
+
+    early_abort (flight_monitor.EarlyAbort, set by IntelliGen with FLIGHT_MONITOR) stops the
+    simulations whose outcome is decided before the end of the mission.
+
+    extra_runs counts the simulations beyond one per evaluation (the full fidelity re-runs),
+    the callers counting evaluations add it to stay within their simulation budget.
+    """
+
+    COL = ["screen_distance", "screen_s", "full_distance", "full_s", "audit"]
+
+    def __init__(self, logger, template, enabled=MULTI_FIDELITY, report_path="fidelity.csv", latency_log=SIM_LATENCY_LOG):
+        self.log = logger
+        self.template = template
+        self.enabled = enabled
+        self.report_path = report_path
+        self.latency_log = latency_log
+        self.records = []
+        self.gate = None
+        self.early_abort = None
+        self.extra_runs = 0
+        self.lock = threading.Lock()
+
+    def _run(self, obstacles, speed=None):
+        if self.gate is not None and not self.gate.acquire():
+            raise BudgetExhausted("batch simulation budget used")
+        test = TestCase(
+            self.template, obstacles, speed=speed, latency_log=self.latency_log, early_abort=self.early_abort
+        )
+        start = time.perf_counter()
+        test.execute()
+        return test, min(test.get_distances()), time.perf_counter() - start
+
+    def evaluate(self, obstacles):
+        """Returns the executed TestCase (full fidelity unless screened out)."""
+        test = self._evaluate(obstacles)
+        if self.gate is not None:
+            self.gate.report(test.full_fidelity and min(test.get_distances()) < FAILURE_DISTANCE)
+        return test
+
+    def _evaluate(self, obstacles):
+        if not self.enabled:
+            return self._run(obstacles)[0]
+
+        screen, screen_distance, screen_s = self._run(obstacles, SCREEN_SPEED)
+        promoted = screen_distance < SCREEN_THRESHOLD
+        audit = not promoted and random.random() < FIDELITY_AUDIT_RATE
+        if not (promoted or audit):
+            self.log.info(f"screened out at x{SCREEN_SPEED}: min distance {screen_distance:.2f}m")
+            self._record([screen_distance, round(screen_s, 3), None, None, False])
+            return screen
+
+        with self.lock:
+            self.extra_runs += 1
+        full, full_distance, full_s = self._run(obstacles)
+        self.log.info(
+            f"{'audit' if audit else 'promoted'}: screening {screen_distance:.2f}m, full fidelity {full_distance:.2f}m"
+        )
+        self._record([screen_distance, round(screen_s, 3), full_distance, round(full_s, 3), audit])
+        return full
+
+    def _record(self, row):
+        # islands evaluate concurrently, the header check and the write must not interleave
+        with self.lock:
+            self.records.append(dict(zip(self.COL, row)))
+            Helper.write_csv(self.COL, row, self.report_path)
+
+    def report(self):
+        if not self.enabled or not self.records:
+            return None
+        paired = [r for r in self.records if r["full_distance"] is not None]
+        agree = [
+            (r["screen_distance"] < FAILURE_DISTANCE) == (r["full_distance"] < FAILURE_DISTANCE)
+            for r in paired
+        ]
+        full_times = [r["full_s"] for r in paired]
+        mean_full = sum(full_times) / len(full_times) if full_times else None
+        spent = sum(r["screen_s"] + (r["full_s"] or 0) for r in self.records)
+        single_tier = mean_full * len(self.records) if mean_full is not None else None
+        audits = [r for r in paired if r["audit"]]
+        return {
+            "evaluated": len(self.records),
+            "full_fidelity_runs": len(paired),
+            "failure_agreement": sum(agree) / len(agree) if agree else None,
+            "mean_abs_distance_gap": (
+                sum(abs(r["screen_distance"] - r["full_distance"]) for r in paired) / len(paired)
+                if paired else None
+            ),
+            # screened-out configs that failed at full fidelity (estimated from the audits)
+            "missed_failures": sum(r["full_distance"] < FAILURE_DISTANCE for r in audits),
+            "audited": len(audits),
+            "wall_clock_s": round(spent, 1),
+            "single_fidelity_estimate_s": round(single_tier, 1) if single_tier is not None else None,
+            "saved_s": round(single_tier - spent, 1) if single_tier is not None else None,
+        }
@@ -0,0 +1,300 @@
+import logging
+import os
+import re
+import struct
+import subprocess
+import tempfile
+import threading
+import numpy as np
+from decouple import config
+
+try:
+    from aerialist.px4.aerialist_test import AerialistTestResult
+except ImportError:  # older aerialist releases
+    from aerialist.px4.drone_test import DroneTestResult as AerialistTestResult
+
+# docker agent only: a local run shares its PX4 log folder and processes with everything else on the host
+FLIGHT_MONITOR = config("FLIGHT_MONITOR", default=False, cast=bool)
+# PX4 SITL log folder inside the simulator container
+MONITOR_LOG_DIR = config("MONITOR_LOG_DIR", default="/src/PX4-Autopilot/build/px4_sitl_default/rootfs/log/")
+# seconds between two reads of the growing log
+MONITOR_INTERVAL = config("MONITOR_INTERVAL", default=1.0, cast=float)
+# abort once the UAV is this close (m) to an obstacle, the min distance cannot get any lower
+MONITOR_COLLISION_DISTANCE = config("MONITOR_COLLISION_DISTANCE", default=0.0, cast=float)
+# abort once the UAV is this far (m) along the SOI past every obstacle, never closer than that to any of them
+MONITOR_PASS_CLEARANCE = config("MONITOR_PASS_CLEARANCE", default=5.0, cast=float)
+# seconds the agent gets to return after an abort before it is abandoned
+MONITOR_GRACE = config("MONITOR_GRACE", default=15.0, cast=float)
+# stops the flight inside the container of the run, the mission client of the agent then fails and returns
+KILL_CMD = "pkill -9 -f 'px4|gzserver|gzclient'"
+ULOG_MAGIC = b"ULog\x01\x12\x35"
+
+logger = logging.getLogger(__name__)
+
+
+class ULogTail:
+    """
+    Incremental ULog reader: feed() it the bytes appended to a growing log, it returns the
+    (timestamp, x, y) samples of the topic completed by them. Only the format definitions,
+    the subscription of the topic and its data messages are decoded, an incomplete trailing
+    message is kept for the next feed().
+    """
+
+    SIZES = {
+        "int8_t": 1, "uint8_t": 1, "bool": 1, "char": 1,
+        "int16_t": 2, "uint16_t": 2,
+        "int32_t": 4, "uint32_t": 4, "float": 4,
+        "int64_t": 8, "uint64_t": 8, "double": 8,
+    }
+    FIELDS = (("timestamp", "Q"), ("x", "f"), ("y", "f"))
+
+    def __init__(self, topic="vehicle_local_position"):
+        self.topic = topic
+        self.buffer = bytearray()
+        self.started = False
+        self.formats = {}
+        self.msg_id = None
+        self.layout = None
+
+    def size_of(self, kind):
+        match = re.fullmatch(r"(.+)\[(\d+)\]", kind)
+        count = 1
+        if match:
+            kind, count = match.group(1), int(match.group(2))
+        if kind in self.SIZES:
+            return self.SIZES[kind] * count
+        return sum(self.size_of(t) for t, _ in self.formats[kind]) * count
+
+    def compile(self):
+        """struct reading FIELDS out of a data message of the topic (padding fields are explicit in ULog)."""
+        offsets, offset = {}, 0
+        for kind, name in self.formats[self.topic]:
+            offsets[name] = offset
+            offset += self.size_of(kind)
+        fmt, cursor = "<", 0
+        for name, code in self.FIELDS:
+            fmt += f"{offsets[name] - cursor}x{code}"
+            cursor = offsets[name] + struct.calcsize(f"<{code}")
+        return struct.Struct(fmt)
+
+    def feed(self, chunk):
+        buf = self.buffer
+        buf += chunk
+        pos = 0
+        if not self.started:
+            if len(buf) < 16:
+                return []
+            if bytes(buf[:7]) != ULOG_MAGIC:
+                raise ValueError("not a ULog file")
+            self.started = True
+            pos = 16
+        samples = []
+        while len(buf) - pos >= 3:
+            size, kind = struct.unpack_from("<HB", buf, pos)
+            start, end = pos + 3, pos + 3 + size
+            if end > len(buf):
+                break
+            if kind == ord("D"):
+                if self.layout is not None and struct.unpack_from("<H", buf, start)[0] == self.msg_id:
+                    samples.append(self.layout.unpack_from(buf, start + 2))
+            elif kind == ord("F"):
+                name, _, fields = bytes(buf[start:end]).decode("ascii", "replace").partition(":")
+                self.formats[name] = [tuple(f.split(" ", 1)) for f in fields.split(";") if f]
+            elif kind == ord("A"):
+                multi_id, msg_id = struct.unpack_from("<BH", buf, start)
+                if multi_id == 0 and bytes(buf[start + 3:end]).decode("ascii", "replace") == self.topic:
+                    self.msg_id = msg_id
+                    self.layout = self.compile()
+            pos = end
+        del buf[:pos]
+        return samples
+
+
+class ContainerLog:
+    """
+    Newest PX4 log created in log_dir of a simulator container after the monitor started,
+    the appended bytes are fetched with docker exec tail. The container runs one test at a
+    time (its own, or acquired from the pool), so the log and the processes killed by an
+    abort belong to this run.
+    """
+
+    def __init__(self, container_id, log_dir=MONITOR_LOG_DIR, owned=True):
+        self.container_id = container_id
+        # pooled containers are retired by the pool, the others are removed here if the agent hangs
+        self.owned = owned
+        self.log_dir = log_dir
+        self.path = None
+        self.offset = 0
+        self.known = set(self.list())
+
+    def exec(self, cmd):
+        return subprocess.run(f"docker exec {self.container_id} {cmd}", shell=True, capture_output=True)
+
+    def list(self):
+        found = self.exec(f"find {self.log_dir} -name '*.ulg'")
+        return found.stdout.decode("ascii", "replace").split() if found.returncode == 0 else []
+
+    def find(self):
+        if self.path is None:
+            new = set(self.list()) - self.known
+            # PX4 names the logs <date>/<time>.ulg
+            self.path = max(new) if new else None
+        return self.path
+
+    def read(self):
+        if self.find() is None:
+            return b""
+        tail = self.exec(f"tail -c +{self.offset + 1} {self.path}")
+        if tail.returncode != 0:
+            return b""
+        self.offset += len(tail.stdout)
+        return tail.stdout
+
+    def abort(self):
+        self.exec(f'bash -c "{KILL_CMD}"')
+
+    def release(self):
+        if self.owned:
+            subprocess.run(f"docker rm -f {self.container_id}", shell=True, capture_output=True)
+
+
+class FlightMonitor:
+    """
+    Tails the log of a running simulation (source: ContainerLog) and keeps the
+    min distance of the UAV to the obstacles up to date. The run is aborted as soon as its
+    outcome is decided:
+
+        collision   min distance <= MONITOR_COLLISION_DISTANCE
+        passed      the UAV is MONITOR_PASS_CLEARANCE past every obstacle along the SOI
+                    (route) and never came closer than MONITOR_PASS_CLEARANCE to any of them
+
+    The bytes read so far are written to a ULog in out_dir, kept as the artifact of an
+    aborted run (a ULog cut at a message boundary is a valid log) and removed otherwise.
+    Positions are the raw vehicle_local_position x, y, the frame the obstacles are given in.
+    """
+
+    def __init__(self, source, obstacles, out_dir, route=None, interval=MONITOR_INTERVAL,
+                 collision=MONITOR_COLLISION_DISTANCE, clearance=MONITOR_PASS_CLEARANCE):
+        self.source = source
+        self.interval = interval
+        self.collision = collision
+        self.clearance = clearance
+        self.tail = ULogTail()
+        self.min_distance = float("inf")
+        self.progress = 0.0
+        self.samples = 0
+        self.outcome = None
+        self.obstacles = np.array([
+            [o.position.x, o.position.y, o.size.l / 2, o.size.w / 2, np.radians(o.position.r)] for o in obstacles
+        ], dtype=float).reshape(-1, 5)
+        self.route, self.arc, self.passed_at = None, None, None
+        if route is not None and len(route) > 1 and len(self.obstacles):
+            self.route = np.asarray(route, dtype=float)
+            self.arc = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(self.route, axis=0), axis=1))])
+            self.passed_at = self.locate(self.obstacles[:, :2]).max() + clearance
+        os.makedirs(out_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=out_dir, prefix="aborted-", suffix=".ulg")
+        self.out = os.fdopen(fd, "wb")
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, name="flight-monitor", daemon=True)
+
+    def locate(self, points):
+        """Arc length along the route of the route point closest to each point."""
+        d = np.linalg.norm(points[:, None, :] - self.route[None], axis=2)
+        return self.arc[d.argmin(axis=1)]
+
+    def distances(self, points):
+        """(P,) distance of every point to the closest obstacle footprint (rotated l x w rectangles)."""
+        x, y, hl, hw, r = self.obstacles.T
+        dx, dy = points[:, 0, None] - x, points[:, 1, None] - y
+        cos, sin = np.cos(r), np.sin(r)
+        u = np.abs(dx * cos + dy * sin) - hl
+        v = np.abs(dy * cos - dx * sin) - hw
+        return np.hypot(np.maximum(u, 0), np.maximum(v, 0)).min(axis=1)
+
+    def update(self, samples):
+        points = np.array([[x, y] for _, x, y in samples], dtype=float)
+        self.samples += len(points)
+        if len(self.obstacles) == 0:
+            return None
+        self.min_distance = min(self.min_distance, float(self.distances(points).min()))
+        if self.min_distance <= self.collision:
+            return "collision"
+        if self.passed_at is not None:
+            self.progress = max(self.progress, float(self.locate(points).max()))
+            if self.progress >= self.passed_at and self.min_distance > self.clearance:
+                return "passed"
+        return None
+
+    def watch(self):
+        while not self.stopped.is_set():
+            try:
+                data = self.source.read()
+                if data:
+                    self.out.write(data)
+                    samples = self.tail.feed(data)
+                    if samples:
+                        self.outcome = self.update(samples)
+            except Exception as e:
+                # the run itself is never disturbed by the monitor
+                logger.warning(f"flight monitor stopped: {e}")
+                return
+            if self.outcome is not None:
+                logger.info(
+                    f"early abort ({self.outcome}): min distance {self.min_distance:.2f}m after {self.samples} samples"
+                )
+                self.source.abort()
+                return
+            self.stopped.wait(self.interval)
+
+    def run(self, agent, grace=MONITOR_GRACE):
+        """
+        agent.run() while tailing its log. Returns (results, finished): the agent results, or the
+        partial log of an aborted run, and whether the agent returned (False: it was abandoned).
+        """
+        outcome = {}
+
+        def target():
+            try:
+                outcome["results"] = agent.run()
+            except Exception as e:
+                outcome["error"] = e
+
+        runner = threading.Thread(target=target, name="agent", daemon=True)
+        self.thread.start()
+        runner.start()
+        while runner.is_alive() and self.outcome is None:
+            runner.join(0.5)
+        if self.outcome is not None:
+            runner.join(grace)
+        self.stopped.set()
+        self.thread.join()
+        self.out.close()
+        if self.outcome is None:
+            os.remove(self.path)
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["results"], True
+        finished = not runner.is_alive()
+        if not finished:
+            logger.warning(f"agent still running {grace}s after the abort, abandoned")
+            self.source.release()
+        return [AerialistTestResult(self.path)], finished
+
+
+class EarlyAbort:
+    """
+    Monitoring settings of a generator run (Evaluator.early_abort): the SOI route the
+    passed decision is taken on and the folder of the partial logs.
+    """
+
+    def __init__(self, route, out_dir, log_dir=MONITOR_LOG_DIR):
+        self.route = route
+        self.out_dir = out_dir
+        self.log_dir = log_dir
+
+    def monitor(self, obstacles, container_id=None, pooled=False):
+        """FlightMonitor of a test, None (the run is not monitored) unless it runs in a container."""
+        if container_id is None:
+            return None
+        return FlightMonitor(ContainerLog(container_id, self.log_dir, owned=not pooled), obstacles, self.out_dir, route=self.route)
@@ -2,21 +2,32 @@ import os
 
 import yaml
 from bot.prompter import Prompter
+from bot.core.scheduler import Priority
 from utils.helper import Helper
+from utils.logger import Payload
 from test_validator import TestValidator
+from reply_parser import PARSE_STATS, config_schema
 from bot.sys_prompts.mutate_config import SYSTEM_PROMPT
 
 
 class GenerateMutation:
-    def __init__(self,logger, case_study, soi):
+    def __init__(self,logger, case_study, soi, workspace=None, results_path=None):
         """
         base_config_file -> will be used to write the base yaml file
         base_trajectory_path - > defines the base trajectory that UAV will follow 
+        workspace -> workspace.Workspace of the run, results.csv/gen_config/ in the working directory if None
+        results_path -> fitness history of the prompts (best/worst cases), the workspace's results.csv if None
         """
         self.logger = logger
         self.soi = soi
         self.case_study = case_study 
-        self.gen = Prompter(logger=logger, system_prompt=SYSTEM_PROMPT)
+        self.results_path = results_path or (workspace.results if workspace is not None else "results.csv")
+        self.out_dir = workspace.gen_config if workspace is not None else "gen_config"
+        self.gen = Prompter(
+            logger=logger,
+            system_prompt=SYSTEM_PROMPT,
+            token_log=workspace.tokens if workspace is not None else None,
+        )
         self.val = TestValidator(logger)
 
     def get_prompt(self, flight_trajectory, previous_obstacle_config):
@@ -55,6 +66,10 @@ class GenerateMutation:
         """
         return prompt
     
+    def tell(self, obstacles, distance):
+        """Fitness history of the LLM mutation is read from the run's results.csv (best_worse_fitness)."""
+        pass
+
     def get_duplicated_config_prompt(self):
         prompt = """
         The generated obstacle configuration is a duplicate of previous one. 
@@ -64,26 +79,26 @@ class GenerateMutation:
         """
         return prompt
 
-    def generate_mutated_obstacles_config(self, flight_trajectory_path, previous_obstacle_config, test_dir, iter):
-        
-        # import previous flight trajectory for reference
-        flight_trajectory = Helper.read_ulg(flight_trajectory_path, 30)
-        # Load Yaml to get previous obstacle configuration
-        obstacles = Helper.load_config(previous_obstacle_config)
-        # Generate mutated obstacle configuration
-        prompt = self.get_prompt(str(flight_trajectory), obstacles)
-        first_trial, record = Helper.best_worse_fitness(f"results.csv")
+    def generate_mutated_obstacles_config(self, flight_trajectory, previous_obstacles, test_dir, iter):
+        """
+        flight_trajectory -> sampled path of the previous flight (see Helper.read_ulg)
+        previous_obstacles -> obstacle list of the previous configuration
+        Returns the parsed configuration, <out_dir>/mission_iter{iter}.yaml is only written as an artifact.
+        """
+        # Generate mutated obstacle configuration, replies constrained to the same number of obstacles
+        schema = config_schema(len(previous_obstacles))
+        prompt = self.get_prompt(flight_trajectory, str(previous_obstacles))
+        first_trial, record = Helper.best_worse_fitness(self.results_path)
         
         if first_trial:
             print("First Trial - No previous fitness record.")
-            self.logger .info(f"Generated Prompt for LLM: \n {prompt}")
-            resp = self.gen.process(prompt)
+            self.logger.info("Generated Prompt for LLM: \n %s", Payload(prompt, self.logger))
+            parsed_data, _ = self.gen.ask(prompt, schema, priority=Priority.MUTATE)
         else:
             prompt = prompt + "The best and worse cases are as follow, always try to pick the best config as reference while generating a new one as the goal is to make sure UAV will crash: \n " + record
-            self.logger .info(f"Generated Prompt for LLM: \n {prompt}")
-            resp = self.gen.process(prompt)
-        
-        parsed_data = Helper.parse_response(resp['reply'])
+            prompt = prompt + "\n The novelty of a case is the mean distance (m) of its flight path to the closest flights seen before, a low novelty means the configuration repeats an avoidance behaviour already tested, prefer changes that make the UAV fly a new path. \n"
+            self.logger.info("Generated Prompt for LLM: \n %s", Payload(prompt, self.logger))
+            parsed_data, _ = self.gen.ask(prompt, schema, priority=Priority.MUTATE)
         
         # Sanity Checks
         overlapped = self.val.any_overlap(parsed_data['obstacles'])
@@ -96,14 +111,15 @@ class GenerateMutation:
                 print("Regenerating due to duplicate test case...")
                 self.logger.info("Regenerating due to duplicate test case...")
                 new_prompt = self.get_duplicated_config_prompt() + prompt
-                self.logger.info(f"Regen Prompt: \n {new_prompt}")
-                resp = self.gen.process(new_prompt)
-                parsed_data = Helper.parse_response(resp['reply'])
+                self.logger.info("Regen Prompt: \n %s", Payload(new_prompt, self.logger))
+                PARSE_STATS.add("reprompts")
+                parsed_data, _ = self.gen.ask(new_prompt, schema, priority=Priority.DEDUP)
                 test = Helper.get_hash(parsed_data)
             else:
                 self.logger.info("Got new unique test case, updating test directory")
                 test_dir.add(test)
-                self.logger.info(f"The Test Directory: {test_dir}")
+                self.logger.info("The Test Directory: %d configs", len(test_dir))
+                self.logger.debug("The Test Directory: %s", test_dir)
                 break
         
         ol_loop = 1
@@ -111,9 +127,9 @@ class GenerateMutation:
             print("Regenerating due to overlap...")
             self.logger.info(f"Regenerating due to overlap... iter:{ol_loop}")
             new_prompt = "We have overlapping obstacles in the previous configuration. Please generate a new configuration without any overlapping obstacles." + prompt
-            self.logger.info(f"New Prompt to avoid overlappig: {new_prompt}")
-            resp = self.gen.process(new_prompt)
-            parsed_data = Helper.parse_response(resp['reply'])
+            self.logger.info("New Prompt to avoid overlappig: %s", Payload(new_prompt, self.logger))
+            PARSE_STATS.add("reprompts")
+            parsed_data, _ = self.gen.ask(new_prompt, schema, priority=Priority.REPAIR)
             overlapped = self.val.any_overlap(parsed_data['obstacles'])
             ol_loop += 1
             print("Sanity Check - Any Overlap:", overlapped)
@@ -127,9 +143,9 @@ class GenerateMutation:
             the ground. Please generate a new configuration that satisfies these conditions, obstacles must
             be placed directly on the ground (z = 0), be taller than UAV flight height (h > 10 m)
             """ + prompt
-            self.logger.info(f"New Prompt to obtain minimum height: {new_prompt}")
-            resp = self.gen.process(new_prompt)
-            parsed_data = Helper.parse_response(resp['reply'])
+            self.logger.info("New Prompt to obtain minimum height: %s", Payload(new_prompt, self.logger))
+            PARSE_STATS.add("reprompts")
+            parsed_data, _ = self.gen.ask(new_prompt, schema, priority=Priority.REPAIR)
             min_height_check = self.val.check_based_and_min_height(parsed_data['obstacles'])
             mh_loop += 1
             print("Sanity Check - Min Height Valid:", min_height_check)
@@ -142,16 +158,16 @@ class GenerateMutation:
             Some obstacles have parameters that are out of the valid ranges. 
             Please generate a new configuration with all parameters within the specified ranges.
             """ + prompt
-            self.logger.info(f"New Prompt to make sure we are within containts: {new_prompt}")
-            resp = self.gen.process(new_prompt)
-            parsed_data = Helper.parse_response(resp['reply'])
+            self.logger.info("New Prompt to make sure we are within containts: %s", Payload(new_prompt, self.logger))
+            PARSE_STATS.add("reprompts")
+            parsed_data, _ = self.gen.ask(new_prompt, schema, priority=Priority.REPAIR)
             within_range = self.val.check_obstacle_parameter_ranges(parsed_data['obstacles'])
             wr_loop += 1
             print("Sanity Check - Within Parameter Ranges:", within_range)
         
-        with open(f"gen_config/mission_iter{iter}.yaml", "w", encoding="utf-8") as f:
+        with open(os.path.join(self.out_dir, f"mission_iter{iter}.yaml"), "w", encoding="utf-8") as f:
             yaml.safe_dump(parsed_data, f, sort_keys=False, allow_unicode=True)
         
-        return f"gen_config/mission_iter{iter}.yaml"
+        return parsed_data
         
     
\ No newline at end of file
@@ -1,100 +1,369 @@
 import os
 import shutil
-import yaml
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from aerialist.px4.aerialist_test import AerialistTest
-from testcase import TestCase
-from seed_generator import SeedGenerator
+from decouple import config
+from aerialist.px4.aerialist_test import AerialistTest, AgentConfig
+from aerialist.px4.trajectory import Trajectory
+from testcase import AGENT, TestCase
+from seed_generator import SeedGenerator, TOP_SEED_THRESHOLD
 from gen_mutation import GenerateMutation
+from numeric_mutation import NumericMutation, HybridMutation
 from utils.helper import Helper
+from fidelity import Evaluator, FAILURE_DISTANCE
+from distance_field import DistanceField
+from sampler import ConfigSampler
+from test_store import TestStore
+from workspace import Workspace
+from budget import BudgetExhausted
+from seed_library import SEED_LIBRARY, SeedLibrary, soi_descriptor
+from flight_monitor import FLIGHT_MONITOR, EarlyAbort
+from novelty import NOVELTY, BehaviorArchive, Lineage
+from trajectory_store import TRAJECTORY_STORE_KEEP, TrajectoryStore
+from islands import Archipelago, Island, island_count
+from utils.logger import Payload
+from utils import profiler
+
+# llm | gaussian | cmaes | de | hybrid-<gaussian|cmaes|de> (LLM, numeric while the LLM is slow/rate limited)
+MUTATION_ENGINE = config("MUTATION_ENGINE", default="llm")
+# llm | sampler (random constraint-satisfying configs biased toward the SOI)
+SEED_SOURCE = config("SEED_SOURCE", default="llm")
+SOI_CACHE = config("SOI_CACHE", default=True, cast=bool)
+SOI_CACHE_DIR = config("SOI_CACHE_DIR", default="soi/cache/")
+# simulator settings that change the obstacle-free flight, part of the SOI cache key
+SOI_SETTINGS = ["AGENT", "SIMULATOR", "SPEED", "HEADLESS", "AVOIDANCE_WORLD", "AVOIDANCE_LAUNCH", "SIMULATION_TIMEOUT"]
+RESULTS_COL = ["Iteration", "distance", "time", "obs1-size", "obs1-position", "obs2-size", "obs2-position", "novelty"]
+# mutations of a chain, a chain also stops at the first config that does not fail
+CHAIN_LENGTH = 7
+
 
-if os.path.exists("temp") and os.path.isdir("temp"):
-    shutil.rmtree("temp")
-if os.path.exists("seeds") and os.path.isdir("seeds"):
-    shutil.rmtree("seeds")  
-    
 class IntelliGen():
-    def __init__(self, logger, case_study):
+    def __init__(self, logger, case_study, workspace=None):
+        """
+        workspace -> workspace.Workspace every file of the run goes to, a new one under WORKSPACE_DIR if None
+        """
         self.log = logger
-        os.makedirs("soi", exist_ok=True) 
-        os.makedirs("temp", exist_ok=True)
-        os.makedirs("gen_config", exist_ok=True)
         self.case_study = case_study
-        self.soi = self.init_soi()
-        self.seed_gen = SeedGenerator(logger, self.soi, "seeds")
-        self.mutator = GenerateMutation(logger, case_study, self.soi)
+        self.workspace = workspace if workspace is not None else Workspace.create(case_study)
+        self.log.info(f"workspace: {self.workspace.root}")
+        # parsed once, every test of the run is built on top of this template
+        self.template = AerialistTest.from_yaml(case_study)
+        with profiler.stage("soi"):
+            self.soi = self.init_soi()
+        soi_xy = self.load_soi_path()
+        # SOI and every simulated flight as float arrays, process pool workers attach by name
+        self.trajectories = TrajectoryStore.create(self.workspace.trajectories)
+        self.trajectories.add(soi_xy, key="soi")
+        self.distance_field = DistanceField(soi_xy)
+        self.soi_descriptor = soi_descriptor(soi_xy)
+        self.library = SeedLibrary(logger) if SEED_LIBRARY else None
+        warm_seeds = self.library.query(self.soi_descriptor) if self.library is not None else []
+        self.evaluator = Evaluator(
+            logger, self.template, report_path=self.workspace.fidelity, latency_log=self.workspace.sim_latency
+        )
+        if FLIGHT_MONITOR and AGENT != AgentConfig.DOCKER:
+            self.log.warning(f"FLIGHT_MONITOR is only supported by the docker agent, {AGENT} runs are not monitored")
+        elif FLIGHT_MONITOR:
+            self.evaluator.early_abort = EarlyAbort(self.distance_field.path, self.workspace.partial)
+        # behaviours (flights) of the run, mutation chains repeating them are cut short
+        self.archive = BehaviorArchive() if NOVELTY else None
+        self.stagnant = set()
+        # iteration counter, results.csv and retained tests are shared by the concurrent lineages
+        self.iteration = 0
+        self.lock = threading.Lock()
+        self.archipelago = None
+        sampler = ConfigSampler(path=self.distance_field.path) if SEED_SOURCE == "sampler" else None
+        self.seed_gen = SeedGenerator(
+            logger,
+            self.soi,
+            self.workspace.seeds,
+            evaluator=self.evaluator,
+            sampler=sampler,
+            field=self.distance_field,
+            token_log=self.workspace.tokens,
+            warm_seeds=warm_seeds,
+            archive=self.archive,
+            trajectories=self.trajectories,
+        )
+        self.mutator = self.init_mutator()
+
+    def init_mutator(self, results_path=None):
+        """
+        results_path -> fitness history the LLM mutation prompts are built from, the run's results.csv if None
+        """
+        if MUTATION_ENGINE == "llm":
+            return GenerateMutation(self.log, self.case_study, self.soi, workspace=self.workspace, results_path=results_path)
+        if MUTATION_ENGINE.startswith("hybrid"):
+            method = MUTATION_ENGINE.split("-", 1)[1] if "-" in MUTATION_ENGINE else "gaussian"
+            return HybridMutation(
+                self.log,
+                GenerateMutation(self.log, self.case_study, self.soi, workspace=self.workspace, results_path=results_path),
+                NumericMutation(self.log, method, field=self.distance_field, out_dir=self.workspace.gen_config),
+            )
+        return NumericMutation(
+            self.log, MUTATION_ENGINE, field=self.distance_field, out_dir=self.workspace.gen_config
+        )
     
     def init_soi(self):
         """
-        Will init the SOI path of the flight
+        Will init the SOI path of the flight, reusing the cached baseline of
+        the same mission and simulator settings when available
         """
+        soi_dir = self.workspace.soi
+        cache_dir = os.path.join(SOI_CACHE_DIR, self.get_soi_key())
+        if SOI_CACHE and os.path.isfile(os.path.join(cache_dir, "soi.txt")):
+            self.log.info(f"SOI cache hit, skipping the baseline simulation: {cache_dir}")
+            Helper.copy_file(os.path.join(cache_dir, "soi.ulg"), soi_dir, "soi")
+            Helper.copy_file(os.path.join(cache_dir, "soi.png"), soi_dir, "soi")
+            with open(os.path.join(cache_dir, "soi.txt"), 'r', encoding='utf-8') as sf:
+                soi = sf.read()
+            self.log.info("co-ordinates of the SOI: %s", Payload(soi, self.log))
+            return soi
+
         test = TestCase(
-            AerialistTest.from_yaml(self.case_study),
-            Helper.to_px4_obstacles([])  # will be empty
+            self.template,
+            Helper.to_px4_obstacles([]),  # will be empty
+            latency_log=self.workspace.sim_latency,
         )
         _ , path = test.execute()
         self.log.info(f"SOI_path:{path}")
-        Helper.copy_file(path, "soi", "soi")
+        Helper.copy_file(path, soi_dir, "soi")
         img_path = test.plot()
         self.log.info(f"SOI image stored at following path: {img_path}")
-        soi = Helper.read_ulg("soi/soi.ulg", 30)
-        self.log.info(f"co-ordinates of the SOI: {img_path}")
+        soi, _ = test.load_log_summary()
+        self.log.info("co-ordinates of the SOI: %s", Payload(soi, self.log))
+        if SOI_CACHE:
+            self.store_soi_cache(cache_dir, path, img_path, soi)
         return soi
 
-    def run(self, budget):
-        iteration = 0
-        seed_iter = 0
-        test_dir = set()
-        test_cases = []
-        col = ["Iteration", "distance", "time", "obs1-size", "obs1-position", "obs2-size", "obs2-position"]
-
-        # Generate the seeds
-        seeds_yaml, seeds_df, uti_budget = self.seed_gen.get_seeds(self.case_study, test_cases)
-        
-        # run Simulation
-        while (iteration <= (budget -uti_budget)):
-            sel_yaml = seeds_yaml[seed_iter]
-            print(f"Selected Seed: {sel_yaml}")
-            self.log.info(f"Selected Seed: {sel_yaml}")
-            row = seeds_df[seeds_df["yaml_path"].str.strip() == sel_yaml]
-            Helper.copy_file(row["yaml_path"].iloc[0], "temp", "mission")
-            Helper.copy_file(row["ulg_path"].iloc[0], "temp", "trajectory")
-            Helper.write_csv(col, [iteration, row["distance"].iloc[0], row["time"].iloc[0], row["obs1-size"].iloc[0], row["obs1-position"].iloc[0], row["obs2-size"].iloc[0], row["obs2-position"].iloc[0]],f"results.csv")
-            iteration +=1
-            for i in range(7):
-                test_path = self.mutator.generate_mutated_obstacles_config(
-                    "temp/trajectory.ulg",
-                    "temp/mission.yaml",
-                    test_dir,
-                    iter=iteration,
+    def store_soi_cache(self, cache_dir, ulg_path, img_path, soi):
+        """
+        The cache is shared by every run of the host: the entry is written to a private
+        folder first and renamed into place, the first run to finish wins.
+        """
+        staging = f"{os.path.normpath(cache_dir)}.{os.getpid()}.tmp"
+        Helper.copy_file(ulg_path, staging, "soi")
+        Helper.copy_file(img_path, staging, "soi")
+        with open(os.path.join(staging, "soi.txt"), 'w', encoding='utf-8') as sf:
+            sf.write(soi)
+        try:
+            os.rename(staging, cache_dir)
+            self.log.info(f"SOI baseline cached at: {cache_dir}")
+        except OSError:
+            # another run cached the same baseline meanwhile
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def load_soi_path(self):
+        """SOI as (x, y) points in the obstacle frame, from the stored SOI flight log."""
+        positions = Trajectory.extract_from_log(os.path.join(self.workspace.soi, "soi.ulg")).positions
+        return [[p.x, p.y] for p in positions]
+
+    def remember(self, obstacles, distance):
+        """Failures go to the seed library, to warm start the next missions with a similar SOI."""
+        if self.library is not None and distance < FAILURE_DISTANCE:
+            self.library.add(self.soi_descriptor, Helper.get_x_limit(self.soi), obstacles, distance, self.case_study)
+
+    def get_soi_key(self):
+        settings = {name: config(name, default="") for name in SOI_SETTINGS}
+        return Helper.get_mission_hash(self.case_study, settings)
+
+    def next_iteration(self, budget=None):
+        """Reserve the next iteration, None once budget (if given) is used."""
+        with self.lock:
+            if budget is not None and not self.budget_left(budget):
+                return None
+            iteration = self.iteration
+            self.iteration += 1
+            return iteration
+
+    def budget_left(self, budget):
+        # every simulation counts, the full fidelity re-runs of screened configs included
+        return self.iteration + self.evaluator.extra_runs <= (budget - self.seed_gen.seeds_reserved())
+
+    def write_result(self, row, *paths):
+        with self.lock:
+            for path in (self.workspace.results,) + paths:
+                Helper.write_csv(RESULTS_COL, row, path)
+
+    def seed_row(self, seed):
+        return [seed["distance"], seed["time"], seed["obs1-size"], seed["obs1-position"], seed["obs2-size"], seed["obs2-position"], seed.get("novelty")]
+
+    def mutation_step(self, mutator, flight_trajectory, obstacles, test_dir, test_cases, results=(), budget=None):
+        """
+        Mutate obstacles, simulate the mutated config and record it (results.csv and the extra
+        results files, trajectory store, behaviour archive, retained tests).
+        Returns (obstacles, flight_trajectory, distance, novelty, row) of the mutated config,
+        None when budget is used.
+        """
+        iteration = self.next_iteration(budget)
+        if iteration is None:
+            return None
+        mutated = mutator.generate_mutated_obstacles_config(
+            flight_trajectory,
+            obstacles,
+            test_dir,
+            iter=iteration,
+        )
+        obstacles = mutated["obstacles"]
+        test = self.evaluator.evaluate(Helper.to_px4_obstacles(obstacles))
+        flight_trajectory, flight_time = test.load_log_summary()
+        distance = min(test.get_distances())
+        img_path = test.plot()
+        self.log.info(f"Trajectory of Mutated Config stored at following path: {img_path}")
+        mutator.tell(obstacles, distance)
+        self.trajectories.add_trajectory(test.trajectory, key=f"iter{iteration}")
+        novelty = round(self.archive.add(test.trajectory), 2) if self.archive is not None else None
+        val = Helper.get_obstacles_info(obstacles)
+        if distance and test.full_fidelity:
+            with self.lock:
+                test_cases.append(test)
+            self.remember(obstacles, distance)
+        row = [iteration, distance, flight_time, val['obs1_size'], val['obs1_position'], val['obs2_size'], val['obs2_position'], novelty]
+        self.write_result(row, *results)
+        return obstacles, flight_trajectory, distance, novelty, row
+
+    def mutate_seed(self, seed, test_dir, test_cases, budget=None):
+        """
+        Mutation chain of one seed (a seeds_info.csv record), cut short once budget is used.
+        """
+        print(f"Selected Seed: {seed['yaml_path']}")
+        self.log.info(f"Selected Seed: {seed['yaml_path']}")
+        obstacles = Helper.load_obstacles(seed["yaml_path"])
+        flight_trajectory = Helper.read_ulg(seed["ulg_path"], 30)
+        self.write_result([self.next_iteration()] + self.seed_row(seed))
+        lineage = Lineage()
+        for i in range(CHAIN_LENGTH):
+            step = self.mutation_step(self.mutator, flight_trajectory, obstacles, test_dir, test_cases, budget=budget)
+            if step is None:
+                break
+            obstacles, flight_trajectory, distance, novelty, _ = step
+            if distance > 1.5:
+                break
+            if novelty is not None and lineage.tell(novelty):
+                self.log.info(f"lineage of {seed['yaml_path']} stagnates: {lineage.repeats} flights repeating known behaviours")
+                self.stagnant.add(seed["yaml_path"])
+                break
+
+    def init_island(self, index, seed):
+        """Island of a top seed, its results file starts with the seed."""
+        results = self.workspace.island_results(index)
+        mutator = self.init_mutator(results_path=results)
+        obstacles = Helper.load_obstacles(seed["yaml_path"])
+        mutator.tell(obstacles, seed["distance"])
+        row = [self.next_iteration()] + self.seed_row(seed)
+        self.write_result(row, results)
+        return Island(index, seed, mutator, results, obstacles, Helper.read_ulg(seed["ulg_path"], 30), row)
+
+    def evolve_island(self, island, budget, test_dir, test_cases):
+        """
+        Mutation chains of one island until the shared budget is used or the lineage
+        stagnates. Every chain starts from the best config the island knows, a migrant
+        arriving mid-chain becomes the parent of the next mutation.
+        """
+        self.log.info(f"{island.name}: lineage of {island.seed['yaml_path']}")
+        while self.budget_left(budget):
+            obstacles, flight_trajectory = island.best["obstacles"], island.best["flight_trajectory"]
+            for i in range(CHAIN_LENGTH):
+                migrant = self.archipelago.receive(island)
+                if migrant is not None:
+                    self.log.info(f"{island.name}: migrant of {migrant['source']} ({migrant['distance']:.2f}m) adopted")
+                    obstacles, flight_trajectory = migrant["obstacles"], migrant["flight_trajectory"]
+                    island.mutator.tell(obstacles, migrant["distance"])
+                    with self.lock:
+                        Helper.write_csv(RESULTS_COL, migrant["row"], island.results)
+                step = self.mutation_step(
+                    island.mutator, flight_trajectory, obstacles, test_dir, test_cases, (island.results,), budget
                 )
-                Helper.copy_file(test_path, "temp", "mission") 
-                with open(test_path, 'r', encoding='utf-8') as bs:
-                    base_data = yaml.safe_load(bs)
-                obstacles = base_data["obstacles"]
-                test = TestCase(AerialistTest.from_yaml(self.case_study), Helper.to_px4_obstacles(obstacles))
-                _, ulg_path = test.execute()
-                Helper.copy_file(ulg_path, "temp", "trajectory")
-                distances = test.get_distances()
-                img_path = test.plot()
-                self.log.info(f"Trajectory of Mutated Config stored at following path: {img_path}")
-                val = Helper.get_config_info(test_path)
-                if min(distances):
-                    test_cases.append(test)
-                Helper.write_csv(col, [iteration, min(distances), Helper.get_flight_time(ulg_path), val['obs1_size'], val['obs1_position'],val['obs2_size'], val['obs2_position']],f"results.csv")
-                iteration +=1
-                if min(distances) > 1.5:
+                if step is None:
+                    return
+                obstacles, flight_trajectory, distance, novelty, row = step
+                island.tell(obstacles, flight_trajectory, distance, row)
+                self.archipelago.publish(island)
+                if distance > 1.5:
+                    break
+                if novelty is not None and island.lineage.tell(novelty):
+                    self.log.info(f"{island.name} stagnates: {island.lineage.repeats} flights repeating known behaviours")
+                    self.stagnant.add(island.seed["yaml_path"])
+                    if self.archipelago.leave(island):
+                        return
                     break
-            
-            seed_iter +=1
-            if seed_iter == 6:
-                seed_iter = 0
 
+    def evolve_islands(self, top_seeds, budget, test_dir, test_cases):
+        """One island per top seed, evolved concurrently (see islands.Archipelago)."""
+        islands = [self.init_island(i, seed) for i, seed in enumerate(top_seeds)]
+        self.archipelago = Archipelago(islands)
+        with ThreadPoolExecutor(max_workers=len(islands), thread_name_prefix="island") as executor:
+            futures = [
+                executor.submit(self.evolve_island, island, budget, test_dir, test_cases) for island in islands
+            ]
+            # the first error (BudgetExhausted included) ends the run once every island stopped
+            errors = [f.exception() for f in futures]
+        self.log.info(f"islands: {self.archipelago.report()}")
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def run(self, budget, gate=None):
+        """
+        gate -> budget.MissionBudget when the mission is part of a batch, the run then ends
+                as soon as the batch budget refuses a simulation (budget is only an upper bound)
+        """
+        test_cases = TestStore(self.workspace.retained)
+        self.evaluator.gate = gate
+        try:
+            self.search(budget, test_cases)
+        except BudgetExhausted:
+            self.log.info(f"batch budget used, stopping with {len(test_cases)} test cases")
+        finally:
+            if gate is not None:
+                gate.finish()
+            self.close()
         return test_cases
 
-from utils.logger import LoggerManager
-logger = LoggerManager(name='UAV Generator',log_dir='logs', level='INFO').get_logger()
+    def close(self):
+        """End of the run: the trajectory store goes away unless TRAJECTORY_STORE_KEEP."""
+        self.trajectories.close(unlink=not TRAJECTORY_STORE_KEEP)
+
+    def search(self, budget, test_cases):
+        test_dir = set()
+        top_seeds = []
+
+        # Seeds are simulated as soon as they validate, promising ones are mutated right away
+        # while the remaining seeds are still being generated/repaired by the LLM
+        for seed in self.seed_gen.stream_seeds(self.template, test_cases):
+            obstacles = Helper.load_obstacles(seed["yaml_path"])
+            self.mutator.tell(obstacles, seed["distance"])
+            self.remember(obstacles, seed["distance"])
+            if seed["distance"] >= TOP_SEED_THRESHOLD:
+                continue
+            top_seeds.append(seed)
+            if self.budget_left(budget):
+                with profiler.stage("mutation"):
+                    self.mutate_seed(seed, test_dir, test_cases, budget)
+
+        # Then evolve the best seeds until the budget is used
+        top_seeds = sorted(top_seeds, key=lambda seed: seed["distance"])[:6]
+        islands = island_count(len(top_seeds))
+        if islands > 1 and self.budget_left(budget):
+            with profiler.stage("mutation"):
+                self.evolve_islands(top_seeds[:islands], budget, test_dir, test_cases)
+            return
+
+        seed_iter = 0
+        while top_seeds and self.budget_left(budget):
+            seed = top_seeds[seed_iter]
+            with profiler.stage("mutation"):
+                self.mutate_seed(seed, test_dir, test_cases, budget)
+            if seed["yaml_path"] in self.stagnant and len(top_seeds) > 1:
+                # the budget of a stagnating lineage goes to the ones still finding new behaviours
+                top_seeds.pop(seed_iter)
+                seed_iter %= len(top_seeds)
+            else:
+                seed_iter = (seed_iter + 1) % len(top_seeds)
 
 if __name__ == "__main__":
-    gen = IntelliGen(logger, "case_studies/mission2.yaml", 65)
-    gen.run()
\ No newline at end of file
+    from utils.logger import LoggerManager
+    logger = LoggerManager(name='UAV Generator',log_dir='logs', level='INFO').get_logger()
+    gen = IntelliGen(logger, "case_studies/mission2.yaml")
+    gen.run(65)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import threading
+from decouple import config
+from sim_pool import SIM_POOL_SIZE
+from novelty import Lineage
+
+# concurrent mutation lineages, 0: one per pooled simulator (SIM_POOL_SIZE), 1: one lineage at a time
+ISLANDS = config("ISLANDS", default=0, cast=int)
+# mutations of an island between two migrations of its best config to the next island
+MIGRATION_INTERVAL = config("MIGRATION_INTERVAL", default=3, cast=int)
+
+
+def island_count(seeds, islands=ISLANDS):
+    """Lineages evolved concurrently for seeds top seeds."""
+    workers = islands if islands > 0 else max(1, SIM_POOL_SIZE)
+    return max(1, min(workers, seeds))
+
+
+class Island:
+    """
+    Mutation lineage of one top seed. Its parent config, mutator (fitness history) and
+    results file (the best/worst cases of the LLM mutation prompt) belong to it alone.
+    """
+
+    def __init__(self, index, seed, mutator, results, obstacles, flight_trajectory, row):
+        """
+        row -> results.csv row of the seed, kept with the best config to be handed to migrations
+        """
+        self.index = index
+        self.seed = seed
+        self.mutator = mutator
+        self.results = results
+        self.lineage = Lineage()
+        self.best = {"obstacles": obstacles, "flight_trajectory": flight_trajectory, "distance": seed["distance"], "row": row}
+        self.steps = 0
+        self.immigrants = 0
+        self.inbox = None
+
+    @property
+    def name(self):
+        return f"island{self.index}"
+
+    def tell(self, obstacles, flight_trajectory, distance, row):
+        """A mutation of the lineage was simulated, returns True when it is the best config of the island."""
+        self.steps += 1
+        if distance < self.best["distance"]:
+            self.best = {"obstacles": obstacles, "flight_trajectory": flight_trajectory, "distance": distance, "row": row}
+            return True
+        return False
+
+
+class Archipelago:
+    """
+    Islands on a ring: every interval mutations, an island sends its best config to the
+    next island, which adopts it as its parent when it beats its own best. Islands that
+    stagnate leave (their budget goes to the others), the last one never does.
+    """
+
+    def __init__(self, islands, interval=MIGRATION_INTERVAL):
+        self.islands = islands
+        self.interval = interval
+        self.active = set(range(len(islands)))
+        self.migrations = 0
+        self.lock = threading.Lock()
+
+    def publish(self, island):
+        if self.interval <= 0 or island.steps % self.interval or len(self.active) < 2:
+            return
+        with self.lock:
+            ring = sorted(self.active)
+            target = self.islands[ring[(ring.index(island.index) + 1) % len(ring)]] if island.index in ring else None
+            if target is None or target is island or island.best["distance"] >= target.best["distance"]:
+                return
+            target.inbox = dict(island.best, source=island.name)
+            self.migrations += 1
+
+    def receive(self, island):
+        """Migrant waiting for the island (adopted as its best config), None if there is none."""
+        with self.lock:
+            migrant, island.inbox = island.inbox, None
+        if migrant is None or migrant["distance"] >= island.best["distance"]:
+            return None
+        island.immigrants += 1
+        island.best = {key: migrant[key] for key in island.best}
+        return migrant
+
+    def leave(self, island):
+        """A stagnant island stops unless it is the last one left, returns True if it left."""
+        with self.lock:
+            if len(self.active) < 2:
+                return False
+            self.active.discard(island.index)
+            return True
+
+    def report(self):
+        with self.lock:
+            return {
+                "islands": len(self.islands),
+                "migrations": self.migrations,
+                **{
+                    island.name: {
+                        "seed": island.seed["yaml_path"],
+                        "steps": island.steps,
+                        "immigrants": island.immigrants,
+                        "best_distance": island.best["distance"],
+                        "active": island.index in self.active,
+                    }
+                    for island in self.islands
+                },
+            }
@@ -0,0 +1,85 @@
+import threading
+import numpy as np
+from decouple import config
+from seed_library import soi_descriptor
+
+NOVELTY = config("NOVELTY", default=True, cast=bool)
+# behaviours (flights) the novelty of a new flight is averaged over
+NOVELTY_K = config("NOVELTY_K", default=3, cast=int)
+# novelty (mean point distance, m) under which a flight repeats a known behaviour
+NOVELTY_THRESHOLD = config("NOVELTY_THRESHOLD", default=1.0, cast=float)
+# repeated behaviours in a row after which a mutation chain is stopped
+NOVELTY_PATIENCE = config("NOVELTY_PATIENCE", default=2, cast=int)
+# behaviour descriptor: the XY flight path resampled to this many points by arc length
+BEHAVIOR_POINTS = 32
+
+
+def behavior_descriptor(trajectory, points=BEHAVIOR_POINTS):
+    """(points, 2) descriptor of an aerialist Trajectory, same resampling as the SOI descriptor."""
+    xy = [[p.x, p.y] for p in trajectory.positions]
+    if len(xy) < 2:
+        xy = (xy or [[0.0, 0.0]]) * 2
+    return soi_descriptor(xy, points)
+
+
+class BehaviorArchive:
+    """
+    Descriptors of every flight of the run, in one preallocated (capacity, points, 2) array
+    grown by doubling, so a nearest neighbour query is a single vectorised pass.
+
+    The novelty of a flight is the mean distance (mean point distance of the descriptors)
+    to its k nearest archived flights: a config whose flight lands close to known ones
+    costs a simulation without exploring a new avoidance behaviour.
+    """
+
+    def __init__(self, k=NOVELTY_K, points=BEHAVIOR_POINTS, capacity=256):
+        self.k = k
+        self.points = points
+        self.descriptors = np.empty((capacity, points, 2), dtype=np.float32)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def novelty(self, descriptor):
+        with self.lock:
+            return self._novelty(descriptor)
+
+    def _novelty(self, descriptor):
+        """inf for the first flight of the run."""
+        if self.size == 0:
+            return float("inf")
+        d = np.linalg.norm(self.descriptors[:self.size] - descriptor, axis=2).mean(axis=1)
+        k = min(self.k, len(d))
+        return float(np.partition(d, k - 1)[:k].mean())
+
+    def add(self, trajectory):
+        """Archive the flight, returns its novelty with respect to the flights before it."""
+        descriptor = behavior_descriptor(trajectory, self.points)
+        with self.lock:
+            novelty = self._novelty(descriptor)
+            if self.size == len(self.descriptors):
+                grown = np.empty((2 * len(self.descriptors), self.points, 2), dtype=np.float32)
+                grown[:self.size] = self.descriptors[:self.size]
+                self.descriptors = grown
+            self.descriptors[self.size] = descriptor
+            self.size += 1
+        return novelty
+
+
+class Lineage:
+    """Novelty history of one mutation chain, stagnant after patience repeated behaviours in a row."""
+
+    def __init__(self, threshold=NOVELTY_THRESHOLD, patience=NOVELTY_PATIENCE):
+        self.threshold = threshold
+        self.patience = patience
+        self.repeats = 0
+
+    def tell(self, novelty):
+        self.repeats = self.repeats + 1 if novelty < self.threshold else 0
+        return self.stagnant
+
+    @property
+    def stagnant(self):
+        return self.repeats >= self.patience
@@ -0,0 +1,273 @@
+import os
+import time
+import numpy as np
+import yaml
+from decouple import config
+from constraints import RANGES
+from test_validator import TestValidator
+from utils.helper import Helper
+
+# per obstacle parameter vector, z is always 0 (placed on the ground)
+PARAMS = ["x", "y", "l", "w", "h", "r"]
+# check_based_and_min_height requires h > 10
+MIN_HEIGHT_MARGIN = 0.5
+LLM_SLOW_SECONDS = config("LLM_SLOW_SECONDS", default=60, cast=float)
+HYBRID_COOLDOWN = config("HYBRID_COOLDOWN", default=3, cast=int)
+FIELD_CANDIDATES = config("FIELD_CANDIDATES", default=32, cast=int)
+
+
+def obstacles_to_vector(obstacles):
+    return np.array(
+        [
+            float(obs["position"][p]) if p in ("x", "y", "r") else float(obs["size"][p])
+            for obs in obstacles
+            for p in PARAMS
+        ]
+    )
+
+
+def vector_to_obstacles(vector):
+    obstacles = []
+    for x, y, l, w, h, r in np.round(np.asarray(vector).reshape(-1, len(PARAMS)), 1).tolist():
+        obstacles.append({
+            "size": {"l": l, "w": w, "h": h},
+            "position": {"x": x, "y": y, "z": 0, "r": r},
+        })
+    return obstacles
+
+
+class _CMAES:
+    """Minimal (mu/mu_w, lambda) CMA-ES with a sequential ask/tell, minimising the fitness."""
+
+    def __init__(self, mean, sigma, rng):
+        n = len(mean)
+        self.n = n
+        self.rng = rng
+        self.mean = np.array(mean, dtype=float)
+        self.sigma = sigma
+        self.lam = 4 + int(3 * np.log(n))
+        self.mu = self.lam // 2
+        w = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = w / w.sum()
+        self.mueff = 1.0 / np.sum(self.weights ** 2)
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.C = np.eye(n)
+        self.B = np.eye(n)
+        self.D = np.ones(n)
+        self.inv_sqrt_C = np.eye(n)
+        self.generation = 0
+        self.told = []
+
+    def ask(self):
+        z = self.rng.standard_normal(self.n)
+        return self.mean + self.sigma * (self.B @ (self.D * z))
+
+    def tell(self, x, fitness):
+        self.told.append((fitness, np.asarray(x, dtype=float)))
+        if len(self.told) < self.lam:
+            return
+        self.told.sort(key=lambda t: t[0])
+        xs = np.array([x for _, x in self.told[: self.mu]])
+        old_mean = self.mean
+        self.mean = self.weights @ xs
+        y = (self.mean - old_mean) / self.sigma
+        self.generation += 1
+        self.ps = (1 - self.cs) * self.ps + np.sqrt(self.cs * (2 - self.cs) * self.mueff) * (self.inv_sqrt_C @ y)
+        ps_norm = np.linalg.norm(self.ps) / np.sqrt(1 - (1 - self.cs) ** (2 * self.generation))
+        hsig = float(ps_norm / self.chi_n < 1.4 + 2 / (self.n + 1))
+        self.pc = (1 - self.cc) * self.pc + hsig * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * y
+        steps = (xs - old_mean) / self.sigma
+        self.C = (
+            (1 - self.c1 - self.cmu) * self.C
+            + self.c1 * (np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.C)
+            + self.cmu * (steps.T * self.weights) @ steps
+        )
+        self.sigma *= np.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chi_n - 1))
+        self.sigma = float(np.clip(self.sigma, 1e-3, 1.0))
+        self.C = np.triu(self.C) + np.triu(self.C, 1).T
+        eigenvalues, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(eigenvalues, 1e-12))
+        self.inv_sqrt_C = self.B @ np.diag(1 / self.D) @ self.B.T
+        self.told = []
+
+
+class NumericMutation:
+    """
+    Local (non-LLM) mutation operators over the obstacle parameter vector, with the same
+    interface as GenerateMutation.generate_mutated_obstacles_config.
+
+    method:
+        gaussian -> perturbation of the previous/best config, step size adapted on success
+        cmaes    -> CMA-ES fed with every simulated config (tell)
+        de       -> differential evolution (rand/1/bin) over the best configs seen so far
+    Candidates are sampled in the space normalised by constraints.RANGES and rejected
+    until they are inside the test area, not overlapping and not a duplicate.
+    """
+
+    METHODS = ("gaussian", "cmaes", "de")
+
+    def __init__(self, logger, method="gaussian", max_tries=500, rng_seed=None, field=None,
+                 field_candidates=FIELD_CANDIDATES, out_dir="gen_config"):
+        """
+        out_dir -> folder of the mission_iter<N>.yaml artifacts
+        field -> optional distance_field.DistanceField, when given field_candidates valid
+                 candidates are drawn and the one blocking most of the SOI is kept
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"unknown numeric mutation method: {method}")
+        self.logger = logger
+        self.method = method
+        self.max_tries = max_tries
+        self.val = TestValidator(logger)
+        self.rng = np.random.default_rng(rng_seed)
+        self.history = []  # (normalised vector, distance)
+        self.sigma = 0.15
+        self.cma = None
+        self.field = field
+        self.field_candidates = field_candidates
+        self.out_dir = out_dir
+
+    def _bounds(self, n_obstacles):
+        low = np.array([RANGES[p][0] for p in PARAMS], dtype=float)
+        high = np.array([RANGES[p][1] for p in PARAMS], dtype=float)
+        low[PARAMS.index("h")] += MIN_HEIGHT_MARGIN
+        return np.tile(low, n_obstacles), np.tile(high, n_obstacles)
+
+    def normalise(self, vector):
+        low, high = self._bounds(len(vector) // len(PARAMS))
+        return (vector - low) / (high - low)
+
+    def denormalise(self, unit):
+        low, high = self._bounds(len(unit) // len(PARAMS))
+        return low + np.clip(unit, 0.0, 1.0) * (high - low)
+
+    def best(self):
+        return min(self.history, key=lambda h: h[1]) if self.history else None
+
+    def tell(self, obstacles, distance):
+        """Fitness feedback (min distance, lower is better) of a simulated config."""
+        unit = self.normalise(obstacles_to_vector(obstacles))
+        best = self.best()
+        if best is not None and len(unit) == len(best[0]):
+            # 1/5th success rule style step size adaptation for the gaussian operator
+            self.sigma = min(0.5, self.sigma * 1.22) if distance < best[1] else max(0.02, self.sigma * 0.95)
+        self.history.append((unit, float(distance)))
+        if self.cma is not None and len(unit) == self.cma.n:
+            self.cma.tell(unit, float(distance))
+
+    def _gaussian(self, parent, attempt):
+        best = self.best()
+        base = best[0] if best is not None and len(best[0]) == len(parent) and self.rng.random() < 0.5 else parent
+        # widen the step while candidates keep getting rejected
+        sigma = self.sigma * (1 + attempt / 50)
+        return base + self.rng.normal(0.0, sigma, size=len(base))
+
+    def _cmaes(self, parent, attempt):
+        if self.cma is None or self.cma.n != len(parent):
+            self.cma = _CMAES(parent, 0.2, self.rng)
+            for unit, distance in self.history:
+                if len(unit) == len(parent):
+                    self.cma.tell(unit, distance)
+        return self.cma.ask()
+
+    def _de(self, parent, attempt, F=0.6, CR=0.8):
+        population = sorted(
+            (h for h in self.history if len(h[0]) == len(parent)), key=lambda h: h[1]
+        )[:10]
+        if len(population) < 3:
+            return self._gaussian(parent, attempt)
+        a, b, c = self.rng.choice(len(population), size=3, replace=False)
+        mutant = population[a][0] + F * (population[b][0] - population[c][0])
+        cross = self.rng.random(len(parent)) < CR
+        cross[self.rng.integers(len(parent))] = True
+        return np.where(cross, mutant, parent)
+
+    def feasible(self, obstacles):
+        return self.val.check_within_boundary(obstacles) and not self.val.any_overlap(obstacles)
+
+    def generate_mutated_obstacles_config(self, flight_trajectory, previous_obstacles, test_dir, iter):
+        """
+        flight_trajectory is not used, kept for interface compatibility with GenerateMutation.
+        """
+        parent = self.normalise(obstacles_to_vector(previous_obstacles))
+        propose = {"gaussian": self._gaussian, "cmaes": self._cmaes, "de": self._de}[self.method]
+        start = time.perf_counter()
+        wanted = 1 if self.field is None else self.field_candidates
+        candidates, hashes = [], set()
+        for attempt in range(2 * self.max_tries):
+            if attempt < self.max_tries:
+                unit = propose(parent, attempt)
+            else:
+                # operator keeps failing (e.g. parent wedged against the boundary), sample uniformly
+                unit = self.rng.random(len(parent))
+            obstacles = vector_to_obstacles(self.denormalise(unit))
+            if not self.feasible(obstacles):
+                continue
+            test = Helper.get_hash({"obstacles": obstacles})
+            if test in test_dir or test in hashes:
+                continue
+            candidates.append((obstacles, test))
+            hashes.add(test)
+            if len(candidates) >= wanted:
+                break
+        if candidates:
+            if self.field is not None:
+                best = int(self.field.rank(self.field.to_array([c[0] for c in candidates]))[0])
+                obstacles, test = candidates[best]
+            else:
+                obstacles, test = candidates[0]
+            parsed_data = {"obstacles": obstacles}
+            test_dir.add(test)
+            self.logger.info(
+                f"Numeric mutation ({self.method}) after {attempt + 1} candidates in {(time.perf_counter() - start) * 1000:.1f} ms"
+            )
+            with open(os.path.join(self.out_dir, f"mission_iter{iter}.yaml"), "w", encoding="utf-8") as f:
+                yaml.safe_dump(parsed_data, f, sort_keys=False, allow_unicode=True)
+            return parsed_data
+        raise RuntimeError(f"numeric mutation ({self.method}) found no valid configuration")
+
+
+class HybridMutation:
+    """
+    LLM mutations (GenerateMutation), interleaved with numeric ones for the next
+    HYBRID_COOLDOWN steps whenever the LLM call was slow, rate limited or failed.
+    """
+
+    def __init__(self, logger, llm, numeric, slow_seconds=LLM_SLOW_SECONDS, cooldown=HYBRID_COOLDOWN):
+        self.logger = logger
+        self.llm = llm
+        self.numeric = numeric
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.numeric_left = 0
+
+    def tell(self, obstacles, distance):
+        self.llm.tell(obstacles, distance)
+        self.numeric.tell(obstacles, distance)
+
+    def generate_mutated_obstacles_config(self, flight_trajectory, previous_obstacles, test_dir, iter):
+        if self.numeric_left > 0:
+            self.numeric_left -= 1
+            return self.numeric.generate_mutated_obstacles_config(flight_trajectory, previous_obstacles, test_dir, iter)
+
+        scheduler = self.llm.gen.scheduler
+        rate_limited = scheduler.stats["rate_limited"]
+        start = time.perf_counter()
+        try:
+            parsed_data = self.llm.generate_mutated_obstacles_config(flight_trajectory, previous_obstacles, test_dir, iter)
+        except Exception as e:
+            self.logger.warning(f"LLM mutation failed ({e}), using numeric mutation instead")
+            self.numeric_left = self.cooldown - 1
+            return self.numeric.generate_mutated_obstacles_config(flight_trajectory, previous_obstacles, test_dir, iter)
+        elapsed = time.perf_counter() - start
+        if elapsed > self.slow_seconds or scheduler.stats["rate_limited"] > rate_limited:
+            self.logger.info(f"LLM slow or rate limited ({elapsed:.1f}s), next {self.cooldown} mutations are numeric")
+            self.numeric_left = self.cooldown
+        return parsed_data
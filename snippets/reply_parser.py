@@ -0,0 +1,348 @@
+import json
+import re
+import threading
+from functools import lru_cache
+import yaml
+from constraints import RANGES
+
+# number of obstacles of a generated configuration (results.csv / seeds_info.csv have two)
+N_OBSTACLES = 2
+
+
+class ReplyError(ValueError):
+    """LLM reply that is not JSON/YAML at all, even after the re-prompts."""
+
+
+def _number(name, exclusive_min=False):
+    low, high = RANGES[name]
+    if low == high:
+        return {"type": "number", "enum": [low]}
+    if exclusive_min:
+        # check_based_and_min_height requires h > 10
+        return {"type": "number", "exclusiveMinimum": low, "maximum": high}
+    return {"type": "number", "minimum": low, "maximum": high}
+
+
+def _object(properties):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def obstacle_schema():
+    return _object({
+        "size": _object({"l": _number("l"), "w": _number("w"), "h": _number("h", exclusive_min=True)}),
+        "position": _object({"x": _number("x"), "y": _number("y"), "z": _number("z"), "r": _number("r")}),
+    })
+
+
+@lru_cache(maxsize=None)
+def config_schema(n_obstacles=N_OBSTACLES):
+    """One obstacle configuration (mutation replies, seed YAML files), ranges from constraints.RANGES."""
+    return {
+        "title": f"obstacle_config_{n_obstacles}",
+        **_object({
+            "obstacles": {"type": "array", "items": obstacle_schema(), "minItems": n_obstacles, "maxItems": n_obstacles}
+        }),
+    }
+
+
+@lru_cache(maxsize=None)
+def seeds_schema(n_configs, n_obstacles=N_OBSTACLES):
+    """n_configs configurations (seed and seed repair replies), the root of a strict schema must be an object."""
+    config = dict(config_schema(n_obstacles))
+    config.pop("title")
+    return {
+        "title": f"seed_configs_{n_configs}x{n_obstacles}",
+        **_object({"configs": {"type": "array", "items": config, "minItems": n_configs, "maxItems": n_configs}}),
+    }
+
+
+def response_format(schema):
+    """OpenAI structured output parameter constraining the reply to schema."""
+    body = {k: v for k, v in schema.items() if k != "title"}
+    return {"type": "json_schema", "json_schema": {"name": schema["title"], "schema": body, "strict": True}}
+
+
+def _compile(schema, path="$"):
+    """Compile the JSON schema subset used above into a validation closure returning error strings."""
+    kind = schema.get("type")
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check(value, path=path):
+            return [] if value in allowed else [f"{path}: {value!r} is not one of {allowed}"]
+        return check
+
+    if kind == "number":
+        low, high = schema.get("minimum"), schema.get("maximum")
+        exclusive = schema.get("exclusiveMinimum")
+
+        def check(value, path=path):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return [f"{path}: {value!r} is not a number"]
+            if low is not None and value < low:
+                return [f"{path}: {value} < {low}"]
+            if exclusive is not None and value <= exclusive:
+                return [f"{path}: {value} <= {exclusive}"]
+            if high is not None and value > high:
+                return [f"{path}: {value} > {high}"]
+            return []
+        return check
+
+    if kind == "array":
+        item = _compile(schema["items"], path)
+        low, high = schema.get("minItems", 0), schema.get("maxItems")
+
+        def check(value, path=path):
+            if not isinstance(value, list):
+                return [f"{path}: not an array"]
+            errors = []
+            if len(value) < low or (high is not None and len(value) > high):
+                errors.append(f"{path}: {len(value)} items, expected {low}" + (f"-{high}" if high != low else ""))
+            for i, v in enumerate(value):
+                errors += item(v, f"{path}[{i}]")
+            return errors
+        return check
+
+    if kind == "object":
+        fields = {name: _compile(sub, f"{path}.{name}") for name, sub in schema["properties"].items()}
+        required = schema.get("required", [])
+
+        def check(value, path=path):
+            if not isinstance(value, dict):
+                return [f"{path}: not an object"]
+            errors = [f"{path}.{name}: missing" for name in required if name not in value]
+            for name, v in value.items():
+                if name in fields:
+                    errors += fields[name](v, f"{path}.{name}")
+            return errors
+        return check
+
+    raise ValueError(f"unsupported schema: {schema}")
+
+
+_validators = {}
+_validators_lock = threading.Lock()
+
+
+def validator(schema):
+    key = schema["title"]
+    with _validators_lock:
+        if key not in _validators:
+            _validators[key] = _compile(schema)
+        return _validators[key]
+
+
+def validate_config(obstacles, n_obstacles=N_OBSTACLES):
+    """Schema errors of an obstacle list (n_obstacles of them, ranges, z = 0, h > 10), empty when valid."""
+    return validator(config_schema(n_obstacles))({"obstacles": obstacles})
+
+
+class ParseStats:
+    """Process wide counters of the structured replies, report() gives the rates."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"replies": 0, "parse_failures": 0, "schema_violations": 0, "reprompts": 0, "early_cancels": 0}
+        # time to first obstacle of the streamed replies
+        self.first_obstacle = []
+
+    def add(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def first(self, seconds):
+        with self.lock:
+            self.first_obstacle.append(seconds)
+
+    def report(self):
+        with self.lock:
+            counts = dict(self.counts)
+            first = sorted(self.first_obstacle)
+        replies = counts["replies"] or 1
+        for name in ("parse_failures", "schema_violations", "reprompts", "early_cancels"):
+            counts[f"{name}_rate"] = round(counts[name] / replies, 3)
+        if first:
+            counts["first_obstacle_s_p50"] = round(first[len(first) // 2], 2)
+            counts["first_obstacle_s_max"] = round(first[-1], 2)
+        return counts
+
+
+PARSE_STATS = ParseStats()
+
+
+def _load(text):
+    text = text.strip()
+    try:
+        # structured output: the whole reply is the JSON document
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    # legacy replies: fenced ```json / ```yaml block or bare YAML
+    match = re.search(r"```(?:json|yaml)?(.*?)```", text, re.DOTALL)
+    body = match.group(1).strip() if match else text
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        try:
+            return yaml.safe_load(body)
+        except yaml.YAMLError as e:
+            raise ReplyError(f"reply is neither JSON nor YAML: {e}") from e
+
+
+def parse_reply(text, schema):
+    """
+    The single parse path of every LLM reply carrying obstacle configurations.
+    Returns (data, errors), data is None when the reply does not parse at all.
+    """
+    PARSE_STATS.add("replies")
+    try:
+        data = _load(text or "")
+    except ReplyError as e:
+        PARSE_STATS.add("parse_failures")
+        return None, [str(e)]
+    if isinstance(data, list) and "configs" in schema.get("properties", {}):
+        # seed replies of the legacy prompt format are a bare array of configs
+        data = {"configs": data}
+    if not isinstance(data, dict):
+        PARSE_STATS.add("parse_failures")
+        return None, [f"reply is a {type(data).__name__}, not a JSON object"]
+    errors = validator(schema)(data)
+    if errors:
+        PARSE_STATS.add("schema_violations")
+    return data, errors
+
+
+def _find_obstacles(data):
+    """Obstacle dicts of a (partial) reply in document order, wherever they are nested."""
+    if isinstance(data, dict):
+        if "size" in data and "position" in data:
+            return [data]
+        return [o for v in data.values() for o in _find_obstacles(v)]
+    if isinstance(data, list):
+        return [o for v in data for o in _find_obstacles(v)]
+    return []
+
+
+def _filled(obstacle):
+    size, position = obstacle.get("size"), obstacle.get("position")
+    return (
+        isinstance(size, dict) and isinstance(position, dict)
+        and all(k in size for k in "lwh") and all(k in position for k in "xyzr")
+    )
+
+
+class StreamParser:
+    """
+    Incremental parse of a streamed reply against schema. feed() the text deltas, every
+    obstacle is validated as soon as it is complete: closing brace of a JSON object (brace
+    scanner, strings only tracked inside objects so prose around the JSON is ignored), or
+    all its fields present in the complete lines of a YAML reply (re-parsed per new line).
+
+    complete: every obstacle of the reply arrived (the rest of the generation is noise)
+    errors:   schema violations of the obstacles received so far
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        properties = schema["properties"]
+        if "configs" in properties:
+            self.configs = properties["configs"]["minItems"]
+            self.per_config = properties["configs"]["items"]["properties"]["obstacles"]["minItems"]
+        else:
+            self.configs, self.per_config = None, properties["obstacles"]["minItems"]
+        self.expected = self.per_config * (self.configs or 1)
+        self.check = validator({"title": "obstacle", **obstacle_schema()})
+        self.text = ""
+        self.obstacles = []
+        self.errors = []
+        # JSON scanner
+        self.scanned = 0
+        self.starts = []
+        self.in_string = False
+        self.escape = False
+        self.yaml_lines = 0
+        self.json_obstacles = []
+        self.yaml_obstacles = []
+
+    @property
+    def complete(self):
+        return len(self.obstacles) >= self.expected
+
+    def feed(self, chunk):
+        """Returns the number of obstacles completed by chunk."""
+        before = len(self.obstacles)
+        self.text += chunk
+        self._scan()
+        if not self.json_obstacles:
+            # YAML reply (or JSON without a complete obstacle yet), re-parsed per complete line
+            self._yaml()
+            self.obstacles = self.yaml_obstacles
+        for i in range(before, len(self.obstacles)):
+            self.errors += self.check(self.obstacles[i], f"$.obstacles[{i}]")
+        return len(self.obstacles) - before
+
+    def _scan(self):
+        text = self.text
+        for i in range(self.scanned, len(text)):
+            c = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"' and self.starts:
+                self.in_string = True
+            elif c == "{":
+                self.starts.append(i)
+            elif c == "}" and self.starts:
+                start = self.starts.pop()
+                try:
+                    obj = json.loads(text[start:i + 1])
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(obj, dict) and "size" in obj and "position" in obj:
+                    self.json_obstacles.append(obj)
+        self.scanned = len(text)
+        if self.json_obstacles:
+            self.obstacles = self.json_obstacles
+
+    def _yaml(self):
+        lines = self.text.count("\n")
+        if lines == self.yaml_lines:
+            return
+        self.yaml_lines = lines
+        body = self.text[:self.text.rfind("\n")]
+        body = re.sub(r"^\s*```\w*\s*$", "", body, flags=re.MULTILINE)
+        try:
+            found = _find_obstacles(yaml.safe_load(body))
+        except yaml.YAMLError:
+            return
+        # an obstacle is complete once all its fields are there or the next one started
+        self.yaml_obstacles = [o for i, o in enumerate(found) if i + 1 < len(found) or _filled(o)]
+
+    def result(self):
+        """Data of a reply whose obstacles are all in (the generation may have been cancelled)."""
+        obstacles = self.obstacles[:self.expected]
+        if self.configs is None:
+            return {"obstacles": obstacles}
+        return {"configs": [
+            {"obstacles": obstacles[i:i + self.per_config]} for i in range(0, len(obstacles), self.per_config)
+        ]}
+
+    def parse(self):
+        """(data, errors) like parse_reply, from the obstacles received when the stream was cut short."""
+        if not self.complete:
+            return parse_reply(self.text, self.schema)
+        PARSE_STATS.add("replies")
+        data = self.result()
+        errors = validator(self.schema)(data)
+        if errors:
+            PARSE_STATS.add("schema_violations")
+        return data, errors
@@ -0,0 +1,125 @@
+import numpy as np
+from decouple import config
+from constraints import RANGES
+from numeric_mutation import PARAMS, vector_to_obstacles
+
+# share of obstacles centred on the SOI (the rest uniform over the test area)
+SAMPLER_CORRIDOR = config("SAMPLER_CORRIDOR", default=0.5, cast=float)
+# std (m) of the offset from the SOI point of a corridor obstacle
+SAMPLER_SPREAD = config("SAMPLER_SPREAD", default=3.0, cast=float)
+# candidates drawn per returned seed when ranking with a distance field
+SAMPLER_POOL = config("SAMPLER_POOL", default=200, cast=int)
+# check_based_and_min_height requires h > 10, configs are rounded to 0.1
+MIN_HEIGHT_STEP = 0.1
+
+
+class ConfigSampler:
+    """
+    Vectorised random generator of obstacle configurations (no LLM, no shapely).
+
+    Every returned config satisfies constraints.RANGES, lies fully inside the test area
+    (so it passes TestValidator.check_within_boundary), is placed on the ground with
+    h > 10 and has no pair of overlapping (rotated) obstacles. Sizes and rotations are
+    sampled first, positions are then drawn inside the area shrunk by the rotated
+    extents (constructive), the remaining rule (overlap, separating axis test) is
+    enforced by rejection.
+
+    Batches are arrays of shape (N, n_obstacles, 6) in numeric_mutation.PARAMS order,
+    see to_obstacles for the YAML/LLM format.
+    """
+
+    def __init__(self, n_obstacles=2, path=None, corridor=SAMPLER_CORRIDOR, spread=SAMPLER_SPREAD,
+                 rng_seed=None, x_range=(-40.0, 30.0), y_range=(10.0, 40.0)):
+        """
+        path -> optional (P, 2) SOI points (e.g. DistanceField.path), enables the corridor bias
+        """
+        self.n_obstacles = n_obstacles
+        self.path = None if path is None else np.asarray(path, dtype=float)
+        self.corridor = corridor if self.path is not None and len(self.path) else 0.0
+        self.spread = spread
+        self.rng = np.random.default_rng(rng_seed)
+        self.x_range = x_range
+        self.y_range = y_range
+        self.drawn = 0
+        self.accepted = 0
+
+    def _uniform(self, name, shape, low=None):
+        lo, hi = RANGES[name]
+        return self.rng.uniform(lo if low is None else low, hi, size=shape)
+
+    def _extents(self, l, w, r):
+        th = np.radians(r)
+        cos, sin = np.abs(np.cos(th)), np.abs(np.sin(th))
+        return l / 2 * cos + w / 2 * sin, l / 2 * sin + w / 2 * cos
+
+    def _draw(self, n):
+        shape = (n, self.n_obstacles)
+        l = np.round(self._uniform("l", shape), 1)
+        w = np.round(self._uniform("w", shape), 1)
+        h = np.round(self._uniform("h", shape, low=RANGES["h"][0] + MIN_HEIGHT_STEP), 1)
+        r = np.round(self._uniform("r", shape), 1)
+        dx, dy = self._extents(l, w, r)
+        # centre range that keeps the whole footprint inside the area, the 0.05 absorbs the rounding
+        x_lo, x_hi = self.x_range[0] + dx + 0.05, self.x_range[1] - dx - 0.05
+        y_lo, y_hi = self.y_range[0] + dy + 0.05, self.y_range[1] - dy - 0.05
+        fits = (x_lo <= x_hi) & (y_lo <= y_hi)
+
+        x = x_lo + self.rng.random(shape) * (x_hi - x_lo)
+        y = y_lo + self.rng.random(shape) * (y_hi - y_lo)
+        if self.corridor > 0:
+            on_path = self.rng.random(shape) < self.corridor
+            anchor = self.path[self.rng.integers(len(self.path), size=shape)]
+            cx = anchor[..., 0] + self.rng.normal(0.0, self.spread, size=shape)
+            cy = anchor[..., 1] + self.rng.normal(0.0, self.spread, size=shape)
+            x = np.where(on_path, np.clip(cx, x_lo, x_hi), x)
+            y = np.where(on_path, np.clip(cy, y_lo, y_hi), y)
+        batch = np.stack([np.round(x, 1), np.round(y, 1), l, w, h, r], axis=-1)
+        return batch[fits.all(axis=1)]
+
+    @staticmethod
+    def overlapping(batch):
+        """True for configs with at least one pair of overlapping footprints (touching is allowed)."""
+        n = batch.shape[1]
+        result = np.zeros(len(batch), dtype=bool)
+        th = np.radians(batch[..., 5])
+        axes = np.stack([np.stack([np.cos(th), np.sin(th)], -1), np.stack([-np.sin(th), np.cos(th)], -1)], axis=-2)
+        half = batch[..., 2:4] / 2
+        for i in range(n):
+            for j in range(i + 1, n):
+                d = batch[:, j, :2] - batch[:, i, :2]
+                separated = np.zeros(len(batch), dtype=bool)
+                for a in np.concatenate([axes[:, i], axes[:, j]], axis=1).transpose(1, 0, 2):
+                    ext_i = (half[:, i] * np.abs((axes[:, i] * a[:, None]).sum(-1))).sum(-1)
+                    ext_j = (half[:, j] * np.abs((axes[:, j] * a[:, None]).sum(-1))).sum(-1)
+                    separated |= np.abs((d * a).sum(-1)) >= ext_i + ext_j - 1e-9
+                result |= ~separated
+        return result
+
+    def sample(self, n):
+        """n valid configs, shape (n, n_obstacles, 6)."""
+        batches, found = [], 0
+        rate = 0.5
+        while found < n:
+            draw = int((n - found) / max(rate, 0.05) * 1.1) + 16
+            batch = self._draw(draw)
+            batch = batch[~self.overlapping(batch)]
+            self.drawn += draw
+            self.accepted += len(batch)
+            rate = self.accepted / self.drawn
+            batches.append(batch)
+            found += len(batch)
+        return np.concatenate(batches)[:n]
+
+    def best(self, n, field, pool=SAMPLER_POOL):
+        """
+        n configs, each the best ranked (distance_field.DistanceField.rank) of its own pool of
+        candidates, so the picks stay as diverse as independent samples.
+        """
+        batch = self.sample(n * pool).reshape(n, pool, self.n_obstacles, len(PARAMS))
+        picks = [group[field.rank(group)[0]] for group in batch]
+        return np.stack(picks)
+
+    @staticmethod
+    def to_obstacles(batch):
+        """(N, n_obstacles, 6) array -> list of obstacle lists."""
+        return [vector_to_obstacles(config) for config in batch]
@@ -1,34 +1,64 @@
-import json
 import os
+import queue
 import argparse
+import threading
 import pandas as pd
 from pathlib import Path
 from pathlib import Path
 
 import yaml
 from utils.helper import Helper
+from utils import profiler
+from utils.logger import LoggerManager
 from testcase import TestCase
 from test_validator import TestValidator
-from aerialist.px4.aerialist_test import AerialistTest
+from sampler import ConfigSampler
+from seed_library import SEED_LIBRARY_TOPK
+from reply_parser import PARSE_STATS, seeds_schema, validate_config
 from bot.prompter import Prompter
+from bot.core.scheduler import Priority
 from bot.sys_prompts.gen_seed import get_system_prompt
 
-from utils.logger import LoggerManager
-logger = LoggerManager(name='Test Seed Generater',log_dir='logs', level='INFO').get_logger()
+# seeds closer than this (m) to the obstacles are mutated further
+TOP_SEED_THRESHOLD = 1.55
+# valid seeds the streaming seed phase stops at
+SEED_TARGET = 10
 
 class SeedGenerator:
-    def __init__(self, logger, soi, output_dir):
+    def __init__(self, logger, soi, output_dir, evaluator=None, sampler=None, field=None, token_log=None,
+                 warm_seeds=None, warm_start_k=SEED_LIBRARY_TOPK, archive=None, trajectories=None):
+        """
+        evaluator -> fidelity.Evaluator running the seed simulations, plain TestCase runs if None
+        sampler   -> sampler.ConfigSampler, seeds are sampled instead of asked to the LLM
+        field     -> distance_field.DistanceField used to pick the sampled seeds
+        token_log -> token accounting CSV of the seed prompts (see Prompter)
+        warm_seeds -> obstacle lists transferred from the seed library, simulated first,
+                      the LLM/sampler seed phase is skipped when there are warm_start_k of them
+        archive   -> novelty.BehaviorArchive the seed flights are added to (record["novelty"])
+        trajectories -> trajectory_store.TrajectoryStore the seed flights are stored in (record["trajectory"])
+        """
         self.output_dir = output_dir
+        self.evaluator = evaluator
+        self.sampler = sampler
+        self.field = field
+        self.warm_seeds = warm_seeds or []
+        self.warm_start_k = warm_start_k
+        self.archive = archive
+        self.trajectories = trajectories
         self.log = logger
         self.soi = soi
         xl,xh= Helper.get_x_limit(soi)
-        self.gen = Prompter(logger, get_system_prompt(xl,xh))
+        self.gen = Prompter(logger, get_system_prompt(xl,xh), token_log=token_log)
         self.validator = TestValidator(logger)
         self.seeds_track = 0
+        self.seeds_simulated = 0
+        # seeds queued for simulation by the producer, and whether it may still queue more
+        self.seeds_queued = 0
+        self.producing = False
         os.makedirs(output_dir, exist_ok=True)
         self.col = ["yaml_path", "ulg_path", "distance", "time", "obs1-size", "obs1-position", "obs2-size", "obs2-position"]
   
-    def get_prompt(self):
+    def get_prompt(self, n=SEED_TARGET):
         prompt = f"""
         See below I will provide you the Segment of Interest, path UAV will follow to complete 
         his flight given that there are no obstacles.
@@ -42,7 +72,7 @@ class SeedGenerator:
         those obstacles. 
         
         Goal:
-            1. You are supposed to generate 10 very diversified config. Should differ from each other significantly and must be placed in the way of Segment of Interest.
+            1. You are supposed to generate {n} very diversified config. Should differ from each other significantly and must be placed in the way of Segment of Interest.
             2. No Overlapping of obstacles in each test case.
             3. Don't place obstacles directly on the top of the other obstacle in a line.
             4. Obstacle should not placed directly at the starting point of SOI, we want to give room to UAV to atleast fly.
@@ -57,77 +87,73 @@ class SeedGenerator:
         """
         return prompt
     
-    def strip_json_fence(self, text: str) -> str:
+    @staticmethod
+    def configs_of(data):
+        """Configs of a parsed seed reply that have an obstacle list, the ranges are checked by check_seed."""
+        configs = data.get("configs")
+        if not isinstance(configs, list):
+            return []
+        return [c for c in configs if isinstance(c, dict) and isinstance(c.get("obstacles"), list)]
+
+    def write_seeds(self, data):
         """
-        Remove ```json ... ``` fences from a model reply, compatible with older Python.
+        Dump each config of an LLM reply to its own seed YAML, returns the written paths.
         """
-        text = text.strip()
+        paths = []
+        for config in data:
+            path = f"{self.output_dir}/base_config_{self.seeds_track + 1}.yaml"
+            with open(path, "w", encoding="utf-8") as f:
+                yaml.safe_dump(config, f, sort_keys=False, allow_unicode=True)
+            self.seeds_track +=1
+            paths.append(path)
+        return paths
 
-        if text.startswith("```json"):
-            text = text[len("```json"):]
-        elif text.startswith("```"):
-            text = text[len("```"):]
+    def generate_seeds(self, n=SEED_TARGET):
+        self.log.info("generating base seeds..")
+        prompt = self.get_prompt(n)
+        # invalid configs are not re-asked here, check_seed sends them to repair_seeds
+        data, _ = self.gen.ask(prompt, seeds_schema(n), priority=Priority.SEED, reask_invalid=False)
+        return self.write_seeds(self.configs_of(data))
 
-        if text.endswith("```"):
-            text = text[:-3]
+    def sample_seeds(self, n=SEED_TARGET):
+        """
+        Random seeds from the sampler, every one already satisfies the constraints.
+        With a distance field each seed is the best ranked of its own candidate pool.
+        """
+        self.log.info("sampling base seeds..")
+        if self.field is not None:
+            batch = self.sampler.best(n, self.field)
+        else:
+            batch = self.sampler.sample(n)
+        return self.write_seeds({"obstacles": obstacles} for obstacles in ConfigSampler.to_obstacles(batch))
 
-        return text.strip()
+    def check_seed(self, yaml_path):
+        with open(yaml_path, 'r', encoding='utf-8') as bs:
+            base_data = yaml.safe_load(bs)
 
-    def generate_seeds(self):
-        self.log.info("generating base seeds..")
-        prompt = self.get_prompt()
-        resp = self.gen.process(prompt)
-        cleaned = self.strip_json_fence(resp["reply"])
-        data = json.loads(cleaned)
-        id =1
-        for config in data:
-            with open(f"{self.output_dir}/base_config_{id}.yaml", "w", encoding="utf-8") as f:
-                yaml.safe_dump(config, f, sort_keys=False, allow_unicode=True)
-            id +=1
+        obstacles = (base_data or {}).get("obstacles")
+        errors = validate_config(obstacles)
+        if errors:
+            # wrong obstacle count or out of the parameter ranges, told to the LLM by the repair prompt
+            return False, {"file_path": str(yaml_path), "config": str(obstacles), "errors": "; ".join(errors)}
+        ok = self.validator.check_within_boundary(obstacles)
+        val = Helper.get_obstacles_info(obstacles)
+        record = {
+            "file_path": str(yaml_path),
+            "obs1_size": val.get("obs1_size"),
+            "obs1_position": val.get("obs1_position"),
+            "obs2_size": val.get("obs2_size"),
+            "obs2_position": val.get("obs2_position"),
+        }
+        return ok, record
             
-    def verify_seed(self):
-        yaml_files = list(Path(self.output_dir).rglob("*.yaml"))
-        valid_records = []
-        invalid_records = []
-        for i, yaml_path in enumerate(yaml_files, start=1):
-            with open(yaml_path, 'r', encoding='utf-8') as bs:
-                base_data = yaml.safe_load(bs)
-
-            obstacles = base_data["obstacles"]
-            ok = self.validator.check_within_boundary(obstacles)
-            val = Helper.get_config_info(str(yaml_path))
-            record = {
-                "file_path": str(yaml_path),
-                "obs1_size": val.get("obs1_size"),
-                "obs1_position": val.get("obs1_position"),
-                "obs2_size": val.get("obs2_size"),
-                "obs2_position": val.get("obs2_position"),
-            }
-
-            if ok:
-                valid_records.append(record)
-            else:
-                invalid_records.append(record)
-
-        df_valid = pd.DataFrame(valid_records)
-        df_invalid = pd.DataFrame(invalid_records)
-
-        self.log.info(f"Valid Configurations: {len(df_valid)}")
-        self.log.info(f"Invalid Configurations:{ len(df_invalid)}")
-        self.seeds_track = len(yaml_files)
-        return df_valid, df_invalid
-
-    def get_valid_seeds(self):
-        self.generate_seeds()
-        valid_seeds, invalid_seeds = self.verify_seed()
-        while (len(valid_seeds) < 10):
-            names = invalid_seeds["file_path"].tolist()
-            self.log.info(f"invalid files = {len(names)}")
-            invalid_seeds.drop(columns=["file_path"], inplace=True)
-            prompt = f"""
+    def get_repair_prompt(self, valid_seeds, invalid_seeds):
+        invalid_seeds = invalid_seeds.drop(columns=["file_path"])
+        prompt = f"""
             We got 10 configs and out of the 10 config, {len(valid_seeds)} configs are valid and 
             {len(invalid_seeds)} are in valid, below I will provide the details of the invalid configs
-            as they were out of the defined rectangular test area (flight boundary), X ∈ [−40, 30], Y ∈ [10, 40]:
+            as they were out of the defined rectangular test area (flight boundary), X ∈ [−40, 30], Y ∈ [10, 40],
+            or outside the parameter ranges (see errors):
             {invalid_seeds.to_string(index=False)}
             
             Goal:
@@ -137,51 +163,131 @@ class SeedGenerator:
                 {valid_seeds.to_string(index=False)}
                 4. if we got x invalid config, rectify all of them and return same number of configs
             """
-            resp = self.gen.process(prompt)
-            cleaned = self.strip_json_fence(resp["reply"])
-            # Parse JSON into Python objects
-            data = json.loads(cleaned)
-            for config in data:
-                with open(f"{self.output_dir}/base_config_{self.seeds_track + 1}.yaml", "w", encoding="utf-8") as f:
-                    yaml.safe_dump(config, f, sort_keys=False, allow_unicode=True)
-                self.seeds_track +=1
-            valid_seeds, invalid_seeds = self.verify_seed()
-        
-        self.log.info("got 10 valid seeds.. lets go")
-        valid_seeds, invalid_seeds = self.verify_seed()
-        for _, row in invalid_seeds.iterrows(): 
-            Helper.del_file(row['file_path'])
-    
-    def simulate_seed(self, base_yaml_file, test_cases):
-        yaml_files = list(Path(self.output_dir).rglob("*.yaml"))
-        self.log.info(f"Found {len(yaml_files)} YAML files.\n")
-        for i, yaml_path in enumerate(yaml_files, start=1):
-            self.log.info(f"Processing file: {yaml_path}")
-            with open(yaml_path, 'r', encoding='utf-8') as bs:
-                base_data = yaml.safe_load(bs)
-
-            obstacles = base_data["obstacles"]
-            test = TestCase(AerialistTest.from_yaml(base_yaml_file), Helper.to_px4_obstacles(obstacles))
+        return prompt
+
+    def repair_seeds(self, valid_seeds, invalid_seeds):
+        names = invalid_seeds["file_path"].tolist()
+        self.log.info(f"invalid files = {len(names)}")
+        PARSE_STATS.add("reprompts")
+        data, _ = self.gen.ask(
+            self.get_repair_prompt(valid_seeds, invalid_seeds),
+            seeds_schema(len(names)),
+            priority=Priority.REPAIR,
+            reask_invalid=False,
+        )
+        return self.write_seeds(self.configs_of(data))
+
+    def produce_valid_seeds(self, valid_queue):
+        """
+        LLM side of the streaming pipeline: every config that passes check_within_boundary
+        is queued for simulation right away, while the invalid ones are sent back for repair.
+        Ends the stream with None.
+        """
+        try:
+            if self.warm_seeds:
+                self.log.info(f"warm start: {len(self.warm_seeds)} seeds from the seed library")
+                for yaml_path in self.write_seeds({"obstacles": obstacles} for obstacles in self.warm_seeds):
+                    self.seeds_queued += 1
+                    valid_queue.put(yaml_path)
+                if len(self.warm_seeds) >= self.warm_start_k:
+                    return
+            valid_records, invalid_records = [], []
+            pending = self.sample_seeds() if self.sampler is not None else self.generate_seeds()
+            while True:
+                for yaml_path in pending:
+                    ok, record = self.check_seed(yaml_path)
+                    if ok:
+                        valid_records.append(record)
+                        self.seeds_queued += 1
+                        valid_queue.put(yaml_path)
+                    else:
+                        invalid_records.append(record)
+                self.log.info(f"Valid Configurations: {len(valid_records)}")
+                self.log.info(f"Invalid Configurations:{len(invalid_records)}")
+                if len(valid_records) >= SEED_TARGET:
+                    break
+                if not invalid_records:
+                    # short reply: nothing to repair, ask for the missing seeds
+                    missing = SEED_TARGET - len(valid_records)
+                    pending = self.sample_seeds(missing) if self.sampler is not None else self.generate_seeds(missing)
+                    if not pending:
+                        self.log.warning(f"no new seeds in the reply, stopping at {len(valid_records)} valid seeds")
+                        break
+                    continue
+                pending = self.repair_seeds(pd.DataFrame(valid_records), pd.DataFrame(invalid_records))
+                for record in invalid_records:
+                    Helper.del_file(record["file_path"])
+                invalid_records = []
+            self.log.info(f"got {len(valid_records)} valid seeds..")
+        except Exception as e:
+            self.log.exception(f"seed generation stopped: {e}")
+            self.producer_error = e
+        finally:
+            self.producing = False
+            valid_queue.put(None)
+
+    def simulate_one(self, template, yaml_path, test_cases):
+        self.log.info(f"Processing file: {yaml_path}")
+        with open(yaml_path, 'r', encoding='utf-8') as bs:
+            base_data = yaml.safe_load(bs)
+
+        obstacles = base_data["obstacles"]
+        if self.evaluator is not None:
+            test = self.evaluator.evaluate(Helper.to_px4_obstacles(obstacles))
+            ulg_path = test.log_file
+        else:
+            test = TestCase(template, Helper.to_px4_obstacles(obstacles))
             _, ulg_path = test.execute()
-            self.log.info(f"Seed's ({yaml_path:}) flight logs stored at following path: {ulg_path}")
-            distances = test.get_distances()
-            print(f"minimum_distance:{min(distances)}")
-            img_path = test.plot()
-            self.log.info(f"Seed's ({yaml_path:}) image stored at following path: {img_path}")
-            if min(distances) < 1.5:
-                test_cases.append(test)
-            Helper.write_csv(self.col, [yaml_path, ulg_path, min(distances), Helper.get_flight_time(ulg_path) ,obstacles[0]["size"], obstacles[0]['position'], obstacles[1]['size'], obstacles[1]['position']],f"{self.output_dir}/seeds_info.csv")
-    
-    def get_top_seeds(self, threshold=1.55):
-        df = pd.read_csv(f"{self.output_dir}/seeds_info.csv")
-        df_sorted = df.sort_values(by='distance', ascending=True)
-        sel_conf = df_sorted[df_sorted["distance"] < threshold]
-        return sel_conf['yaml_path'].tolist(), sel_conf, len(df_sorted)
+        _, flight_time = test.load_log_summary()
+        self.log.info(f"Seed's ({yaml_path:}) flight logs stored at following path: {ulg_path}")
+        distances = test.get_distances()
+        print(f"minimum_distance:{min(distances)}")
+        img_path = test.plot()
+        self.log.info(f"Seed's ({yaml_path:}) image stored at following path: {img_path}")
+        if min(distances) < 1.5 and test.full_fidelity:
+            test_cases.append(test)
+        row = [yaml_path, ulg_path, min(distances), flight_time ,obstacles[0]["size"], obstacles[0]['position'], obstacles[1]['size'], obstacles[1]['position']]
+        Helper.write_csv(self.col, row, f"{self.output_dir}/seeds_info.csv")
+        self.seeds_simulated += 1
+        record = dict(zip(self.col, row))
+        if self.trajectories is not None:
+            record["trajectory"] = self.trajectories.add_trajectory(test.trajectory, key=yaml_path)
+        if self.archive is not None:
+            record["novelty"] = round(self.archive.add(test.trajectory), 2)
+        return record
     
-    def get_seeds(self, base_yaml_file, test_cases):
-        self.get_valid_seeds()
-        self.simulate_seed(base_yaml_file, test_cases)
-        return self.get_top_seeds()
+    def seeds_reserved(self):
+        """
+        Simulations the seed phase uses: the seeds simulated, plus the queued ones and, while
+        the producer runs, the ones still expected up to the target (they are simulated anyway).
+        """
+        expected = self.seeds_queued
+        if self.producing:
+            warm = len(self.warm_seeds)
+            expected = max(expected, warm if warm >= self.warm_start_k else warm + SEED_TARGET)
+        return max(expected, self.seeds_simulated)
+
+    def stream_seeds(self, template, test_cases):
+        """
+        Seed phase of the generator: yields the record (seeds_info.csv columns) of every seed
+        as soon as it is simulated. Repair prompts keep running in the background meanwhile,
+        so the caller can already mutate the good seeds before the seed set is complete.
+        """
+        valid_queue = queue.Queue()
+        self.producer_error = None
+        self.producing = True
+        producer = threading.Thread(target=self.produce_valid_seeds, args=(valid_queue,), daemon=True)
+        producer.start()
+        while True:
+            yaml_path = valid_queue.get()
+            if yaml_path is None:
+                break
+            with profiler.stage("seeds"):
+                record = self.simulate_one(template, yaml_path, test_cases)
+            yield record
+        producer.join()
+        if self.producer_error is not None and self.seeds_simulated == 0:
+            raise self.producer_error
         
         
 def main():
@@ -210,9 +316,9 @@ def main():
         parser.error(f"Trajectory not found: {args.trajectory}")
     if not args.yaml.exists():
         parser.error(f"YAML not found: {args.yaml}")
+    logger = LoggerManager(name='Test Seed Generater',log_dir='logs', level='INFO').get_logger()
     soi = Helper.read_ulg(str(args.trajectory),30)
     gen = SeedGenerator(logger, soi,"seeds")
-    # gen.get_seeds(str(args.yaml))
     gen.generate_seeds()
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from decouple import config
+from test_validator import TestValidator
+from utils.helper import Helper
+
+SEED_LIBRARY = config("SEED_LIBRARY", default=True, cast=bool)
+SEED_LIBRARY_DIR = config("SEED_LIBRARY_DIR", default="seed_library/")
+# transferred seeds a mission starts from, the LLM seed phase is skipped when that many are found
+SEED_LIBRARY_TOPK = config("SEED_LIBRARY_TOPK", default=5, cast=int)
+# mean distance (m) between two SOI descriptors for their failures to be transferred
+SEED_LIBRARY_RADIUS = config("SEED_LIBRARY_RADIUS", default=3.0, cast=float)
+# SOI descriptor: the flight path resampled to this many points by arc length
+DESCRIPTOR_POINTS = 32
+
+
+def soi_descriptor(soi_xy, points=DESCRIPTOR_POINTS):
+    """(points, 2) SOI polyline resampled at equal arc length steps."""
+    soi = np.asarray(soi_xy, dtype=float)
+    seg = np.linalg.norm(np.diff(soi, axis=0), axis=1)
+    arc = np.concatenate([[0.0], np.cumsum(seg)])
+    s = np.linspace(0.0, arc[-1], points)
+    return np.stack([np.interp(s, arc, soi[:, 0]), np.interp(s, arc, soi[:, 1])], axis=1)
+
+
+class SeedLibrary:
+    """
+    Failure-inducing obstacle configs of every past run of the host, stored with the
+    descriptor of the SOI they were found for (library.jsonl, one JSON entry per line,
+    appended so several runs can share it).
+
+    query() is a brute force nearest neighbour search over the descriptors (mean point
+    distance): the failures of the closest SOIs are translated by the offset between
+    the two SOIs and returned as warm-start seeds for a new mission.
+    """
+
+    def __init__(self, logger, root=SEED_LIBRARY_DIR):
+        self.log = logger
+        self.path = os.path.join(root, "library.jsonl")
+        self.validator = TestValidator(logger)
+        self.lock = threading.Lock()
+        self.entries = []
+        self.hashes = set()
+        self.descriptors = np.empty((0, DESCRIPTOR_POINTS, 2))
+        os.makedirs(root, exist_ok=True)
+        self.load()
+
+    def load(self):
+        entries = []
+        if os.path.isfile(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # line cut short by a run killed while appending
+                        continue
+        self.entries = entries
+        self.hashes = {e["hash"] for e in entries}
+        if entries:
+            self.descriptors = np.array([e["descriptor"] for e in entries], dtype=float)
+        self.log.info(f"seed library: {len(entries)} failures loaded from {self.path}")
+
+    def add(self, descriptor, x_limits, obstacles, distance, mission):
+        """Record a failure of the mission with SOI descriptor, duplicates are skipped."""
+        descriptor = np.round(np.asarray(descriptor, dtype=float), 2)
+        digest = Helper.get_hash({"obstacles": obstacles, "descriptor": descriptor.tolist()})
+        with self.lock:
+            if digest in self.hashes:
+                return False
+            entry = {
+                "hash": digest,
+                "mission": str(mission),
+                "time": time.time(),
+                "distance": float(distance),
+                "x_limits": list(x_limits),
+                "descriptor": descriptor.tolist(),
+                "obstacles": obstacles,
+            }
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.entries.append(entry)
+            self.hashes.add(digest)
+            self.descriptors = np.concatenate([self.descriptors, descriptor[None]])
+        return True
+
+    def transfer(self, entry, shift):
+        obstacles = []
+        for obs in entry["obstacles"]:
+            position = dict(obs["position"])
+            position["x"] = round(float(position["x"] + shift[0]), 1)
+            position["y"] = round(float(position["y"] + shift[1]), 1)
+            obstacles.append({"size": dict(obs["size"]), "position": position})
+        return obstacles
+
+    def query(self, descriptor, k=SEED_LIBRARY_TOPK, radius=SEED_LIBRARY_RADIUS):
+        """
+        Up to k distinct, in-boundary seeds (obstacle lists) transferred from the failures of
+        the SOIs within radius, closest SOI first, then lowest failure distance.
+        """
+        with self.lock:
+            if not self.entries:
+                return []
+            descriptor = np.asarray(descriptor, dtype=float)
+            soi_distance = np.linalg.norm(self.descriptors - descriptor, axis=2).mean(axis=1)
+            close = np.flatnonzero(soi_distance <= radius)
+            order = close[np.lexsort(([self.entries[i]["distance"] for i in close], soi_distance[close]))]
+            seeds, seen = [], set()
+            for i in order:
+                shift = descriptor.mean(axis=0) - self.descriptors[i].mean(axis=0)
+                obstacles = self.transfer(self.entries[i], shift)
+                digest = Helper.get_hash(obstacles)
+                if digest in seen or not self.validator.check_within_boundary(obstacles):
+                    continue
+                seen.add(digest)
+                seeds.append(obstacles)
+                if len(seeds) >= k:
+                    break
+        self.log.info(f"seed library: {len(seeds)} seeds transferred from {len(close)} failures within {radius}m")
+        return seeds
@@ -0,0 +1,214 @@
+import atexit
+import logging
+import queue
+import subprocess
+import threading
+import time
+from decouple import config
+from aerialist.px4.docker_agent import DockerAgent
+
+try:
+    from aerialist.px4.aerialist_test import AerialistTestResult
+except ImportError:  # older aerialist releases
+    from aerialist.px4.drone_test import DroneTestResult as AerialistTestResult
+
+SIM_POOL_SIZE = config("SIM_POOL_SIZE", default=0, cast=int)
+SIM_POOL_MAX_REUSE = config("SIM_POOL_MAX_REUSE", default=20, cast=int)
+SIM_POOL_ACQUIRE_TIMEOUT = config("SIM_POOL_ACQUIRE_TIMEOUT", default=1800, cast=int)
+# processes left behind by an aborted or finished test inside a container, killed and then the
+# test files removed by two separate execs: a shell running both would match the pattern itself
+RESET_KILL = "px4|gzserver|gzclient|roslaunch|rosmaster|rosout|local_planner"
+RESET_CLEAN = "rm -rf /io/*"
+
+logger = logging.getLogger(__name__)
+
+
+class PooledContainer(object):
+    def __init__(self, container_id):
+        self.container_id = container_id
+        self.uses = 0
+
+    def __repr__(self):
+        return f"{self.container_id[:12]} (uses={self.uses})"
+
+
+class PooledDockerAgent(DockerAgent):
+    """
+    DockerAgent that runs the test in an already started container
+    and leaves it alive afterwards, so the pool can reuse it.
+    """
+
+    def __init__(self, config, container_id):
+        self.config = config
+        self.results = []
+        self.container_id = container_id
+        self.docker_config = self.import_config()
+        self.docker_cmd = self.DOCKER_CMD.format(
+            id=self.container_id
+        ) + self.format_command(self.docker_config)
+
+    def process_output(self, returncode, stdout, stderr, print_logs=False):
+        # same as DockerAgent.process_output, without killing the container
+        try:
+            docker_log = stdout[stdout.find("LOG:") + 4 :].split()[0]
+            log_add = f"{self.COPY_DIR}{self.container_id[:12]}_{int(time.time() * 1000)}.ulg"
+            self.export_file(docker_log, log_add)
+            self.results.append(AerialistTestResult(log_add))
+            if print_logs:
+                if stdout:
+                    logger.debug(stdout)
+                if stderr:
+                    logger.warning(stderr)
+        except:
+            if stdout:
+                logger.info(stdout)
+            if stderr:
+                logger.error(stderr)
+
+
+class SimulatorPool(object):
+    """
+    Pool of pre-started simulator containers.
+    PX4/Gazebo receive the obstacles as launch arguments, so a test always starts its own
+    simulation; what is reused is the container. Containers are reset between tests,
+    health checked before being handed out, and replaced after max_reuse tests.
+    """
+
+    def __init__(self, size, max_reuse=SIM_POOL_MAX_REUSE, image=DockerAgent.DOCKER_IMG):
+        self.size = size
+        self.max_reuse = max_reuse
+        self.image = image
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.started = 0
+        self.retired = 0
+        self.unhealthy = 0
+        starters = [threading.Thread(target=self._replenish) for _ in range(size)]
+        for t in starters:
+            t.start()
+        for t in starters:
+            t.join()
+        logger.info(f"simulator pool ready: {self.idle.qsize()}/{size} containers")
+
+    def _start_container(self):
+        create_cmd = subprocess.run(
+            f"docker run -td {self.image}", shell=True, capture_output=True
+        )
+        if create_cmd.returncode != 0:
+            logger.error(create_cmd.stderr.decode("ascii"))
+            return None
+        with self.lock:
+            self.started += 1
+        container = PooledContainer(create_cmd.stdout.decode("ascii").strip())
+        logger.info(f"pool container started: {container}")
+        return container
+
+    def _replenish(self):
+        if self.closed:
+            return
+        container = self._start_container()
+        if container is not None:
+            self.idle.put(container)
+
+    def _kill(self, container):
+        subprocess.run(
+            f"docker rm -f {container.container_id}", shell=True, capture_output=True
+        )
+
+    def is_healthy(self, container):
+        inspect = subprocess.run(
+            f"docker inspect -f '{{{{.State.Running}}}}' {container.container_id}",
+            shell=True,
+            capture_output=True,
+        )
+        if inspect.returncode != 0 or inspect.stdout.decode("ascii").strip() != "true":
+            return False
+        probe = subprocess.run(
+            f"docker exec {container.container_id} true", shell=True, capture_output=True
+        )
+        return probe.returncode == 0
+
+    def reset(self, container):
+        """Kill the test processes and clear /io, returns False if the container could not be reset."""
+        kill = subprocess.run(
+            f"docker exec {container.container_id} pkill -9 -f '{RESET_KILL}'",
+            shell=True,
+            capture_output=True,
+        )
+        # pkill exits 1 when nothing was left running
+        if kill.returncode not in (0, 1):
+            logger.error(f"pool container {container} kill failed: {kill.stderr.decode('ascii', 'replace')}")
+            return False
+        clean = subprocess.run(
+            f'docker exec {container.container_id} bash -c "{RESET_CLEAN}"',
+            shell=True,
+            capture_output=True,
+        )
+        if clean.returncode != 0:
+            logger.error(f"pool container {container} cleanup failed: {clean.stderr.decode('ascii', 'replace')}")
+            return False
+        return True
+
+    def retire(self, container, reason):
+        logger.info(f"retiring pool container {container}: {reason}")
+        with self.lock:
+            self.retired += 1
+        self._kill(container)
+        # start the replacement in the background so it is warm for the next test
+        threading.Thread(target=self._replenish, daemon=True).start()
+
+    def acquire(self):
+        while True:
+            container = self.idle.get(timeout=SIM_POOL_ACQUIRE_TIMEOUT)
+            if self.is_healthy(container):
+                container.uses += 1
+                return container
+            with self.lock:
+                self.unhealthy += 1
+            self.retire(container, "failed health check")
+
+    def release(self, container, healthy=True):
+        if not healthy:
+            self.retire(container, "test failed")
+        elif container.uses >= self.max_reuse:
+            self.retire(container, f"reached {self.max_reuse} tests")
+        elif self.closed:
+            self._kill(container)
+        elif not self.reset(container):
+            self.retire(container, "reset failed")
+        else:
+            self.idle.put(container)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "idle": self.idle.qsize(),
+            "started": self.started,
+            "retired": self.retired,
+            "unhealthy": self.unhealthy,
+        }
+
+    def shutdown(self):
+        self.closed = True
+        while not self.idle.empty():
+            self._kill(self.idle.get_nowait())
+        logger.info(f"simulator pool closed: {self.stats()}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Shared pool of the process, None when SIM_POOL_SIZE is 0 (one container per test).
+    """
+    global _pool
+    if SIM_POOL_SIZE <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = SimulatorPool(SIM_POOL_SIZE)
+            atexit.register(_pool.shutdown)
+    return _pool
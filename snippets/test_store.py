@@ -0,0 +1,89 @@
+import os
+import shutil
+import pandas as pd
+from aerialist.px4.aerialist_test import AerialistTest
+from aerialist.px4.trajectory import Trajectory
+from utils.helper import Helper
+
+
+class TestHandle:
+    """
+    Small in-memory reference to a retained test, the test itself lives on disk.
+    """
+
+    COL = ["yaml_path", "hash", "distance", "log_file", "plot_file"]
+
+    def __init__(self, yaml_path, hash, distance, log_file, plot_file=None):
+        self.yaml_path = yaml_path
+        self.hash = hash
+        self.distance = float(distance)
+        self.log_file = log_file
+        self.plot_file = plot_file
+
+    def row(self):
+        return [self.yaml_path, self.hash, self.distance, self.log_file, self.plot_file]
+
+    def load(self):
+        """AerialistTest of the retained test, parsed from its YAML on every call."""
+        return AerialistTest.from_yaml(self.yaml_path)
+
+    def load_trajectory(self):
+        return Trajectory.extract_from_log(self.log_file)
+
+    def export(self, folder, name):
+        """Copy the test YAML, flight log and plot to folder/name.{yaml,ulg,png}."""
+        shutil.copy2(self.yaml_path, os.path.join(folder, f"{name}.yaml"))
+        shutil.copy2(self.log_file, os.path.join(folder, f"{name}.ulg"))
+        if self.plot_file:
+            shutil.copy2(self.plot_file, os.path.join(folder, f"{name}.png"))
+
+
+class TestStore:
+    """
+    List of the retained (failing) tests of a run, used in place of a list of TestCase.
+
+    append() writes the test YAML under root, records it in root/index.csv and keeps
+    only a TestHandle, so the executed TestCase (AerialistTest copy, test_results,
+    trajectory) can be garbage collected by the caller. load() rebuilds the store of a
+    previous run from its index.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index = os.path.join(root, "index.csv")
+        self.handles = []
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def load(cls, root):
+        store = cls(root)
+        if os.path.isfile(store.index):
+            df = pd.read_csv(store.index).astype(object)
+            for record in df.where(pd.notna(df), None).to_dict("records"):
+                store.handles.append(TestHandle(**record))
+        return store
+
+    def append(self, test):
+        yaml_path = os.path.join(self.root, f"test_{len(self.handles)}.yaml")
+        test.save_yaml(yaml_path)
+        with open(yaml_path, "r", encoding="utf-8") as f:
+            digest = Helper.get_hash(f.read())
+        handle = TestHandle(
+            yaml_path,
+            digest,
+            min(test.get_distances()),
+            test.log_file,
+            getattr(test, "plot_file", None),
+        )
+        Helper.write_csv(TestHandle.COL, handle.row(), self.index)
+        self.handles.append(handle)
+        return handle
+
+    def __len__(self):
+        return len(self.handles)
+
+    def __iter__(self):
+        return iter(self.handles)
+
+    def __getitem__(self, index):
+        return self.handles[index]
@@ -1,42 +1,110 @@
 import copy
 import logging
+import threading
+import time
 from typing import List
 from decouple import config
 from aerialist.px4.aerialist_test import AerialistTest, AgentConfig
 from aerialist.px4.obstacle import Obstacle
 from aerialist.px4.trajectory import Trajectory
 from aerialist.px4.plot import Plot
+from utils.helper import Helper
+from utils import profiler
 
 AGENT = config("AGENT", default=AgentConfig.DOCKER)
 if AGENT == AgentConfig.LOCAL:
     from aerialist.px4.local_agent import LocalAgent
 if AGENT == AgentConfig.DOCKER:
     from aerialist.px4.docker_agent import DockerAgent
+    from sim_pool import PooledDockerAgent, get_pool
 if AGENT == AgentConfig.K8S:
     from aerialist.px4.k8s_agent import K8sAgent
 
+SIM_LATENCY_LOG = config("SIM_LATENCY_LOG", default="logs/sim_latency.csv")
 logger = logging.getLogger(__name__)
+# tests run concurrently (islands), the header check and the write must not interleave
+_latency_lock = threading.Lock()
 
 
 class TestCase(object):
-    def __init__(self, casestudy: AerialistTest, obstacles: List[Obstacle]):
-        self.test = copy.deepcopy(casestudy)
+    def __init__(self, casestudy: AerialistTest, obstacles: List[Obstacle], speed: float = None,
+                 latency_log: str = SIM_LATENCY_LOG, early_abort=None):
+        """
+        early_abort -> flight_monitor.EarlyAbort, tail the log of local/docker runs and stop them once decided
+        """
+        self.latency_log = latency_log
+        self.early_abort = early_abort if AGENT != AgentConfig.K8S else None
+        # collision | passed when the run was stopped early, the log is then the partial one
+        self.aborted = None
+        # copy-on-write: casestudy is a shared template parsed once per run,
+        # only simulation.obstacles is overridden, everything else is shared read-only
+        self.test = copy.copy(casestudy)
+        self.test.simulation = copy.copy(casestudy.simulation)
         self.test.simulation.obstacles = obstacles
+        # screening runs override the simulation speed, they never end up in the test suite
+        self.full_fidelity = speed is None
+        if speed is not None:
+            self.test.simulation.speed = speed
+            if self.test.test is not None:
+                self.test.test = copy.copy(casestudy.test)
+                self.test.test.speed = speed
 
     def execute(self) -> Trajectory:
+        start = time.perf_counter()
+        pool = get_pool() if AGENT == AgentConfig.DOCKER else None
         if AGENT == AgentConfig.LOCAL:
             agent = LocalAgent(self.test)
         if AGENT == AgentConfig.DOCKER:
-            agent = DockerAgent(self.test)
+            if pool is not None:
+                with profiler.wait("simulator"):
+                    container = pool.acquire()
+                agent = PooledDockerAgent(self.test, container.container_id)
+            else:
+                agent = DockerAgent(self.test)
         if AGENT == AgentConfig.K8S:
             agent = K8sAgent(self.test)
+        setup_time = time.perf_counter() - start
         logger.info("running the test...")
-        self.test_results = agent.run()
-        logger.info("test finished...")
+        healthy = False
+        try:
+            with profiler.wait("simulator"):
+                monitor = None
+                if self.early_abort is not None:
+                    monitor = self.early_abort.monitor(
+                        self.test.simulation.obstacles, getattr(agent, "container_id", None), pooled=pool is not None
+                    )
+                if monitor is None:
+                    self.test_results = agent.run()
+                    healthy = len(self.test_results) > 0
+                else:
+                    self.test_results, finished = monitor.run(agent)
+                    self.aborted = monitor.outcome
+                    # an aborted container is reset by the pool, unless the agent never returned
+                    healthy = finished if self.aborted else len(self.test_results) > 0
+        finally:
+            if pool is not None:
+                pool.release(container, healthy)
+        run_time = time.perf_counter() - start - setup_time
+        logger.info(f"test finished... (setup {setup_time:.1f}s, run {run_time:.1f}s)")
+        with _latency_lock:
+            Helper.write_csv(
+                ["agent", "pooled", "setup_s", "run_s", "total_s", "outcome"],
+                [AGENT, pool is not None, round(setup_time, 3), round(run_time, 3), round(setup_time + run_time, 3),
+                 self.aborted or "completed"],
+                self.latency_log,
+            )
         self.trajectory = self.test_results[0].record
         self.log_file = self.test_results[0].log_file
         return self.trajectory, self.log_file
 
+    def load_log_summary(self, store_space=30):
+        """
+        Parse the flight log once and keep the sampled path and flight time in memory.
+        """
+        if not hasattr(self, "trajectory_text"):
+            self.trajectory_text, self.flight_time = Helper.read_ulg_summary(self.log_file, store_space)
+        return self.trajectory_text, self.flight_time
+
     def get_distances(self) -> List[float]:
         return [
             self.trajectory.min_distance_to_obstacles([obst])
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from decouple import config
+
+# keep the store files after the run (they only duplicate the flight logs)
+TRAJECTORY_STORE_KEEP = config("TRAJECTORY_STORE_KEEP", default=False, cast=bool)
+# points per segment file, a trajectory never spans two segments
+SEGMENT_POINTS = 1_000_000
+
+
+class TrajectoryStore:
+    """
+    Append-only store of the SOI and every simulated trajectory as float32 (x, y, z) arrays,
+    in memory-mapped segment files under root:
+
+        seg-<k>.f32     points of the trajectories, back to back
+        index.json      [segment, offset, length] and key of every trajectory
+
+    The run (IntelliGen) owns the only writable instance. Worker processes attach by name
+    (the root folder) and get read-only views of the shared pages, nothing is parsed,
+    pickled or copied. Points are written before the index entry is published (atomic
+    rename), so a reader never sees a partial trajectory.
+    """
+
+    def __init__(self, root, writable=False):
+        self.root = root
+        self.writable = writable
+        self.lock = threading.Lock()
+        self.maps = {}
+        self.rows = []
+        self.keys = []
+        # writer: segment being filled and the points used in it
+        self.current = None
+        self.used = 0
+        if not writable:
+            self.refresh()
+
+    @classmethod
+    def create(cls, root):
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root)
+        store = cls(root, writable=True)
+        store.publish()
+        return store
+
+    @classmethod
+    def attach(cls, name):
+        return cls(name)
+
+    @property
+    def name(self):
+        return self.root
+
+    def __len__(self):
+        return len(self.rows)
+
+    def segment_path(self, k):
+        return os.path.join(self.root, f"seg-{k}.f32")
+
+    def segment(self, k):
+        if k not in self.maps:
+            points = os.path.getsize(self.segment_path(k)) // 12
+            mode = "r+" if self.writable else "r"
+            self.maps[k] = np.memmap(self.segment_path(k), dtype=np.float32, mode=mode, shape=(points, 3))
+        return self.maps[k]
+
+    def publish(self):
+        tmp = os.path.join(self.root, f"index.json.{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "keys": self.keys}, f)
+        os.replace(tmp, os.path.join(self.root, "index.json"))
+
+    def refresh(self):
+        with open(os.path.join(self.root, "index.json"), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.rows, self.keys = index["rows"], index["keys"]
+
+    def add(self, points, key=None):
+        """Append an (n, 2) or (n, 3) trajectory, returns its id."""
+        n = len(points)
+        # a flight without positions is stored as an empty trajectory
+        points = np.asarray(points, dtype=np.float32).reshape(n, -1) if n else np.empty((0, 3), dtype=np.float32)
+        with self.lock:
+            if self.current is None or self.used + n > len(self.segment(self.current)):
+                self.current = 0 if self.current is None else self.current + 1
+                np.memmap(self.segment_path(self.current), dtype=np.float32, mode="w+", shape=(max(SEGMENT_POINTS, n, 1), 3))
+                self.used = 0
+            segment = self.segment(self.current)
+            segment[self.used:self.used + n, :points.shape[1]] = points
+            self.rows.append([self.current, self.used, n])
+            self.keys.append(None if key is None else str(key))
+            self.used += n
+            self.publish()
+            return len(self.rows) - 1
+
+    def add_trajectory(self, trajectory, key=None):
+        """aerialist Trajectory -> id."""
+        return self.add([[p.x, p.y, p.z] for p in trajectory.positions], key)
+
+    def get(self, i):
+        """Read-only (n, 3) view of trajectory i."""
+        if i >= len(self.rows) and not self.writable:
+            self.refresh()
+        k, offset, n = self.rows[i]
+        view = self.segment(k)[offset:offset + n]
+        view.flags.writeable = False
+        return view
+
+    def find(self, key):
+        """Id of the last trajectory stored under key, None if there is none."""
+        if not self.writable:
+            self.refresh()
+        for i in range(len(self.keys) - 1, -1, -1):
+            if self.keys[i] == key:
+                return i
+        return None
+
+    def close(self, unlink=False):
+        # the mappings go away with the last view still held by a caller
+        self.maps = {}
+        if unlink:
+            shutil.rmtree(self.root, ignore_errors=True)
@@ -52,6 +52,29 @@ class Helper:
         # Hash using SHA256 (or MD5 if you prefer)
         return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
     
+    @staticmethod
+    def get_mission_hash(mission_yaml, settings):
+        """
+        Hash of the mission YAML, the drone/test files it references and the simulator settings.
+        Used as the key of the SOI cache, anything that changes the obstacle-free flight must be part of it.
+        """
+        digest = hashlib.sha256()
+        with open(mission_yaml, 'rb') as mf:
+            raw = mf.read()
+        digest.update(raw)
+        data = yaml.safe_load(raw) or {}
+        referenced = [
+            (data.get("drone") or {}).get("params_file"),
+            (data.get("drone") or {}).get("mission_file"),
+            (data.get("test") or {}).get("commands_file"),
+        ]
+        for ref in referenced:
+            if ref and os.path.isfile(str(ref).strip()):
+                with open(str(ref).strip(), 'rb') as rf:
+                    digest.update(rf.read())
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
     @staticmethod
     def load_config(config_path: str) -> dict:
         """
@@ -61,23 +84,16 @@ class Helper:
             data = yaml.safe_load(yf)
 
         return str(data["obstacles"])
-    
+
     @staticmethod
-    def parse_response(raw_text: str) -> str:
+    def load_obstacles(config_path: str) -> list:
         """
-        Extracts YAML content enclosed in ```yaml ... ``` or ``` ... ```
-        and returns it as a string.
+        Load a YAML configuration file and return its obstacle list.
         """
-        pattern = r"```(?:yaml)?(.*?)```"
-        match = re.search(pattern, raw_text, re.DOTALL)
-
-        if match:
-            yaml_content = match.group(1).strip()
-        else:
-            # fallback if no markdown fences are found
-            yaml_content = raw_text.strip()
+        with open(config_path, 'r', encoding='utf-8') as yf:
+            data = yaml.safe_load(yf)
 
-        return yaml.safe_load(yaml_content)
+        return data["obstacles"]
     
     @staticmethod
     def write_yaml(base_seed, parsed_data, output_path) -> Path:
@@ -162,11 +178,15 @@ class Helper:
         with open(config_path, 'r', encoding='utf-8') as yf:
             data = yaml.safe_load(yf)
             
+        return Helper.get_obstacles_info(data['obstacles'])
+
+    @staticmethod
+    def get_obstacles_info(obstacles):
         return {
-            "obs1_size": str(data['obstacles'][0]['size']),
-            "obs1_position": str(data['obstacles'][0]['position']),
-            "obs2_size": str(data['obstacles'][1]['size']),
-            "obs2_position": str(data['obstacles'][1]['position'])
+            "obs1_size": str(obstacles[0]['size']),
+            "obs1_position": str(obstacles[0]['position']),
+            "obs2_size": str(obstacles[1]['size']),
+            "obs2_position": str(obstacles[1]['position'])
         }
     
     @staticmethod
@@ -184,9 +204,20 @@ class Helper:
     @staticmethod
     def read_ulg(log_file, store_space):
         log = pyulog.ULog(log_file)
+        return Helper.sample_positions(log, store_space)
 
-        data_list = log.data_list
+    @staticmethod
+    def read_ulg_summary(log_file, store_space):
+        """
+        Parse the ULog once and return the sampled positions (same text as read_ulg)
+        together with the flight time in seconds.
+        """
+        log = ULog(log_file)
+        duration_s = (log.last_timestamp - log.start_timestamp) / 1e6
+        return Helper.sample_positions(log, store_space), duration_s
 
+    @staticmethod
+    def sample_positions(log, store_space):
         vehicle_position_data = log.get_dataset('vehicle_local_position')
 
         previous_timestamp = None
@@ -259,12 +290,29 @@ class Helper:
                 }
             }
         }
+        if 'novelty' in df.columns:
+            # mean distance (m) of the flight to the closest flights before it
+            dict['worse_test_case']['novelty'] = max_row['novelty']
+            dict['best_test_case']['novelty'] = min_row['novelty']
         if len(df) == 1:
             number = True
         else:
             number = False
         return number, str(dict)
     
+    @staticmethod
+    def latency_summary(csv_path):
+        """
+        Per-test simulation latency (seconds) grouped by pooled / not pooled runs
+        and by outcome (completed or aborted early by the flight monitor).
+        """
+        if not os.path.isfile(csv_path):
+            return None
+        df = pd.read_csv(csv_path)
+        keys = ["pooled", "outcome"] if "outcome" in df.columns else "pooled"
+        summary = df.groupby(keys)[["setup_s", "run_s", "total_s"]].describe(percentiles=[0.5, 0.95])
+        return summary.round(2)
+
     @staticmethod
     def get_x_limit(soi):
         # Extract all X values using regex
@@ -1,6 +1,151 @@
+import atexit
+import copy
+import csv
+import gzip
+import io
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
+import threading
 from datetime import datetime
+from decouple import config
+
+LOG_MAX_BYTES = config("LOG_MAX_BYTES", default=50 * 1024 * 1024, cast=int)
+LOG_BACKUPS = config("LOG_BACKUPS", default=5, cast=int)
+LOG_COMPRESS = config("LOG_COMPRESS", default=False, cast=bool)
+LOG_PAYLOAD_CHARS = config("LOG_PAYLOAD_CHARS", default=500, cast=int)
+
+
+class Payload:
+    """
+    Wraps a large log argument (prompt, reply, SOI dump...) so it is only turned into
+    text when the record is written, and truncated unless the logger is at DEBUG.
+    """
+    def __init__(self, value, logger, limit=LOG_PAYLOAD_CHARS):
+        self.value = value
+        self.logger = logger
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.value)
+        if self.logger.isEnabledFor(logging.DEBUG) or len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... [{len(text) - self.limit} more chars]"
+
+
+class CsvRow:
+    """Log message rendered as a CSV line by the writer thread."""
+    def __init__(self, row):
+        self.row = row
+
+    def __str__(self):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(self.row)
+        return buffer.getvalue().rstrip("\r\n")
+
+
+class _RouteQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue, route):
+        super().__init__(log_queue)
+        self.route = route
+
+    def prepare(self, record):
+        # Payload arguments are formatted by the writer thread, anything else is formatted (or
+        # snapshot) here, the caller may change a mutable argument before the record is written
+        record = copy.copy(record)
+        record.route = self.route
+        if isinstance(record.args, tuple) and any(isinstance(arg, Payload) for arg in record.args):
+            record.args = tuple(
+                arg if isinstance(arg, (Payload, str, int, float, type(None))) else str(arg)
+                for arg in record.args
+            )
+        elif record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class LogPipeline:
+    """
+    Every log file of the generator is written by one background thread.
+    Loggers only put records on a queue (attach), the writer formats them
+    and hands them to the handlers registered for that logger.
+    """
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._write, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.routes.get(record.route, ()):
+                if record.levelno >= handler.level:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        handler.handleError(record)
+
+    def file_handler(self, path, level=logging.DEBUG, fmt=None, rotate=True):
+        """Size rotated file handler (gzip compressed backups with LOG_COMPRESS), opened on first write."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=LOG_MAX_BYTES if rotate else 0,
+            backupCount=LOG_BACKUPS,
+            delay=True,
+        )
+        if LOG_COMPRESS:
+            handler.namer = lambda name: name + ".gz"
+            handler.rotator = _gzip_rotator
+        handler.setLevel(level)
+        if fmt is not None:
+            handler.setFormatter(logging.Formatter(fmt))
+        return handler
+
+    def attach(self, logger, handlers, replace=False):
+        """Route the records of logger to handlers through the writer thread."""
+        route = logger.name
+        with self.lock:
+            previous = [] if replace else list(self.routes.get(route, ()))
+            self.routes[route] = previous + list(handlers)
+        if not any(isinstance(h, _RouteQueueHandler) for h in logger.handlers):
+            logger.addHandler(_RouteQueueHandler(self.queue, route))
+        return logger
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for handlers in self.routes.values():
+            for handler in handlers:
+                handler.close()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline()
+    return _pipeline
+
 
 class LoggerManager:
     def __init__(self, name='Logger', log_dir='logs', level=logging.INFO):
@@ -10,8 +155,6 @@ class LoggerManager:
         self.logger = self._setup_logger()
 
     def _setup_logger(self):
-        os.makedirs(self.log_dir, exist_ok=True)
-
         timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
         log_file = os.path.join(self.log_dir, f'{self.name}_{timestamp}.log')
 
@@ -22,13 +165,14 @@ class LoggerManager:
         if logger.hasHandlers():
             logger.handlers.clear()
 
-        # Only file handler
-        fh = logging.FileHandler(log_file)
-        fh.setLevel(self.level)
-        fh_formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(name)s | %(message)s')
-        fh.setFormatter(fh_formatter)
-
-        logger.addHandler(fh)
+        # Only file handler, written by the log pipeline thread
+        pipeline = get_pipeline()
+        fh = pipeline.file_handler(
+            log_file,
+            level=self.level,
+            fmt='%(asctime)s | %(levelname)s | %(name)s | %(message)s',
+        )
+        pipeline.attach(logger, [fh], replace=True)
 
         return logger
 
@@ -0,0 +1,172 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+class Profiler:
+    """
+    Sampling profiler for a generator run (cli.py generate --profile).
+
+    A background thread samples the stack of every thread each `interval` seconds and
+    files it under the current stage (stage()) and, for threads blocked on the LLM or
+    the simulator, under that wait (wait()). stop() writes to out_dir:
+        <stage>.folded -> collapsed stacks ("thread;frame;frame count"), for flamegraph.pl / speedscope
+        summary.txt    -> wall/CPU time, LLM and simulator wait, top-N Python hotspots
+                          (main thread samples outside of waits) and, with trace_alloc,
+                          the top-N allocation sites from tracemalloc
+    """
+
+    def __init__(self, out_dir, interval=0.005, trace_alloc=False, top=25):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.trace_alloc = trace_alloc
+        self.top = top
+        self.stages = ["main"]
+        self.waits = {}  # thread id -> wait kind
+        self.wait_time = Counter()
+        self.stage_time = Counter()
+        self.stacks = defaultdict(Counter)
+        self.main_samples = Counter()
+        self.self_hits = Counter()
+        self.total_hits = Counter()
+        self.lock = threading.Lock()
+        self.main_id = threading.main_thread().ident
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+
+    def start(self):
+        if self.trace_alloc:
+            tracemalloc.start()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.thread.start()
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        self.stages.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.pop()
+            with self.lock:
+                self.stage_time[name] += time.perf_counter() - start
+
+    @contextmanager
+    def wait(self, kind):
+        tid = threading.get_ident()
+        outer = self.waits.get(tid)
+        self.waits[tid] = kind
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if outer is None:
+                self.waits.pop(tid, None)
+            else:
+                self.waits[tid] = outer
+            if outer is None:
+                with self.lock:
+                    self.wait_time[kind] += time.perf_counter() - start
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stage = self.stages[-1]
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self._label(frame))
+                    frame = frame.f_back
+                labels.reverse()
+                kind = self.waits.get(tid)
+                root = names.get(tid, str(tid)) + (f";[{kind} wait]" if kind else "")
+                self.stacks[stage][";".join([root] + labels)] += 1
+                if tid == self.main_id:
+                    self.main_samples[kind or "python"] += 1
+                    if kind is None and labels:
+                        self.self_hits[labels[-1]] += 1
+                        for label in set(labels):
+                            self.total_hits[label] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        os.makedirs(self.out_dir, exist_ok=True)
+        for stage, stacks in self.stacks.items():
+            with open(os.path.join(self.out_dir, f"{stage}.folded"), "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        summary = self.summary(wall, cpu)
+        with open(os.path.join(self.out_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(summary)
+        return summary
+
+    def summary(self, wall, cpu):
+        samples = sum(self.main_samples.values()) or 1
+        lines = [
+            f"wall time        {wall:10.1f} s",
+            f"process CPU time {cpu:10.1f} s (all threads)",
+            f"LLM wait         {self.wait_time['llm']:10.1f} s (summed over threads)",
+            f"simulator wait   {self.wait_time['simulator']:10.1f} s (summed over threads)",
+            "",
+            "main thread samples:",
+        ]
+        for kind, count in self.main_samples.most_common():
+            lines.append(f"  {kind:<12}{count:>8}  {100 * count / samples:5.1f}%")
+        lines += ["", "stage wall time:"]
+        for stage, seconds in self.stage_time.most_common():
+            lines.append(f"  {stage:<12}{seconds:>10.1f} s")
+        python = self.main_samples["python"] or 1
+        lines += ["", f"top {self.top} Python hotspots (main thread, outside LLM/simulator wait):", "  self%  total%  function"]
+        for label, count in self.self_hits.most_common(self.top):
+            lines.append(f"  {100 * count / python:5.1f}  {100 * self.total_hits[label] / python:6.1f}  {label}")
+        if self.trace_alloc and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines += ["", f"traced memory: current {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB",
+                      f"top {self.top} allocation sites:"]
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                lines.append(f"  {stat.size / 1e3:10.1f} kB {stat.count:>8}  {stat.traceback[0]}")
+        return "\n".join(lines) + "\n"
+
+
+_active = None
+
+
+def start(out_dir, **kwargs):
+    global _active
+    _active = Profiler(out_dir, **kwargs).start()
+    return _active
+
+
+def stop():
+    global _active
+    profiler, _active = _active, None
+    return profiler.stop() if profiler is not None else None
+
+
+def stage(name):
+    """Tag the samples taken meanwhile with a run stage, no-op unless profiling."""
+    return _active.stage(name) if _active is not None else nullcontext()
+
+
+def wait(kind):
+    """Mark the calling thread as blocked on kind ("llm" or "simulator"), no-op unless profiling."""
+    return _active.wait(kind) if _active is not None else nullcontext()
@@ -0,0 +1,66 @@
+import os
+from datetime import datetime
+from pathlib import Path
+from decouple import config
+
+WORKSPACE_DIR = config("WORKSPACE_DIR", default="runs/")
+
+
+class Workspace:
+    """
+    Directory of one generator run, every file the run writes is derived from it,
+    so several runs (processes or batch missions) can share one host:
+
+        <root>/soi/            SOI flight log, plot and sampled path
+        <root>/seeds/          seed configs and seeds_info.csv
+        <root>/gen_config/     mutated configs (mission_iter<N>.yaml)
+        <root>/retained/       retained tests (TestStore)
+        <root>/logs/           process logs, token and simulation latency accounting
+        <root>/partial/        partial flight logs of the runs aborted by the flight monitor
+        <root>/trajectories/   shared trajectory store of the run (removed at the end of the run)
+        <root>/islands/        results of each concurrent mutation lineage (island<k>.csv)
+        <root>/results.csv     fitness of every simulated config
+        <root>/fidelity.csv    multi-fidelity tier pairs
+
+    Only the SOI cache (SOI_CACHE_DIR) is shared between runs on purpose.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.name = os.path.basename(os.path.normpath(self.root))
+        self.soi = os.path.join(self.root, "soi")
+        self.seeds = os.path.join(self.root, "seeds")
+        self.gen_config = os.path.join(self.root, "gen_config")
+        self.retained = os.path.join(self.root, "retained")
+        self.logs = os.path.join(self.root, "logs")
+        self.partial = os.path.join(self.root, "partial")
+        self.trajectories = os.path.join(self.root, "trajectories")
+        self.islands = os.path.join(self.root, "islands")
+        self.results = os.path.join(self.root, "results.csv")
+        self.fidelity = os.path.join(self.root, "fidelity.csv")
+        self.sim_latency = os.path.join(self.logs, "sim_latency.csv")
+        self.tokens = os.path.join(self.logs, "assistant_tokens.csv")
+        for folder in (self.soi, self.seeds, self.gen_config, self.retained, self.logs):
+            os.makedirs(folder, exist_ok=True)
+
+    @classmethod
+    def create(cls, mission, base=WORKSPACE_DIR):
+        """New, never reused, workspace named after the mission, the start time and the pid."""
+        stem = f"{Path(mission).stem}-{datetime.now().strftime('%d-%m-%H-%M-%S')}-{os.getpid()}"
+        os.makedirs(base, exist_ok=True)
+        suffix = 0
+        while True:
+            root = os.path.join(base, stem if suffix == 0 else f"{stem}-{suffix}")
+            try:
+                os.makedirs(root)
+                return cls(root)
+            except FileExistsError:
+                suffix += 1
+
+    def island_results(self, index):
+        """Fitness history of island index, the prompts of its LLM mutations are built from it."""
+        os.makedirs(self.islands, exist_ok=True)
+        return os.path.join(self.islands, f"island{index}.csv")
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)